@@ -0,0 +1,177 @@
+"""Bulk import of vendor endpoint feeds into the allow list.
+
+    python acl_import.py endpoints.json --dry-run
+    python acl_import.py feed.csv --allow-list /etc/squid/paw/allowed_paw.acl
+
+Feeds are read as a stream: a plain list (one host, URL or wildcard per
+line, # comments), CSV (a domain/url/host column, or the first column), or
+the Microsoft 365 endpoints JSON (the "urls" of every endpoint set). Each
+entry is reduced to a host, mapped to its parent-domain ACL entry the same
+way "Allow" does in the UI, deduplicated and diffed against the current
+lists. The result is committed with one apply_batch (one atomic write per
+list).
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import re
+import sys
+from functools import lru_cache
+
+import psl
+from acl_store import AclFile, AclWriteError, apply_batch
+
+FORMATS = ("auto", "list", "csv", "m365")
+CSV_COLUMNS = ("domain", "url", "urls", "host", "hostname", "fqdn")
+INVALID_SAMPLE = 20
+PREVIEW_LIMIT = 200
+
+_HOST_RE = re.compile(r"^[a-z0-9_-]+(\.[a-z0-9_-]+)+$")
+_SPLIT_RE = re.compile(r"[\s,;]+")
+
+
+def normalize(raw):
+    """Host name for one feed entry (URL, wildcard, host:port), or None."""
+    value = raw.strip().lower()
+    if "://" in value:
+        value = value.split("://", 1)[1]
+    value = value.split("/", 1)[0].split("?", 1)[0].rsplit("@", 1)[-1]
+    if value.count(":") == 1:
+        value = value.split(":", 1)[0]
+    if "*" in value:
+        # "*.blob.core.windows.net" and "autodiscover.*.onmicrosoft.com"
+        # both reduce to what follows the last wildcard.
+        value = value.rsplit("*", 1)[1]
+    value = value.strip(".")
+    if not _HOST_RE.match(value) or value.replace(".", "").isdigit():
+        return None
+    return value
+
+
+def _m365_urls(data):
+    for item in data if isinstance(data, list) else [data]:
+        if isinstance(item, dict):
+            yield from item.get("urls") or ()
+
+
+def iter_feed(lines, fmt="auto", filename=""):
+    """Yield raw entries from an iterable of text lines."""
+    lines = iter(lines)
+    head = ""
+    for head in lines:
+        if head.strip():
+            break
+    lines = itertools.chain([head], lines)
+    if fmt == "auto":
+        if head.lstrip().startswith(("[", "{")):
+            fmt = "m365"
+        elif filename.lower().endswith(".csv") or "," in head:
+            fmt = "csv"
+        else:
+            fmt = "list"
+    if fmt == "m365":
+        # The endpoints document is a single JSON value; it is small enough
+        # (a few hundred KB) to parse in one go.
+        yield from _m365_urls(json.loads("".join(lines)))
+    elif fmt == "csv":
+        column = 0
+        for i, row in enumerate(csv.reader(lines)):
+            if i == 0:
+                names = [cell.strip().lower() for cell in row]
+                header = next((names.index(n) for n in CSV_COLUMNS if n in names), None)
+                if header is not None:
+                    column = header
+                    continue
+            if len(row) > column:
+                yield from (part for part in _SPLIT_RE.split(row[column]) if part)
+    elif fmt == "list":
+        for line in lines:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                yield line
+    else:
+        raise ValueError(f"Unknown feed format: {fmt}")
+
+
+def plan_import(entries, allow_acl, hidden_acl, parent_fn):
+    """Diff a feed against the lists without writing anything."""
+    allow_trie = allow_acl.trie()
+    hidden = hidden_acl.entries()
+    wanted = set()
+    read = invalid = 0
+    invalid_sample = []
+    for raw in entries:
+        read += 1
+        host = normalize(raw)
+        if host is None:
+            invalid += 1
+            if len(invalid_sample) < INVALID_SAMPLE:
+                invalid_sample.append(raw)
+            continue
+        wanted.add(parent_fn(host))
+    add = []
+    for entry in wanted:
+        match = allow_trie.match(entry)
+        if match is None or not match.startswith("."):
+            add.append(entry)
+    return {
+        "read": read,
+        "invalid": invalid,
+        "invalid_sample": invalid_sample,
+        "unique": len(wanted),
+        "already_allowed": len(wanted) - len(add),
+        "add": sorted(add, key=lambda e: e.lstrip(".")),
+        "unhide": sorted(e for e in wanted if e in hidden),
+    }
+
+
+def commit_import(plan, allow_acl, hidden_acl, collapse=False, dropped=None):
+    """Apply a plan in one batch; returns the number of entries changed.
+
+    With collapse, entries the new wildcards cover are dropped as well and
+    listed in dropped (see apply_batch)."""
+    changes = [(allow_acl, "add", entry) for entry in plan["add"]]
+    changes += [(hidden_acl, "remove", entry) for entry in plan["unhide"]]
+    if not changes:
+        return 0
+    return apply_batch(changes, collapse=(allow_acl, hidden_acl) if collapse else (), dropped=dropped)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import a domain feed into the squid allow list")
+    parser.add_argument("feed", help="Feed file, or - for stdin")
+    parser.add_argument("--format", choices=FORMATS, default="auto")
+    parser.add_argument("--allow-list", default=os.environ.get("PAW_ALLOW_LIST_FILE", "/etc/squid/allowed_paw.acl"))
+    parser.add_argument("--hidden-list", default=os.environ.get("PAW_HIDDEN_LIST_FILE", "/etc/squid/hidden_domains.txt"))
+    parser.add_argument("--dry-run", action="store_true", help="Show the diff without writing")
+    parser.add_argument("--collapse", action="store_true",
+                        help="Also drop existing entries the imported wildcards cover")
+    args = parser.parse_args()
+
+    allow_acl, hidden_acl = AclFile(args.allow_list), AclFile(args.hidden_list)
+    stream = sys.stdin if args.feed == "-" else open(args.feed, encoding="utf-8", errors="replace")
+    with stream:
+        plan = plan_import(iter_feed(stream, args.format, args.feed), allow_acl, hidden_acl,
+                           lru_cache(maxsize=None)(psl.parent_entry))
+    print(f"{plan['read']} entries read, {plan['invalid']} invalid, {plan['unique']} unique parent domains, "
+          f"{plan['already_allowed']} already allowed, {len(plan['add'])} to add, {len(plan['unhide'])} to unhide")
+    for entry in plan["add"][:PREVIEW_LIMIT]:
+        print("+ " + entry)
+    if len(plan["add"]) > PREVIEW_LIMIT:
+        print(f"... and {len(plan['add']) - PREVIEW_LIMIT} more")
+    if args.dry_run:
+        return
+    dropped = []
+    try:
+        changed = commit_import(plan, allow_acl, hidden_acl, collapse=args.collapse, dropped=dropped)
+    except AclWriteError as e:
+        raise SystemExit(str(e))
+    for _, narrow, broad in dropped:
+        print(f"- {narrow} (covered by {broad})")
+    print(f"{changed} changes written. Reload squid (or use Restart Squid in the UI) to apply them.")
+
+
+if __name__ == "__main__":
+    main()
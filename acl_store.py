@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+from contextlib import ExitStack
+
+import metrics
+from domain_trie import DomainTrie
+
+logger = logging.getLogger(__name__)
+
+
+class AclWriteError(OSError):
+    """An ACL file could not be replaced atomically."""
+
+
+def acl_sort_key(entry):
+    return entry.lstrip('.').lower()
+
+
+class AclFile:
+    """A squid ACL/domain list file cached in memory.
+
+    The file is re-read only when its mtime or size changes, so read-only
+    pages cost a single stat() per list. Writes go through a lock and update
+    the cache in place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._signature = None
+        self._entries = set()
+        self._sorted = []
+        self._trie = None
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _reload_if_changed(self):
+        signature = self._stat_signature()
+        if signature is not None and signature == self._signature:
+            return
+        entries = set()
+        if signature is not None:
+            with open(self.path, "r") as f:
+                entries = {line.strip() for line in f if line.strip()}
+            metrics.ACL_RELOADS.inc(list=os.path.basename(self.path))
+            metrics.record("acl_reloads")
+        self._set_entries(entries)
+        self._signature = signature
+
+    def _set_entries(self, entries):
+        self._entries = entries
+        self._sorted = sorted(entries, key=acl_sort_key)
+        self._trie = None
+
+    def entries(self):
+        with self.lock:
+            self._reload_if_changed()
+            return self._entries
+
+    def sorted_entries(self):
+        with self.lock:
+            self._reload_if_changed()
+            return self._sorted
+
+    def version(self):
+        with self.lock:
+            self._reload_if_changed()
+            return self._signature
+
+    def trie(self):
+        with self.lock:
+            self._reload_if_changed()
+            if self._trie is None:
+                self._trie = DomainTrie(self._entries)
+            return self._trie
+
+    def __contains__(self, entry):
+        return entry in self.entries()
+
+    def redundant(self):
+        return self.trie().redundant()
+
+    def _write(self, entries):
+        # Write to a temp file and rename over the original so squid never
+        # sees a half-written list. That needs the list's directory to be
+        # writable by the app user (install.sh sets up /etc/squid/paw); an
+        # in-place rewrite is never used instead.
+        lines = "".join(item + "\n" for item in sorted(entries, key=acl_sort_key))
+        tmp = f"{self.path}.tmp{os.getpid()}"
+        try:
+            with open(tmp, "w") as f:
+                f.write(lines)
+            try:
+                os.chmod(tmp, os.stat(self.path).st_mode & 0o777)
+            except OSError:
+                pass
+            os.replace(tmp, self.path)
+        except OSError as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            logger.error("Could not replace %s: %s", self.path, e)
+            raise AclWriteError(
+                f"Could not update {self.path}: {e.strerror or e}. Its directory must be "
+                f"writable by the app user so the list can be replaced atomically.") from e
+        self._set_entries(entries)
+        self._signature = self._stat_signature()
+
+    def add(self, entry):
+        return apply_batch([(self, "add", entry)]) > 0
+
+    def remove(self, entry):
+        return apply_batch([(self, "remove", entry)]) > 0
+
+
+def collapse_entries(entries):
+    """Drop entries already covered by a broader wildcard entry."""
+    redundant = DomainTrie(entries).redundant()
+    for narrow, broad in redundant:
+        entries.discard(narrow)
+    return redundant
+
+
+def apply_batch(changes, collapse=(), dropped=None):
+    """Apply (acl_file, "add"|"remove", entry) changes as one transaction.
+
+    Every touched file is locked for the whole batch and rewritten at most
+    once. In files listed in collapse, entries made redundant by a wildcard
+    this batch adds are dropped too; with no changes at all (the lint
+    action) every entry covered by a broader one is. Each dropped entry is
+    appended to dropped as (acl_file, entry, covered_by) when a list is
+    given. Returns the number of entries actually added or removed.
+    """
+    files = sorted({acl for acl, _, _ in changes} | set(collapse), key=lambda acl: acl.path)
+    with ExitStack() as stack:
+        for acl in files:
+            stack.enter_context(acl.lock)
+            acl._reload_if_changed()
+        pending = {acl: set(acl._entries) for acl in files}
+        added = {acl: set() for acl in files}
+        changed = 0
+        for acl, op, entry in changes:
+            entries = pending[acl]
+            if op == "add" and entry not in entries:
+                entries.add(entry)
+                added[acl].add(entry)
+                changed += 1
+            elif op == "remove" and entry in entries:
+                entries.discard(entry)
+                added[acl].discard(entry)
+                changed += 1
+        for acl in collapse:
+            if changes:
+                # Only what this batch made redundant; an admin's existing
+                # overlaps are left for the lint action to report.
+                trie = DomainTrie(pending[acl])
+                pairs = {narrow: broad for broad in added[acl] for narrow in trie.covered(broad)}
+                for narrow in pairs:
+                    pending[acl].discard(narrow)
+                pairs = pairs.items()
+            else:
+                pairs = collapse_entries(pending[acl])
+            for narrow, broad in pairs:
+                logger.info("Dropping %s from %s: covered by %s", narrow, acl.path, broad)
+                if dropped is not None:
+                    dropped.append((acl, narrow, broad))
+                if narrow in acl._entries:
+                    changed += 1
+                else:
+                    changed -= 1
+        for acl in files:
+            if pending[acl] != acl._entries:
+                acl._write(pending[acl])
+        return changed
@@ -1,25 +1,129 @@
+import atexit
+import base64
+import cProfile
+import gzip
+import hmac
+import io
+import json
 import os
-import subprocess
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from publicsuffix2 import get_sld
-from functools import wraps
+import pstats
+import time
+import uuid
+from bisect import bisect_right
+from flask import Flask, Response, g, make_response, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import before_render_template, template_rendered
+from functools import lru_cache, wraps
 from datetime import datetime
-import mysql.connector
-import pyotp
 
+import metrics
+import psl
 from db_config import DB_CONFIG
+from db_pool import DbPool
+from fleet import Fleet, acl_payload
+from acl_store import AclFile, AclWriteError, apply_batch
+from acl_import import FORMATS as IMPORT_FORMATS, PREVIEW_LIMIT as IMPORT_PREVIEW_LIMIT
+from acl_import import commit_import, iter_feed, plan_import
+from hit_store import HitStore
+from jobs import JobRegistry
+from log_follower import LogFollower
+from log_history import HistoryCache
+from log_index import LogIndex
+from log_receiver import LogReceiver
+from log_window import WINDOWS, scan_window
+from snapshot import SnapshotBuilder, minute_bucket
+from squid_apply import ApplyQueue
+from unsorted_view import UnsortedView
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET', 'supersecretkey')
 
-SQUID_LOG_FILE = "/var/log/squid/access.log"
-ALLOW_LIST_FILE = "/etc/squid/allowed_paw.acl"
-HIDDEN_LIST_FILE = "/etc/squid/hidden_domains.txt"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get("PAW_DATA_DIR", os.path.join(BASE_DIR, "data"))
+
+# With PAW_UDP_LISTEN set squid sends its log over UDP and the spool file
+# written by the receiver stands in for access.log.
+UDP_LISTEN = os.environ.get("PAW_UDP_LISTEN")
+UDP_SPOOL_FILE = os.environ.get("PAW_UDP_SPOOL_FILE", os.path.join(DATA_DIR, "udp_access.log"))
+SQUID_LOG_FILE = UDP_SPOOL_FILE if UDP_LISTEN else os.environ.get("PAW_SQUID_LOG_FILE", "/var/log/squid/access.log")
+ALLOW_LIST_FILE = os.environ.get("PAW_ALLOW_LIST_FILE", "/etc/squid/allowed_paw.acl")
+HIDDEN_LIST_FILE = os.environ.get("PAW_HIDDEN_LIST_FILE", "/etc/squid/hidden_domains.txt")
+LOG_INDEX_STATE_FILE = os.path.join(DATA_DIR, "log_index.json")
+UNSORTED_VIEW_FILE = os.path.join(DATA_DIR, "unsorted_view.json")
+HIT_STORE_FILE = os.path.join(DATA_DIR, "hits.sqlite3")
+ACL_COLLAPSE_ON_WRITE = os.environ.get("PAW_ACL_COLLAPSE", "0") == "1"
+PARENT_DOMAIN_CACHE_SIZE = int(os.environ.get("PAW_PARENT_DOMAIN_CACHE_SIZE", 65536))
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+CLIENT_PAGE_SIZE = 200
+DB_POOL_SIZE = int(os.environ.get("PAW_DB_POOL_SIZE", 5))
+DB_POOL_WAIT_TIMEOUT = float(os.environ.get("PAW_DB_POOL_WAIT_TIMEOUT", 5.0))
+DB_POOL_PING_INTERVAL = float(os.environ.get("PAW_DB_POOL_PING_INTERVAL", 30.0))
+SNAPSHOT_INTERVAL = float(os.environ.get("PAW_SNAPSHOT_INTERVAL", 5.0))
+# Past this estimate the live log aggregate switches to fixed-memory sketches
+# (0: always exact); PAW_LOG_SKETCH=1 uses sketches from the start.
+LOG_MEMORY_BUDGET_MB = float(os.environ.get("PAW_LOG_MEMORY_BUDGET_MB", 0))
+LOG_SKETCH = os.environ.get("PAW_LOG_SKETCH", "0") == "1"
+JOB_WORKERS = int(os.environ.get("PAW_JOB_WORKERS", 4))
+JOB_NICE = int(os.environ.get("PAW_JOB_NICE", 10))
+METRICS_TOKEN = os.environ.get("PAW_METRICS_TOKEN")
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+PSL_TABLE_FILE = os.path.join(DATA_DIR, "psl.table")
+IMPORT_DIR = os.path.join(DATA_DIR, "imports")
+IMPORT_PLAN_MAX_AGE = 3600
+FLEET_FILE = os.environ.get("PAW_FLEET_FILE", os.path.join(DATA_DIR, "fleet_nodes.json"))
+# Shared secret for fleet traffic; setting it also enables the /agent/* endpoints.
+FLEET_TOKEN = os.environ.get("PAW_FLEET_TOKEN")
+
+def listed_host_filter():
+    allow_trie, hidden_trie = allow_acl.trie(), hidden_acl.trie()
+    return lambda domain: domain in allow_trie or domain in hidden_trie
+
+psl.configure(PSL_TABLE_FILE)
+log_index = LogIndex(SQUID_LOG_FILE, LOG_INDEX_STATE_FILE, memory_budget=int(LOG_MEMORY_BUDGET_MB * 2 ** 20),
+                     sketch=LOG_SKETCH, listed_filter=listed_host_filter)
+log_history = HistoryCache(SQUID_LOG_FILE)
+hit_store = HitStore(HIT_STORE_FILE)
+log_index.listeners.append(lambda batch: hit_store.enqueue(batch, log_index.batch_position))
+log_follower = LogFollower(log_index)
+log_receiver = LogReceiver(log_index, UDP_LISTEN) if UDP_LISTEN else None
+if log_receiver:
+    log_receiver.start()
+# Index state is saved at most every STATE_SAVE_INTERVAL_SECONDS; flush the rest.
+atexit.register(log_index.save)
+atexit.register(hit_store.flush)
+allow_acl = AclFile(ALLOW_LIST_FILE)
+hidden_acl = AclFile(HIDDEN_LIST_FILE)
+apply_queue = ApplyQueue()
+jobs = JobRegistry(workers=JOB_WORKERS, nice=JOB_NICE)
+fleet = Fleet(FLEET_FILE, token=FLEET_TOKEN)
+db_pool = DbPool(DB_CONFIG, size=DB_POOL_SIZE, wait_timeout=DB_POOL_WAIT_TIMEOUT,
+                 ping_interval=DB_POOL_PING_INTERVAL)
 
 # --- MySQL helpers for user/MFA management ---
 
 def get_mysql_conn():
-    return mysql.connector.connect(**DB_CONFIG)
+    return db_pool.connection()
+
+# Once a user exists the setup wizard is normally never needed again, so
+# remember that in-process instead of counting users on every request. A
+# failed login for an unknown user forgets it, so a wiped users table leads
+# back to setup without a restart.
+_users_exist = False
+
+def users_exist():
+    global _users_exist
+    if _users_exist:
+        return True
+    with get_mysql_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM users")
+        (user_count,) = cursor.fetchone()
+    _users_exist = user_count > 0
+    return _users_exist
+
+def forget_users_exist():
+    global _users_exist
+    _users_exist = False
 
 def get_user(username):
     with get_mysql_conn() as conn:
@@ -110,18 +214,83 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --- Metrics and profiling ---
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+    mode = request.headers.get("X-Profile") or request.args.get("profile")
+    if mode and is_god():
+        if mode == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                Profiler = None
+            if Profiler is not None:
+                g.profiler = Profiler()
+                g.profiler.start()
+                g.profile_mode = mode
+                return
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+        g.profile_mode = mode
+
+@app.after_request
+def finish_profiling(response):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    mode = g.pop("profile_mode", "1")
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}-{request.endpoint or 'unknown'}")
+    if mode == "pyinstrument":
+        profiler.stop()
+        path = base + ".html"
+        with open(path, "w") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        path = base + ".prof"
+        profiler.dump_stats(path)
+        if mode == "text":
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(40)
+            response = app.response_class(stream.getvalue(), mimetype="text/plain")
+    response.headers["X-Profile-File"] = path
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    started = g.pop("request_started", None)
+    values = metrics.finish_request()
+    if started is None or request.endpoint in (None, 'static', 'metrics_endpoint', 'events'):
+        return
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint)
+    metrics.REQUEST_LOG_BYTES.observe(values.get("log_bytes", 0))
+    metrics.REQUEST_LOG_LINES.observe(values.get("log_lines", 0))
+    metrics.REQUEST_DB_CHECKOUTS.observe(values.get("db_checkouts", 0))
+    metrics.REQUEST_DB_HOLD_SECONDS.observe(values.get("db_hold_seconds", 0.0))
+
+@before_render_template.connect_via(app)
+def _start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _stop_render_timer(sender, template, context, **extra):
+    started = g.pop("render_started", None)
+    if started is not None:
+        metrics.PHASE_SECONDS.observe(time.perf_counter() - started, phase="render")
+
 # --- Enforce initial setup if no users exist ---
 @app.before_request
 def enforce_first_user_setup():
-    if request.endpoint in ['static', 'setup', 'setup_mfa']:
+    if request.endpoint in ['static', 'setup', 'setup_mfa', 'metrics_endpoint',
+                            'agent_acl', 'agent_apply_status', 'agent_denied']:
         return
-    with get_mysql_conn() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users")
-        (user_count,) = cursor.fetchone()
-        if user_count == 0:
-            if request.endpoint != 'setup' and not request.path.startswith('/setup'):
-                return redirect(url_for('setup'))
+    if not users_exist():
+        if request.endpoint != 'setup' and not request.path.startswith('/setup'):
+            return redirect(url_for('setup'))
 
 # --- Allow static files without login ---
 @app.before_request
@@ -129,74 +298,283 @@ def allow_static_files():
     if request.endpoint and request.endpoint.startswith('static'):
         return
 
+@app.errorhandler(AclWriteError)
+def acl_write_failed(e):
+    # Nothing was written; say so instead of pretending the change applied.
+    if request.path.startswith(("/api/", "/agent/")) or request.is_json:
+        return jsonify({"message": str(e)}), 500
+    flash(str(e), "danger")
+    return redirect(request.referrer or url_for("index"))
+
 # --- Domain helpers ---
 
-def get_blocked_domains():
-    domains = set()
-    if os.path.exists(SQUID_LOG_FILE):
-        with open(SQUID_LOG_FILE, "r") as f:
-            for line in f:
-                parts = line.split()
-                if len(parts) > 6:
-                    domain = parts[6]
-                    if domain and not domain.startswith("http:") and not domain.startswith("https:"):
-                        domains.add(domain)
-    clean_domains = set()
-    for domain in domains:
-        if ':' in domain:
-            domain = domain.split(':')[0]
-        if domain.startswith("www."):
-            domain = domain[4:]
-        clean_domains.add(domain)
-    return sorted(clean_domains, key=lambda d: d.lower())
+def get_blocked_domains(aggregate=None):
+    if aggregate is None:
+        return log_index.blocked_domains()
+    return sorted(aggregate.domains, key=lambda d: d.lower())
+
+@app.template_filter('timestamp')
+def format_timestamp(ts):
+    if ts is None:
+        return "Unknown"
+    return datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
 
+@lru_cache(maxsize=PARENT_DOMAIN_CACHE_SIZE)
 def get_parent_domain(domain):
-    parent = get_sld(domain)
-    return f".{parent}" if parent and parent != domain else f".{domain}"
+    with metrics.PHASE_SECONDS.time(phase="psl"):
+        return psl.parent_entry(domain)
+
+def parent_domain_cache_stats():
+    info = get_parent_domain.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+def filter_unsorted(domains, allow_trie, hidden_trie):
+    with metrics.PHASE_SECONDS.time(phase="acl_filter"):
+        return [d for d in domains if d not in allow_trie and d not in hidden_trie]
 
 def get_allow_list():
-    if not os.path.exists(ALLOW_LIST_FILE):
-        return []
-    with open(ALLOW_LIST_FILE, "r") as f:
-        return [line.strip() for line in f if line.strip()]
+    return allow_acl.sorted_entries()
 
 def get_hidden_list():
-    if not os.path.exists(HIDDEN_LIST_FILE):
-        return []
-    with open(HIDDEN_LIST_FILE, "r") as f:
-        return [line.strip() for line in f if line.strip()]
+    return hidden_acl.sorted_entries()
 
 def add_to_allow_list(domain):
-    entry = get_parent_domain(domain)
-    current = set(get_allow_list())
-    if entry not in current:
-        with open(ALLOW_LIST_FILE, "a") as f:
-            f.write(entry + "\n")
-    remove_from_hidden_list(domain)
+    apply_domain_changes([("allow", domain)])
 
 def remove_from_allow_list(entry):
-    current = set(get_allow_list())
-    if entry in current:
-        current.remove(entry)
-        with open(ALLOW_LIST_FILE, "w") as f:
-            for item in sorted(current, key=lambda d: d.lstrip('.').lower()):
-                f.write(item + "\n")
+    apply_domain_changes([("remove", entry)])
 
 def add_to_hidden_list(domain):
-    entry = get_parent_domain(domain)
-    current = set(get_hidden_list())
-    if entry not in current:
-        with open(HIDDEN_LIST_FILE, "a") as f:
-            f.write(entry + "\n")
+    apply_domain_changes([("hide", domain)])
 
 def remove_from_hidden_list(domain_or_entry):
-    entry = get_parent_domain(domain_or_entry) if not domain_or_entry.startswith('.') else domain_or_entry
-    current = set(get_hidden_list())
-    if entry in current:
-        current.remove(entry)
-        with open(HIDDEN_LIST_FILE, "w") as f:
-            for item in sorted(current, key=lambda d: d.lstrip('.').lower()):
-                f.write(item + "\n")
+    apply_domain_changes([("unhide", domain_or_entry)])
+
+def as_acl_entry(domain_or_entry):
+    return domain_or_entry if domain_or_entry.startswith('.') else get_parent_domain(domain_or_entry)
+
+def apply_domain_changes(operations):
+    """Apply a mix of (action, domain) operations in one write per list.
+
+    Actions: "allow" (add parent to the allow list and unhide it), "hide",
+    "unhide" and "remove" (from the allow list).
+    """
+    changes = []
+    for action, domain in operations:
+        domain = domain.strip()
+        if not domain:
+            continue
+        if action == "allow":
+            entry = get_parent_domain(domain)
+            changes.append((allow_acl, "add", entry))
+            changes.append((hidden_acl, "remove", entry))
+        elif action == "hide":
+            changes.append((hidden_acl, "add", get_parent_domain(domain)))
+        elif action == "unhide":
+            changes.append((hidden_acl, "remove", as_acl_entry(domain)))
+        elif action == "remove":
+            changes.append((allow_acl, "remove", domain))
+        else:
+            raise ValueError(f"Unknown domain action: {action}")
+    if not changes:
+        return 0
+    dropped = []
+    changed = apply_batch(changes, collapse=(allow_acl, hidden_acl) if ACL_COLLAPSE_ON_WRITE else (),
+                          dropped=dropped)
+    report_dropped(dropped)
+    if changed:
+        dashboard_snapshots.invalidate()
+    return changed
+
+def report_dropped(dropped):
+    """Tell the admin which entries collapse-on-write removed."""
+    if dropped:
+        flash("Also removed, now covered by a broader entry: " +
+              ", ".join(f"{narrow} ({broad})" for _, narrow, broad in dropped), "success")
+
+# --- Domain listing API helpers ---
+
+def log_aggregate(scope="live", window=None):
+    with metrics.PHASE_SECONDS.time(phase="log_scan"):
+        if window in WINDOWS:
+            # Keep the incremental index (and its listeners) current as well.
+            log_index.refresh()
+            return scan_window(SQUID_LOG_FILE, WINDOWS[window])
+        aggregate = log_index.snapshot()
+        if scope == "history":
+            aggregate.merge(log_history.aggregate())
+        elif scope == "fleet":
+            aggregate.merge(fleet.collect())
+        return aggregate
+
+unsorted_view = UnsortedView(log_index, allow_acl, hidden_acl, get_parent_domain, UNSORTED_VIEW_FILE)
+unsorted_view.attach()
+
+def live_unsorted(scope, window):
+    # The maintained view covers the live log only, in exact mode.
+    return scope == "live" and window not in WINDOWS and unsorted_view.enabled()
+
+def domain_rows(kind, scope="live", window=None):
+    if kind == "unsorted" and live_unsorted(scope, window):
+        rows = unsorted_view.rows_list()
+        if rows is not None:
+            for row in rows:
+                row["last_seen"] = format_timestamp(row["last_seen"])
+            return rows
+    if kind == "unsorted":
+        aggregate = log_aggregate(scope, window)
+        domains = filter_unsorted(get_blocked_domains(aggregate), allow_acl.trie(), hidden_acl.trie())
+        rows = []
+        for d in domains:
+            stats = aggregate.domains[d]
+            rows.append({
+                "domain": d,
+                "parent": get_parent_domain(d),
+                "hits": stats["hits"],
+                "denied": stats["codes"].get("TCP_DENIED", 0),
+                "last_seen": format_timestamp(stats["last_seen"]),
+            })
+        return rows
+    if kind == "allowed":
+        return [{"domain": d} for d in get_allow_list()]
+    if kind == "blocked":
+        return [{"domain": d} for d in get_hidden_list()]
+    return None
+
+def domain_sort_key(sort):
+    if sort == "client":
+        # Client detail: what the client is being denied first.
+        return lambda row: (-row.get("denied", 0), -row.get("hits", 0), row["domain"])
+    if sort == "hits":
+        return lambda row: (-row.get("hits", 0), row["domain"].lower(), row["domain"])
+    return lambda row: (row["domain"].lower(), row["domain"])
+
+def encode_cursor(key, sort):
+    return base64.urlsafe_b64encode(json.dumps([sort, key]).encode()).decode()
+
+def decode_cursor(cursor, sort):
+    """The sort key a cursor points after; ValueError if it is invalid or was
+    issued for a different sort mode (the keys wouldn't compare)."""
+    try:
+        cursor_sort, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or not isinstance(key, list):
+        raise ValueError("Cursor does not match the sort order")
+    return tuple(key)
+
+# (rows version, sort) -> ((sort keys, rows), build args), so paging through
+# a list doesn't re-sort it for every page.
+_sorted_rows = {}
+SORTED_ROWS_CACHE_SIZE = 16
+
+def sorted_domain_rows(version, sort, build, *args):
+    """build(*args)'s rows in sort order with their keys; None if it returns None."""
+    entry = _sorted_rows.get((version, sort))
+    if entry is not None:
+        return entry[0]
+    rows = build(*args)
+    if rows is None:
+        return None
+    key = domain_sort_key(sort)
+    keyed = sorted(((key(r), r) for r in rows), key=lambda pair: pair[0])
+    cached = ([k for k, _ in keyed], [r for _, r in keyed])
+    while len(_sorted_rows) >= SORTED_ROWS_CACHE_SIZE:
+        _sorted_rows.pop(next(iter(_sorted_rows)), None)
+    _sorted_rows[(version, sort)] = (cached, args)
+    return cached
+
+def paginate_domains(keys, rows, q="", match="substring", sort="name", after=None, limit=API_PAGE_SIZE):
+    """The page of rows (in sort order, see sorted_domain_rows) after the key `after`."""
+    q = q.strip().lower()
+    if q:
+        if match == "prefix":
+            keep = [i for i, r in enumerate(rows) if r["domain"].lower().lstrip('.').startswith(q.lstrip('.'))]
+        else:
+            keep = [i for i, r in enumerate(rows) if q in r["domain"].lower()]
+        keys, rows = [keys[i] for i in keep], [rows[i] for i in keep]
+    start = bisect_right(keys, after) if after else 0
+    page = rows[start:start + limit]
+    more = start + limit < len(rows) and page
+    next_cursor = encode_cursor(keys[start + len(page) - 1], sort) if more else None
+    return {"items": page, "total": len(rows), "next_cursor": next_cursor}
+
+def json_response(payload, status=200):
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    response = app.response_class(body, status=status, mimetype="application/json")
+    response.headers["Vary"] = "Accept-Encoding"
+    if len(body) > 1024 and "gzip" in request.headers.get("Accept-Encoding", ""):
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+# --- Dashboard snapshot ---
+
+def client_rows(aggregate):
+    # Most recently active first; timestamps stay raw until the template.
+    return sorted(aggregate.clients.items(), key=lambda item: item[1].last_seen or 0, reverse=True)
+
+def unconfirmed_count(aggregate, window=None):
+    if window is None and not aggregate.sketch:
+        count = unsorted_view.count()
+        if count is not None:
+            return count
+    allow_trie, hidden_trie = allow_acl.trie(), hidden_acl.trie()
+    if aggregate.sketch:
+        # Distinct domains seen, less the exactly counted ones still listed.
+        listed = sum(1 for d in aggregate.exact if d in allow_trie or d in hidden_trie)
+        return max(aggregate.distinct_domains() - listed, 0)
+    return len(filter_unsorted(get_blocked_domains(aggregate), allow_trie, hidden_trie))
+
+def build_dashboard(window=None):
+    aggregate = log_aggregate(window=window)
+    return {
+        "allowed_count": len(allow_acl.entries()),
+        "blocked_count": len(hidden_acl.entries()),
+        "unconfirmed_count": unconfirmed_count(aggregate, window),
+        "estimated": aggregate.sketch,
+        "client_count": aggregate.distinct_clients() if aggregate.sketch else len(aggregate.clients),
+        "clients": client_rows(aggregate),
+        "top_denied": hit_store.top_denied(WINDOWS.get(window, WINDOWS["24h"]), limit=10),
+    }
+
+def dashboard_version():
+    # The minute bucket keeps time-relative parts (top denied over 24h)
+    # from going stale on an idle proxy.
+    return (log_index.version(), allow_acl.version(), hidden_acl.version(), minute_bucket())
+
+dashboard_snapshots = SnapshotBuilder(build_dashboard, dashboard_version, interval=SNAPSHOT_INTERVAL,
+                                      name="dashboard")
+
+# --- Background jobs ---
+
+def log_job_key(*parts):
+    # Cache key for log-derived results. The log position is not part of it:
+    # jobs move it themselves, so pass version=log_index.position to
+    # jobs.cached instead and get the last result while a newer one builds.
+    return parts + (allow_acl.version(), hidden_acl.version())
+
+def job_pending_page(job_id, title):
+    return render_template(
+        "job_pending.html",
+        job_id=job_id,
+        title=title,
+        page="overview",
+        changes_pending=session.get("changes_pending", False)
+    ), 202
+
+@app.before_request
+def start_background_indexing():
+    if is_logged_in():
+        dashboard_snapshots.start()
+
+@app.route("/jobs/<job_id>")
+@login_required
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"message": "Unknown job"}), 404
+    return jsonify(job)
 
 def mark_changes_pending():
     session["changes_pending"] = True
@@ -208,12 +586,8 @@ def clear_changes_pending():
 
 @app.route('/setup', methods=['GET', 'POST'])
 def setup():
-    with get_mysql_conn() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users")
-        (user_count,) = cursor.fetchone()
-        if user_count > 0:
-            return redirect(url_for('login'))
+    if users_exist():
+        return redirect(url_for('login'))
 
     if request.method == 'POST':
         username = request.form['username'].strip()
@@ -238,6 +612,7 @@ def setup():
 
 @app.route('/setup_mfa', methods=['GET', 'POST'])
 def setup_mfa():
+    import pyotp
     username = session.get('pending_user')
     if not username:
         return redirect(url_for('login'))
@@ -268,18 +643,17 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        # One round trip: the user row carries the password and MFA state.
         user = get_user(username)
         if not user:
+            forget_users_exist()
             flash('User not found in database', 'danger')
             return render_template('login.html')
-        with get_mysql_conn() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT username FROM users WHERE username=%s AND password=%s", (username, password))
-            authed = cursor.fetchone() is not None
-        if not authed:
+        if not hmac.compare_digest(str(user.get('password') or '').encode('utf-8'),
+                                   password.encode('utf-8')):
             flash('Invalid username or password', 'danger')
             return render_template('login.html')
-        secret, enabled = get_user_mfa(username)
+        secret, enabled = user.get('mfa_secret'), user.get('mfa_enabled')
         session['pending_user'] = username
         session['pending_admin_level'] = user.get('admin_level', 0)
         if not secret or not enabled:
@@ -290,6 +664,7 @@ def login():
 
 @app.route('/mfa_setup', methods=['GET', 'POST'])
 def mfa_setup_route():
+    import pyotp
     username = session.get('pending_user')
     if not username:
         return redirect(url_for('login'))
@@ -324,6 +699,7 @@ def mfa_setup_route():
 
 @app.route('/mfa_verify', methods=['GET', 'POST'])
 def mfa_verify():
+    import pyotp
     username = session.get('pending_user')
     if not username:
         return redirect(url_for('login'))
@@ -355,36 +731,88 @@ def logout():
 @app.route("/")
 @login_required
 def index():
-    allow_list = get_allow_list()
-    hidden_list = get_hidden_list()
-    blocked_domains = get_blocked_domains()
-    allow_set = set(allow_list)
-    hidden_set = set(hidden_list)
-    unconfirmed = [d for d in blocked_domains
-                   if get_parent_domain(d) not in allow_set and get_parent_domain(d) not in hidden_set]
-    clients = {}
-    if os.path.exists(SQUID_LOG_FILE):
-        with open(SQUID_LOG_FILE, "r") as f:
-            for line in f:
-                parts = line.split()
-                if len(parts) > 2:
-                    ip = parts[2]
-                    try:
-                        timestamp = float(parts[0])
-                        last_connected = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                    except Exception:
-                        last_connected = "Unknown"
-                    if ip not in clients or last_connected > clients[ip]:
-                        clients[ip] = last_connected
-
-    return render_template(
+    window = request.args.get("window")
+    if window in WINDOWS:
+        ready, data = jobs.cached("dashboard", log_job_key("dashboard", window, minute_bucket()),
+                                  build_dashboard, window, version=log_index.position)
+        if not ready:
+            return job_pending_page(data, "Overview")
+        etag = None
+    else:
+        window = None
+        etag, data = dashboard_snapshots.get(wait=False)
+        if data is None:
+            return job_pending_page(None, "Overview")
+        # The page also depends on per-session state.
+        etag = f"{etag}-{int(session.get('changes_pending', False))}-{session.get('admin_level', 0)}"
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+            response.set_etag(etag)
+            return response
+
+    response = make_response(render_template(
         "index.html",
-        allowed_count=len(allow_list),
-        blocked_count=len(hidden_list),
-        unconfirmed_count=len(unconfirmed),
-        clients=clients,
+        allowed_count=data["allowed_count"],
+        blocked_count=data["blocked_count"],
+        unconfirmed_count=data["unconfirmed_count"],
+        estimated=data["estimated"],
+        client_count=data["client_count"],
+        clients=data["clients"],
+        top_denied=data["top_denied"],
+        window=window,
+        windows=list(WINDOWS),
         page='overview',
         changes_pending=session.get("changes_pending", False)
+    ))
+    if etag:
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def client_domain_rows(client):
+    return [{"domain": domain, "hits": hits, "denied": client.denied_domains.get(domain, 0)}
+            for domain, hits in client.domains.items()]
+
+@app.route("/clients/<ip>")
+@login_required
+def client_detail(ip):
+    ready, client = jobs.cached("client", log_job_key("client", ip), log_index.client, ip,
+                                version=log_index.position)
+    if not ready:
+        return job_pending_page(client, f"Client {ip}")
+    try:
+        after = decode_cursor(request.args["cursor"], "client") if request.args.get("cursor") else None
+    except ValueError as e:
+        return str(e), 400
+    page = {"items": [], "total": 0, "next_cursor": None}
+    if client:
+        # Sorted per request rather than through sorted_domain_rows: one
+        # client's domains are few, and they shouldn't evict the list pages.
+        key = domain_sort_key("client")
+        rows = sorted(client_domain_rows(client), key=key)
+        keys = [key(row) for row in rows]
+        page = paginate_domains(keys, rows, sort="client", after=after, limit=CLIENT_PAGE_SIZE)
+    # Statuses only for the rows shown, not every domain the client touched.
+    allow_trie, hidden_trie = allow_acl.trie(), hidden_acl.trie()
+    rows = []
+    for row in page["items"]:
+        if row["domain"] in allow_trie:
+            status = "allowed"
+        elif row["domain"] in hidden_trie:
+            status = "blocked"
+        else:
+            status = "unsorted"
+        rows.append(dict(row, status=status))
+    return render_template(
+        "client_detail.html",
+        ip=ip,
+        client=client,
+        rows=rows,
+        total=page["total"],
+        next_cursor=page["next_cursor"],
+        first_page=after is None,
+        page="overview",
+        changes_pending=session.get("changes_pending", False)
     )
 
 # --- Manage Users (God Admin and User Admins, with permissions) ---
@@ -546,6 +974,47 @@ def admin_security_settings():
         return redirect(url_for('admin'))
     return render_template('admin_security_settings.html')
 
+@app.route('/admin/acl_lint', methods=['GET', 'POST'])
+@login_required
+def admin_acl_lint():
+    if session.get('admin_level', 0) != 99:
+        return jsonify({"message": "Insufficient permission"}), 403
+    if request.method == 'POST':
+        if apply_batch([], collapse=(allow_acl, hidden_acl)):
+            mark_changes_pending()
+    return jsonify({
+        "allowed": [{"entry": narrow, "covered_by": broad} for narrow, broad in allow_acl.redundant()],
+        "blocked": [{"entry": narrow, "covered_by": broad} for narrow, broad in hidden_acl.redundant()],
+    })
+
+DB_POOL_STATS = metrics.gauge("paw_db_pool", "Database pool counters")
+PARENT_DOMAIN_CACHE = metrics.gauge("paw_parent_domain_cache", "Parent-domain LRU counters")
+LOG_AGGREGATE = metrics.gauge("paw_log_aggregate", "Live log aggregate size and mode")
+
+@app.route('/metrics')
+def metrics_endpoint():
+    authorised = is_god()
+    if METRICS_TOKEN and request.headers.get("Authorization") == f"Bearer {METRICS_TOKEN}":
+        authorised = True
+    if not authorised:
+        return Response("Forbidden\n", status=403, mimetype="text/plain")
+    for key, value in db_pool.get_stats().items():
+        DB_POOL_STATS.set(value, stat=key)
+    for key, value in parent_domain_cache_stats().items():
+        PARENT_DOMAIN_CACHE.set(value or 0, stat=key)
+    aggregate = log_index.aggregate
+    LOG_AGGREGATE.set(int(aggregate.sketch), stat="sketch")
+    LOG_AGGREGATE.set(len(aggregate.domains), stat="domains")
+    LOG_AGGREGATE.set(len(aggregate.clients), stat="clients")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/admin/db_pool_stats')
+@login_required
+def admin_db_pool_stats():
+    if session.get('admin_level', 0) != 99:
+        return jsonify({"message": "Insufficient permission"}), 403
+    return jsonify(db_pool.get_stats())
+
 @app.route("/admin")
 @login_required
 def admin():
@@ -556,11 +1025,9 @@ def admin():
 @app.route("/manage_allowed", methods=["GET", "POST"])
 @login_required
 def manage_allowed():
-    allowed_domains = get_allow_list()
     changes_pending = session.get("changes_pending", False)
     return render_template(
         "manage_allowed.html",
-        allowed_domains=allowed_domains,
         changes_pending=changes_pending,
         page="allowed"
     )
@@ -568,29 +1035,112 @@ def manage_allowed():
 @app.route("/manage_blocked", methods=["GET", "POST"])
 @login_required
 def manage_blocked():
-    blocked_domains = get_hidden_list()
     return render_template(
         "manage_blocked.html",
-        blocked_domains=blocked_domains,
         page="blocked"
     )
 
 @app.route("/manage_unsorted", methods=["GET", "POST"])
 @login_required
 def manage_unsorted():
-    allow_list = set(get_allow_list())
-    hidden_list = set(get_hidden_list())
-    blocked_domains = get_blocked_domains()
-    unsorted_domains = [
-        d for d in blocked_domains
-        if get_parent_domain(d) not in allow_list and get_parent_domain(d) not in hidden_list
-    ]
     return render_template(
         "manage_unsorted.html",
-        unsorted_domains=unsorted_domains,
+        window=request.args.get("window"),
+        windows=list(WINDOWS),
+        fleet_enabled=bool(fleet.nodes()),
         page="unsorted"
     )
 
+@app.route("/events")
+@login_required
+def events():
+    sub = log_follower.subscribe()
+    return Response(
+        log_follower.stream(sub),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/api/top_denied")
+@login_required
+def api_top_denied():
+    window = request.args.get("window", "24h")
+    try:
+        limit = min(max(int(request.args.get("n", 20)), 1), API_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = 20
+    return json_response({
+        "window": window,
+        "items": hit_store.top_denied(WINDOWS.get(window, WINDOWS["24h"]), limit=limit),
+    })
+
+@app.route("/api/sparkline/<domain>")
+@login_required
+def api_sparkline(domain):
+    window = request.args.get("window", "24h")
+    return json_response(hit_store.sparkline(domain, WINDOWS.get(window, WINDOWS["24h"])))
+
+@app.route("/api/domains/<kind>")
+@login_required
+def api_domains(kind):
+    scope, window = request.args.get("scope", "live"), request.args.get("window")
+    try:
+        limit = min(max(int(request.args.get("limit", API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = API_PAGE_SIZE
+    q, sort = request.args.get("q", ""), request.args.get("sort", "name")
+    if sort not in ("name", "hits"):
+        sort = "name"
+    try:
+        after = decode_cursor(request.args["cursor"], sort) if request.args.get("cursor") else None
+    except ValueError as e:
+        return json_response({"message": str(e)}, 400)
+    if kind == "unsorted" and live_unsorted(scope, window) and not q.strip() and sort == "name":
+        # Served straight from the maintained view, already in name order.
+        page = unsorted_view.page(after, limit)
+        if page is not None:
+            rows, total, last_key = page
+            for row in rows:
+                row["last_seen"] = format_timestamp(row["last_seen"])
+            return json_response({"items": rows, "total": total,
+                                  "next_cursor": encode_cursor(last_key, sort) if last_key else None})
+    build, args = domain_rows, (kind,)
+    if kind == "unsorted" and live_unsorted(scope, window):
+        version = ("unsorted", log_index.position(), allow_acl.version(), hidden_acl.version())
+    elif kind == "unsorted":
+        # Log-derived rows are built on the job pool; the page polls the job
+        # and asks again. Windowed, history and fleet results are reused for
+        # a minute.
+        ttl_bucket = minute_bucket() if window or scope != "live" else None
+        key = log_job_key("domains", kind, scope, window, ttl_bucket)
+        ready, rows = jobs.cached("domains", key, domain_rows, kind, scope, window,
+                                  version=log_index.position)
+        if not ready:
+            return json_response({"job_id": rows, "status_url": url_for("job_status", job_id=rows)}, 202)
+        # A rebuilt result replaces the list under the same key; the cache
+        # entry keeps this one alive (via args), so its id isn't reused.
+        version = key + (id(rows),)
+        build, args = list, (rows,)
+    elif kind == "allowed":
+        version = ("allowed", allow_acl.version())
+    elif kind == "blocked":
+        version = ("blocked", hidden_acl.version())
+    else:
+        return json_response({"message": "Unknown list"}, 404)
+    ordered = sorted_domain_rows(version, sort, build, *args)
+    if ordered is None:
+        return json_response({"message": "Unknown list"}, 404)
+    keys, rows = ordered
+    return json_response(paginate_domains(
+        keys,
+        rows,
+        q=q,
+        match=request.args.get("match", "substring"),
+        sort=sort,
+        after=after,
+        limit=limit,
+    ))
+
 # --- Squid/Domain Management actions (POST endpoints for buttons) ---
 
 @app.route("/add_allowed_domain", methods=["POST"])
@@ -602,12 +1152,65 @@ def add_allowed_domain():
         mark_changes_pending()
     return redirect(url_for("manage_allowed"))
 
+@app.route("/import_allowed", methods=["GET", "POST"])
+@login_required
+def import_allowed():
+    """Upload a feed, preview the diff, then confirm to write it."""
+    context = {"formats": IMPORT_FORMATS, "preview_limit": IMPORT_PREVIEW_LIMIT,
+               "changes_pending": session.get("changes_pending", False)}
+    if request.method == "GET":
+        return render_template("import_allowed.html", **context)
+    token = request.form.get("token")
+    if token:
+        path = os.path.join(IMPORT_DIR, os.path.basename(token) + ".json")
+        try:
+            with open(path) as f:
+                plan = json.load(f)
+        except (OSError, ValueError):
+            context["error"] = "That preview has expired; upload the feed again."
+            return render_template("import_allowed.html", **context)
+        dropped = []
+        changed = commit_import(plan, allow_acl, hidden_acl, collapse=ACL_COLLAPSE_ON_WRITE, dropped=dropped)
+        report_dropped(dropped)
+        os.remove(path)
+        if changed:
+            dashboard_snapshots.invalidate()
+            mark_changes_pending()
+        context["changes_pending"] = session.get("changes_pending", False)
+        context["committed"] = changed
+        return render_template("import_allowed.html", **context)
+    upload = request.files.get("feed")
+    if upload and upload.filename:
+        # Decode line by line: before Python 3.11 the SpooledTemporaryFile
+        # behind upload.stream lacks readable(), which TextIOWrapper needs.
+        lines = (raw.decode("utf-8", "replace") for raw in upload.stream)
+        filename = upload.filename
+    else:
+        lines = io.StringIO(request.form.get("text", ""))
+        filename = ""
+    try:
+        plan = plan_import(iter_feed(lines, request.form.get("format", "auto"), filename),
+                           allow_acl, hidden_acl, get_parent_domain)
+    except ValueError as e:
+        context["error"] = f"Could not read the feed: {e}"
+        return render_template("import_allowed.html", **context)
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    now = time.time()
+    for name in os.listdir(IMPORT_DIR):
+        old = os.path.join(IMPORT_DIR, name)
+        if now - os.path.getmtime(old) > IMPORT_PLAN_MAX_AGE:
+            os.remove(old)
+    token = uuid.uuid4().hex
+    with open(os.path.join(IMPORT_DIR, token + ".json"), "w") as f:
+        json.dump(plan, f)
+    context.update(plan=plan, token=token)
+    return render_template("import_allowed.html", **context)
+
 @app.route("/bulk_remove_allowed", methods=["POST"])
 @login_required
 def bulk_remove_allowed():
     selected = request.form.getlist("selected_domains")
-    for domain in selected:
-        remove_from_allow_list(domain)
+    if apply_domain_changes([("remove", domain) for domain in selected]):
         mark_changes_pending()
     return redirect(url_for("manage_allowed"))
 
@@ -620,15 +1223,163 @@ def remove_allowed_domain():
         mark_changes_pending()
     return redirect(url_for("manage_allowed"))
 
+@app.route("/add_blocked_domain", methods=["POST"])
+@login_required
+def add_blocked_domain():
+    domain = request.form.get("domain")
+    if domain:
+        add_to_hidden_list(domain)
+    return redirect(url_for("manage_blocked"))
+
+@app.route("/bulk_remove_blocked", methods=["POST"])
+@login_required
+def bulk_remove_blocked():
+    selected = request.form.getlist("selected_domains")
+    apply_domain_changes([("unhide", domain) for domain in selected])
+    return redirect(url_for("manage_blocked"))
+
+@app.route("/remove_blocked_domain", methods=["POST"])
+@login_required
+def remove_blocked_domain():
+    domain = request.form.get("domain")
+    if domain:
+        remove_from_hidden_list(domain)
+    return redirect(url_for("manage_blocked"))
+
+@app.route("/mark_allowed", methods=["POST"])
+@login_required
+def mark_allowed():
+    domain = request.form.get("domain")
+    if domain:
+        add_to_allow_list(domain)
+        mark_changes_pending()
+    return redirect(url_for("manage_unsorted"))
+
+@app.route("/mark_blocked", methods=["POST"])
+@login_required
+def mark_blocked():
+    domain = request.form.get("domain")
+    if domain:
+        add_to_hidden_list(domain)
+    return redirect(url_for("manage_unsorted"))
+
+@app.route("/bulk_mark_unsorted", methods=["POST"])
+@login_required
+def bulk_mark_unsorted():
+    selected = request.form.getlist("selected_domains")
+    action = "allow" if request.form.get("bulk") == "allow" else "hide"
+    if apply_domain_changes([(action, domain) for domain in selected]) and action == "allow":
+        mark_changes_pending()
+    return redirect(url_for("manage_unsorted"))
+
 @app.route("/restart_squid", methods=["POST"])
 @login_required
 def restart_squid():
-    try:
-        subprocess.run(["sudo", "systemctl", "restart", "squid"], check=True)
-        session.pop("changes_pending", None)
-        return jsonify({"message": "Squid restarted!"})
-    except Exception as e:
-        return jsonify({"message": f"Failed to restart Squid: {e}"}), 500
+    restart = request.args.get("full") == "1"
+    job_id = apply_queue.request_apply(reason=session.get("username", "acl"), restart=restart)
+    pushed = bool(fleet.nodes())
+    if pushed:
+        fleet.push(acl_payload(allow_acl.entries(), hidden_acl.entries()))
+    return jsonify({
+        "message": "Squid reload queued",
+        "job_id": job_id,
+        "status_url": url_for("apply_status", job_id=job_id),
+        "fleet": pushed,
+    }), 202
+
+@app.route("/apply_status/<job_id>")
+@login_required
+def apply_status(job_id):
+    job = apply_queue.get_job(job_id)
+    if not job:
+        return jsonify({"message": "Unknown job"}), 404
+    if job["state"] == "done":
+        clear_changes_pending()
+    return jsonify(job)
+
+# --- Fleet (controller side) ---
+
+@app.route("/admin/fleet", methods=["GET", "POST"])
+@login_required
+def admin_fleet():
+    if session.get('admin_level', 0) != 99:
+        flash("Insufficient permission", "danger")
+        return redirect(url_for('admin'))
+    if request.method == "POST":
+        action = request.form.get("action")
+        name = request.form.get("name", "").strip()
+        try:
+            if action == "add":
+                fleet.add_node(name, request.form.get("url", "").strip(), request.form.get("token") or None)
+                flash(f"Node {name} added.", "success")
+            elif action == "remove":
+                fleet.remove_node(name)
+                flash(f"Node {name} removed.", "success")
+            elif action == "push":
+                fleet.push(acl_payload(allow_acl.entries(), hidden_acl.entries()))
+                flash("Pushing lists to all nodes.", "success")
+        except ValueError as e:
+            flash(str(e), "danger")
+        return redirect(url_for('admin_fleet'))
+    return render_template('admin_fleet.html', nodes=fleet.get_status(), token_set=bool(FLEET_TOKEN))
+
+@app.route("/admin/fleet/status")
+@login_required
+def admin_fleet_status():
+    if session.get('admin_level', 0) != 99:
+        return jsonify({"message": "Insufficient permission"}), 403
+    return jsonify(fleet.get_status())
+
+# --- Fleet (node agent side) ---
+
+def agent_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not FLEET_TOKEN:
+            return jsonify({"message": "Fleet agent disabled"}), 404
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {FLEET_TOKEN}".encode("utf-8")):
+            return jsonify({"message": "Unauthorized"}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+def replace_changes(acl, wanted):
+    current = acl.entries()
+    return ([(acl, "add", entry) for entry in wanted - current] +
+            [(acl, "remove", entry) for entry in current - wanted])
+
+@app.route("/agent/acl", methods=["PUT"])
+@agent_required
+def agent_acl():
+    data = request.get_json(silent=True) or {}
+    lists = {}
+    for key in ("allow", "hidden"):
+        entries = data.get(key)
+        if not isinstance(entries, list) or not all(isinstance(e, str) for e in entries):
+            return jsonify({"message": f"'{key}' must be a list of strings"}), 400
+        lists[key] = {e.strip() for e in entries if e.strip()}
+    changed = apply_batch(replace_changes(allow_acl, lists["allow"]) +
+                          replace_changes(hidden_acl, lists["hidden"]))
+    job_id = None
+    if changed:
+        dashboard_snapshots.invalidate()
+        job_id = apply_queue.request_apply(reason="fleet")
+    return jsonify({"changed": changed, "job_id": job_id})
+
+@app.route("/agent/apply_status/<job_id>")
+@agent_required
+def agent_apply_status(job_id):
+    job = apply_queue.get_job(job_id)
+    if not job:
+        return jsonify({"message": "Unknown job"}), 404
+    return jsonify(job)
+
+@app.route("/agent/denied")
+@agent_required
+def agent_denied():
+    domains = log_index.snapshot().domains
+    return json_response({"domains": {d: stats for d, stats in domains.items()
+                                      if stats["codes"].get("TCP_DENIED")}})
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
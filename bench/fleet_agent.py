@@ -0,0 +1,70 @@
+"""Run local stand-in fleet nodes for testing fleet mode.
+
+    PAW_FLEET_TOKEN=secret python bench/fleet_agent.py --nodes 3 --base-port 7001
+
+Each node is this app in its own process with its own synthetic access.log
+and ACL files, MySQL stubbed out and squid commands replaced by `true`.
+Register them on the controller as http://127.0.0.1:7001, :7002, ...
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from gen_log import write_logs  # noqa: E402
+from run_bench import import_app  # noqa: E402
+
+
+def serve_node(workdir, port, lines, seed, fail_rate, debounce):
+    os.environ["PAW_APPLY_DEBOUNCE"] = str(debounce)
+    write_logs(workdir, lines, max(lines // 20, 10), 10, seed=seed)
+    for name in ("allowed_paw.acl", "hidden_domains.txt"):
+        open(os.path.join(workdir, name), "a").close()
+    app_module = import_app(workdir, 0)
+    rng = random.Random(seed)
+
+    @app_module.app.before_request
+    def flaky():
+        from flask import request
+        if fail_rate and request.path.startswith("/agent/") and rng.random() < fail_rate:
+            return "Injected failure", 503
+
+    from werkzeug.serving import make_server
+    make_server("127.0.0.1", port, app_module.app, threaded=True).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=7001)
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of agent calls answered with 503")
+    parser.add_argument("--debounce", type=float, default=0.2)
+    args = parser.parse_args()
+    if not os.environ.get("PAW_FLEET_TOKEN"):
+        raise SystemExit("Set PAW_FLEET_TOKEN so the agent endpoints are enabled")
+    root = tempfile.mkdtemp(prefix="paw_fleet_")
+    procs = []
+    for i in range(args.nodes):
+        port = args.base_port + i
+        workdir = os.path.join(root, f"node{i + 1}")
+        proc = multiprocessing.Process(target=serve_node, daemon=True,
+                                       args=(workdir, port, args.lines, i + 1, args.fail_rate, args.debounce))
+        proc.start()
+        procs.append(proc)
+        print(f"node{i + 1} http://127.0.0.1:{port} {workdir}")
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Generate synthetic squid native-format access logs and ACL files.
+
+    python bench/gen_log.py --lines 1000000 --hosts 30000 --clients 50 \
+        --denied-ratio 0.3 --rotate 2 --out /tmp/bench
+"""
+import argparse
+import gzip
+import os
+import random
+import time
+
+TLDS = ["com", "net", "org", "io", "co.uk", "microsoft.com", "azure.net", "windows.net"]
+WORDS = ["login", "portal", "api", "cdn", "graph", "assets", "static", "auth", "mgmt", "vault", "edge", "blob"]
+
+
+def make_hosts(count, rng):
+    hosts = set()
+    while len(hosts) < count:
+        depth = rng.choice((0, 1, 1, 2))
+        labels = [rng.choice(WORDS) + str(rng.randrange(100)) for _ in range(depth)]
+        labels.append(f"site{rng.randrange(count)}")
+        labels.append(rng.choice(TLDS))
+        host = ".".join(labels)
+        if rng.random() < 0.1:
+            host = "www." + host
+        hosts.add(host)
+    return sorted(hosts)
+
+
+def make_clients(count):
+    return [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256 + 1}" for i in range(count)]
+
+
+def log_lines(lines, hosts, clients, denied_ratio, start, rng):
+    # Skewed host popularity so there are clear heavy hitters.
+    weights = [1.0 / (i + 1) ** 0.8 for i in range(len(hosts))]
+    step = 86400.0 / max(lines, 1)
+    ts = start
+    chosen = rng.choices(hosts, weights=weights, k=lines)
+    for host in chosen:
+        ts += step * rng.uniform(0.5, 1.5)
+        client = rng.choice(clients)
+        if rng.random() < denied_ratio:
+            action, size = "TCP_DENIED/403", 3900
+        else:
+            action, size = "TCP_TUNNEL/200", rng.randrange(500, 200000)
+        yield (f"{ts:.3f} {rng.randrange(1, 9000):6d} {client} {action} {size} "
+               f"CONNECT {host}:443 - HIER_DIRECT/{rng.randrange(1, 255)}.0.0.1 -\n")
+
+
+def write_logs(out_dir, lines, hosts, clients, denied_ratio=0.3, rotate=0, seed=1, start=None):
+    """Write access.log plus `rotate` older files (.1 plain, .2+ gzipped).
+
+    Returns the list of files written, newest first.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    host_list = make_hosts(hosts, rng)
+    client_list = make_clients(clients)
+    files = [os.path.join(out_dir, "access.log")]
+    for n in range(1, rotate + 1):
+        suffix = f".{n}" if n == 1 else f".{n}.gz"
+        files.append(os.path.join(out_dir, "access.log" + suffix))
+    per_file = lines // len(files)
+    start = start if start is not None else time.time() - 86400 * len(files)
+    # Oldest file first so timestamps increase across the rotation chain.
+    for i, path in enumerate(reversed(files)):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "wt") as f:
+            f.writelines(log_lines(per_file, host_list, client_list, denied_ratio, start + 86400 * i, rng))
+    return files
+
+
+def write_acl(path, entries, seed=2):
+    rng = random.Random(seed)
+    hosts = {host[4:] if host.startswith("www.") else host for host in make_hosts(entries, rng)}
+    with open(path, "w") as f:
+        for host in sorted(hosts):
+            f.write("." + host + "\n")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--hosts", type=int, default=30_000)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--denied-ratio", type=float, default=0.3)
+    parser.add_argument("--rotate", type=int, default=0)
+    parser.add_argument("--acl-entries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    files = write_logs(args.out, args.lines, args.hosts, args.clients, args.denied_ratio, args.rotate, args.seed)
+    write_acl(os.path.join(args.out, "allowed_paw.acl"), args.acl_entries)
+    open(os.path.join(args.out, "hidden_domains.txt"), "a").close()
+    for path in files:
+        print(path, os.path.getsize(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""Benchmark the app's hot paths against a synthetic squid log.
+
+    python bench/run_bench.py --lines 1000000 --output bench/baseline.json
+    python bench/run_bench.py --lines 1000000 --compare bench/baseline.json
+
+Generates a native-format access.log (plus optional rotated files) and an
+allow list, imports app.py with MySQL stubbed out, and times each hot path
+through the Flask test client. Results (throughput, latency percentiles and
+peak RSS) are written as JSON so later runs can be compared against them.
+Startup (a fresh interpreter importing the app and serving its first page)
+is measured in child processes so it reflects a new gunicorn worker.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from contextlib import contextmanager
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from gen_log import write_acl, write_logs  # noqa: E402
+
+
+# --- MySQL stub ---
+
+BENCH_USER = {
+    "id": 1, "username": "bench", "email": "bench@example.com", "password": "bench",
+    "admin_level": 99, "mfa_secret": None, "mfa_enabled": 0,
+}
+
+
+class FakeCursor:
+    def __init__(self, pool, dictionary=False):
+        self.pool = pool
+        self.dictionary = dictionary
+        self.sql = ""
+
+    def execute(self, sql, params=None):
+        if self.pool.latency:
+            time.sleep(self.pool.latency)
+        self.pool.queries += 1
+        self.sql = sql
+
+    def fetchone(self):
+        if "COUNT(*)" in self.sql:
+            return (1,)
+        if "mfa_secret, mfa_enabled" in self.sql:
+            return (BENCH_USER["mfa_secret"], BENCH_USER["mfa_enabled"])
+        if self.dictionary:
+            return dict(BENCH_USER)
+        return (BENCH_USER["username"],)
+
+    def fetchall(self):
+        return [self.fetchone()]
+
+
+class FakeConn:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self.pool, dictionary)
+
+    def commit(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.queries = 0
+
+    @contextmanager
+    def connection(self):
+        yield FakeConn(self)
+
+    def get_stats(self):
+        return {"queries": self.queries}
+
+
+def import_app(workdir, db_latency):
+    os.environ["PAW_SQUID_LOG_FILE"] = os.path.join(workdir, "access.log")
+    os.environ["PAW_ALLOW_LIST_FILE"] = os.path.join(workdir, "allowed_paw.acl")
+    os.environ["PAW_HIDDEN_LIST_FILE"] = os.path.join(workdir, "hidden_domains.txt")
+    os.environ["PAW_DATA_DIR"] = os.path.join(workdir, "data")
+    os.environ["PAW_SQUID_CMD"] = "true"
+    os.environ["PAW_SQUID_RESTART_CMD"] = "true"
+    db_config = types.ModuleType("db_config")
+    db_config.DB_CONFIG = {}
+    sys.modules.setdefault("db_config", db_config)
+    import app as app_module
+    app_module.db_pool = FakePool(db_latency)
+    return app_module
+
+
+def logged_in_client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["username"] = BENCH_USER["username"]
+        sess["admin_level"] = BENCH_USER["admin_level"]
+    return client
+
+
+# --- measurement helpers ---
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    k = min(len(sorted_samples) - 1, max(0, int(round(pct / 100.0 * (len(sorted_samples) - 1)))))
+    return sorted_samples[k]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": 1000 * sum(ordered) / len(ordered),
+        "p50_ms": 1000 * percentile(ordered, 50),
+        "p95_ms": 1000 * percentile(ordered, 95),
+        "p99_ms": 1000 * percentile(ordered, 99),
+        "max_ms": 1000 * ordered[-1],
+    }
+
+
+def time_calls(fn, iterations):
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+def startup_probe(workdir):
+    """Run in a child process: import the app and serve one page."""
+    started = time.perf_counter()
+    app_module = import_app(workdir, 0)
+    imported = time.perf_counter()
+    response = app_module.app.test_client().get("/login")
+    assert response.status_code == 200, response.status_code
+    print(json.dumps({
+        "import_seconds": imported - started,
+        "first_request_seconds": time.perf_counter() - imported,
+        "rss_mb": current_rss_mb(),
+        "modules": len(sys.modules),
+    }))
+
+
+def measure_startup(workdir, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--startup-probe", workdir],
+                             check=True, capture_output=True, text=True).stdout
+        sample = json.loads(out.strip().splitlines()[-1])
+        sample["seconds"] = time.perf_counter() - started
+        samples.append(sample)
+    return {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+
+def get_ok(client, url):
+    # Log-derived pages answer 202 while a background job builds them;
+    # the measured time includes waiting for it, as a user would.
+    def call(_):
+        while True:
+            response = client.get(url)
+            if response.status_code != 202:
+                break
+            time.sleep(0.005)
+        assert response.status_code in (200, 304), (url, response.status_code)
+        response.get_data()
+    return call
+
+
+def login_latency(app_module, iterations):
+    """Login latency when idle and while a full log scan runs on the job pool."""
+    from log_index import LogIndex
+
+    client = app_module.app.test_client()
+    form = {"username": BENCH_USER["username"], "password": BENCH_USER["password"]}
+
+    def login(_):
+        response = client.post("/login", data=form)
+        assert response.status_code == 302, response.status_code
+
+    idle = time_calls(login, iterations)
+    scan_started = time.perf_counter()
+    job_id = app_module.jobs.submit("bench-scan", LogIndex(app_module.SQUID_LOG_FILE).refresh)
+    samples = []
+    while app_module.jobs.get(job_id)["state"] in ("queued", "running") or len(samples) < iterations:
+        started = time.perf_counter()
+        login(0)
+        samples.append(time.perf_counter() - started)
+    during = summarize(samples)
+    during["scan_seconds"] = app_module.jobs.get(job_id)["duration"]
+    during["wall_seconds"] = time.perf_counter() - scan_started
+    return idle, during
+
+
+# --- benchmark run ---
+
+def run(args, workdir):
+    results = {}
+    gen_started = time.perf_counter()
+    files = write_logs(workdir, args.lines, args.hosts, args.clients, args.denied_ratio, args.rotate, args.seed)
+    write_acl(os.path.join(workdir, "allowed_paw.acl"), args.acl_entries)
+    open(os.path.join(workdir, "hidden_domains.txt"), "a").close()
+    log_bytes = os.path.getsize(files[0])
+    log_lines = args.lines // len(files)
+    results["generate_seconds"] = time.perf_counter() - gen_started
+
+    started = time.perf_counter()
+    app_module = import_app(workdir, args.db_latency_ms / 1000.0)
+    results["import_seconds"] = time.perf_counter() - started
+    client = logged_in_client(app_module)
+
+    # Cold scan: first full pass over the live log.
+    started = time.perf_counter()
+    app_module.get_blocked_domains()
+    elapsed = time.perf_counter() - started
+    results["cold_scan"] = {
+        "seconds": elapsed,
+        "lines_per_second": log_lines / elapsed if elapsed else 0.0,
+        "mb_per_second": log_bytes / 1e6 / elapsed if elapsed else 0.0,
+    }
+    results["warm_get_blocked_domains"] = time_calls(lambda _: app_module.get_blocked_domains(), args.iterations)
+
+    for name, url in (
+        ("dashboard", "/"),
+        ("dashboard_1h", "/?window=1h"),
+        ("manage_unsorted", "/manage_unsorted"),
+        ("api_unsorted_page", "/api/domains/unsorted?limit=100"),
+        ("api_unsorted_by_hits", "/api/domains/unsorted?limit=100&sort=hits"),
+        ("api_allowed_page", "/api/domains/allowed?limit=100"),
+        ("manage_allowed", "/manage_allowed"),
+    ):
+        results[name] = time_calls(get_ok(client, url), args.iterations)
+
+    if args.rotate:
+        started = time.perf_counter()
+        get_ok(client, "/api/domains/unsorted?limit=100&scope=history")(0)
+        results["history_scan_seconds"] = time.perf_counter() - started
+
+    results["login"], results["login_during_scan"] = login_latency(app_module, args.iterations)
+
+    def add_allowed(i):
+        client.post("/add_allowed_domain", data={"domain": f"bench{i}.example{i}.com"})
+
+    results["add_allowed_domain"] = time_calls(add_allowed, args.iterations)
+    selected = [f".example{i}.com" for i in range(args.iterations)]
+    results["bulk_remove_allowed"] = time_calls(
+        lambda _: client.post("/bulk_remove_allowed", data={"selected_domains": selected}), 1)
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    # A restart with the index state already on disk, as after update.sh.
+    results["startup"] = measure_startup(workdir, args.startup_runs)
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """Return a list of human-readable regressions."""
+    regressions = []
+    for name, value in current.items():
+        old = baseline.get(name)
+        if isinstance(value, dict) and isinstance(old, dict):
+            for key in ("p50_ms", "p99_ms", "seconds", "import_seconds", "rss_mb"):
+                if key in value and key in old and old[key] and value[key] > old[key] * (1 + tolerance):
+                    regressions.append(f"{name}.{key}: {old[key]:.2f} -> {value[key]:.2f}")
+            for key in ("lines_per_second",):
+                if key in value and key in old and value[key] < old[key] * (1 - tolerance):
+                    regressions.append(f"{name}.{key}: {old[key]:.0f} -> {value[key]:.0f}")
+        elif name == "peak_rss_mb" and old and value > old * (1 + tolerance):
+            regressions.append(f"{name}: {old:.1f} -> {value:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--hosts", type=int, default=30_000)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--denied-ratio", type=float, default=0.3)
+    parser.add_argument("--rotate", type=int, default=0)
+    parser.add_argument("--acl-entries", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--startup-runs", type=int, default=3)
+    parser.add_argument("--startup-probe", metavar="WORKDIR", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help="Keep generated files here instead of a temp dir")
+    parser.add_argument("--output", help="Write results JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    if args.startup_probe:
+        startup_probe(args.startup_probe)
+        return
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        results = run(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="paw_bench_") as workdir:
+            results = run(args, workdir)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "workdir", "startup_probe")},
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline.get("results", {}), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:", file=sys.stderr)
+            for line in regressions:
+                print("  " + line, file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against baseline.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Replay a squid access.log over UDP, the way `access_log udp://` sends it.
+
+    python bench/udp_replay.py /tmp/bench/access.log --target 127.0.0.1:5140 --rate 20000
+"""
+import argparse
+import gzip
+import socket
+import time
+
+
+def replay(path, target, rate=0, syslog=False, limit=0):
+    """Send each line as one datagram; returns (lines sent, seconds)."""
+    host, _, port = target.rpartition(":")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    opener = gzip.open if path.endswith(".gz") else open
+    interval = 1.0 / rate if rate else 0.0
+    prefix = b"<134>" + time.strftime("%b %d %H:%M:%S").encode() + b" proxy squid[1]: " if syslog else b""
+    sent = 0
+    started = time.perf_counter()
+    with opener(path, "rb") as f:
+        for line in f:
+            sock.sendto(prefix + line, (host or "127.0.0.1", int(port)))
+            sent += 1
+            if limit and sent >= limit:
+                break
+            if interval:
+                # Pace against the start time so sleep overhead doesn't add up.
+                delay = started + sent * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    sock.close()
+    return sent, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log")
+    parser.add_argument("--target", default="127.0.0.1:5140")
+    parser.add_argument("--rate", type=float, default=0, help="Lines per second (0 = as fast as possible)")
+    parser.add_argument("--syslog", action="store_true", help="Prefix lines with a syslog header")
+    parser.add_argument("--limit", type=int, default=0)
+    args = parser.parse_args()
+    sent, elapsed = replay(args.log, args.target, args.rate, args.syslog, args.limit)
+    print(f"sent {sent} lines in {elapsed:.2f}s ({sent / elapsed if elapsed else 0:.0f} lines/s)")
+
+
+if __name__ == "__main__":
+    main()
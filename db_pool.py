@@ -0,0 +1,109 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class DbPool:
+    """Lazily created mysql.connector pool with wait-on-exhaustion and stats.
+
+    mysql.connector raises PoolError immediately when every connection is
+    checked out; we retry until wait_timeout instead so short bursts queue
+    rather than fail. Connections idle for longer than ping_interval are
+    pinged (and reconnected if needed) before being handed out.
+    """
+
+    def __init__(self, config, size=5, name="paw_pool", wait_timeout=5.0, ping_interval=30.0):
+        self.config = config
+        self.size = size
+        self.name = name
+        self.wait_timeout = wait_timeout
+        self.ping_interval = ping_interval
+        self._pool = None
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self.stats = {
+            "checkouts": 0,
+            "hits": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+            "pings": 0,
+            "reconnects": 0,
+        }
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # Imported on first use; mysql.connector is slow to import.
+                    from mysql.connector import pooling
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name=self.name, pool_size=self.size, pool_reset_session=True, **self.config
+                    )
+        return self._pool
+
+    def _checkout(self):
+        from mysql.connector import errors
+        pool = self._get_pool()
+        started = time.monotonic()
+        waited = False
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except errors.PoolError:
+                if time.monotonic() - started >= self.wait_timeout:
+                    with self._lock:
+                        self.stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available after {self.wait_timeout}s")
+                waited = True
+                time.sleep(0.01)
+        with self._lock:
+            self.stats["checkouts"] += 1
+            if waited:
+                self.stats["waits"] += 1
+                self.stats["wait_seconds"] += time.monotonic() - started
+            else:
+                self.stats["hits"] += 1
+        return conn
+
+    def _health_check(self, conn):
+        from mysql.connector import errors
+        key = id(getattr(conn, "_cnx", conn))
+        last = self._last_used.get(key)
+        if last is not None and time.monotonic() - last < self.ping_interval:
+            return
+        with self._lock:
+            self.stats["pings"] += 1
+        try:
+            conn.ping(reconnect=False)
+        except errors.Error:
+            with self._lock:
+                self.stats["reconnects"] += 1
+            conn.reconnect(attempts=2, delay=0)
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        # Checkouts and hold time, not queries: one checkout may run several.
+        started = time.perf_counter()
+        try:
+            self._health_check(conn)
+            yield conn
+        finally:
+            self._last_used[id(getattr(conn, "_cnx", conn))] = time.monotonic()
+            conn.close()
+            metrics.record("db_checkouts")
+            metrics.record("db_hold_seconds", time.perf_counter() - started)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["size"] = self.size
+        return stats
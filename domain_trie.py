@@ -0,0 +1,113 @@
+class _Node:
+    __slots__ = ("children", "wildcard", "exact")
+
+    def __init__(self):
+        self.children = {}
+        # Original spelling of the ".example.com" / "example.com" entry
+        # ending at this node, if any.
+        self.wildcard = None
+        self.exact = None
+
+
+def _labels(domain):
+    return reversed(domain.lstrip('.').lower().split('.'))
+
+
+class DomainTrie:
+    """Suffix trie over squid dstdomain entries, keyed by reversed labels.
+
+    Follows dstdomain semantics: ".example.com" matches example.com and every
+    subdomain, "example.com" matches only itself. Lookups cost O(labels in
+    the host) regardless of how many entries the list has.
+    """
+
+    def __init__(self, entries=()):
+        self.root = _Node()
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        node = self.root
+        for label in _labels(entry):
+            node = node.children.setdefault(label, _Node())
+        if entry.startswith('.'):
+            node.wildcard = entry
+        else:
+            node.exact = entry
+
+    def remove(self, entry):
+        path = [self.root]
+        for label in _labels(entry):
+            node = path[-1].children.get(label)
+            if node is None:
+                return
+            path.append(node)
+        if entry.startswith('.'):
+            path[-1].wildcard = None
+        else:
+            path[-1].exact = None
+
+    def match(self, host):
+        """Return the broadest entry matching host, or None."""
+        node = self.root
+        for label in _labels(host):
+            node = node.children.get(label)
+            if node is None:
+                return None
+            if node.wildcard is not None:
+                return node.wildcard
+        return node.exact
+
+    def __contains__(self, host):
+        return self.match(host) is not None
+
+    def covering(self, entry):
+        """Broader entries that already cover entry (excluding entry itself)."""
+        found = []
+        node = self.root
+        for label in _labels(entry):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.wildcard is not None and node.wildcard != entry:
+                found.append(node.wildcard)
+        return found
+
+    def covered(self, entry):
+        """Narrower entries made redundant by a wildcard entry."""
+        if not entry.startswith('.'):
+            return []
+        node = self.root
+        for label in _labels(entry):
+            node = node.children.get(label)
+            if node is None:
+                return []
+        found = []
+        if node.exact is not None:
+            found.append(node.exact)
+        stack = list(node.children.values())
+        while stack:
+            child = stack.pop()
+            if child.wildcard is not None:
+                found.append(child.wildcard)
+            if child.exact is not None:
+                found.append(child.exact)
+            stack.extend(child.children.values())
+        return found
+
+    def redundant(self):
+        """(entry, covering_entry) pairs for every entry another one covers."""
+        pairs = []
+        stack = [(self.root, None)]
+        while stack:
+            node, cover = stack.pop()
+            if cover is not None:
+                if node.wildcard is not None:
+                    pairs.append((node.wildcard, cover))
+                if node.exact is not None:
+                    pairs.append((node.exact, cover))
+            elif node.exact is not None and node.wildcard is not None:
+                pairs.append((node.exact, node.wildcard))
+            next_cover = cover or node.wildcard
+            stack.extend((child, next_cover) for child in node.children.values())
+        return pairs
@@ -0,0 +1,247 @@
+"""Manage several PAW proxies from one app.
+
+Nodes run this same app with PAW_FLEET_TOKEN set, which enables the /agent/*
+endpoints. The controller keeps a registry of nodes and talks to all of them
+concurrently (bounded by an asyncio semaphore): pushing the allow/hidden
+lists and waiting for each node's squid reconfigure, and pulling each node's
+domain aggregate to merge into one unsorted view.
+
+asyncio and urllib are imported on first use to keep app startup fast.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from log_index import LogAggregate
+
+logger = logging.getLogger(__name__)
+
+FLEET_CONCURRENCY = int(os.environ.get("PAW_FLEET_CONCURRENCY", 8))
+FLEET_TIMEOUT_SECONDS = float(os.environ.get("PAW_FLEET_TIMEOUT", 10.0))
+FLEET_RETRIES = 3
+FLEET_RETRY_DELAY_SECONDS = 1.0
+FLEET_PULL_TTL_SECONDS = 30.0
+FLEET_APPLY_WAIT_SECONDS = 90.0
+FLEET_APPLY_POLL_SECONDS = 0.5
+
+
+class FleetError(Exception):
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+def acl_payload(allow_entries, hidden_entries):
+    allow, hidden = sorted(allow_entries), sorted(hidden_entries)
+    version = hashlib.sha1(json.dumps([allow, hidden]).encode()).hexdigest()
+    return {"allow": allow, "hidden": hidden, "version": version}
+
+
+class Fleet:
+    def __init__(self, registry_file, token=None, concurrency=FLEET_CONCURRENCY,
+                 timeout=FLEET_TIMEOUT_SECONDS, retries=FLEET_RETRIES,
+                 retry_delay=FLEET_RETRY_DELAY_SECONDS, pull_ttl=FLEET_PULL_TTL_SECONDS):
+        self.registry_file = registry_file
+        self.token = token
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pull_ttl = pull_ttl
+        self.lock = threading.Lock()
+        self.status = {}
+        self._nodes = None
+        self._pulled = None
+        self._pulled_at = 0.0
+        self._push_thread = None
+        self._next_payload = None
+
+    # --- registry ---
+
+    def nodes(self):
+        with self.lock:
+            if self._nodes is None:
+                try:
+                    with open(self.registry_file) as f:
+                        self._nodes = json.load(f)
+                except (OSError, ValueError):
+                    self._nodes = []
+            return list(self._nodes)
+
+    def _save_nodes(self, nodes):
+        os.makedirs(os.path.dirname(self.registry_file) or ".", exist_ok=True)
+        tmp = self.registry_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(nodes, f, indent=2)
+        os.replace(tmp, self.registry_file)
+        self._nodes = nodes
+        self._pulled = None
+
+    def add_node(self, name, url, token=None):
+        if not name or not url.startswith(("http://", "https://")):
+            raise ValueError("A node needs a name and an http(s) URL")
+        nodes = [n for n in self.nodes() if n["name"] != name]
+        node = {"name": name, "url": url.rstrip("/")}
+        if token:
+            node["token"] = token
+        nodes.append(node)
+        with self.lock:
+            self._save_nodes(nodes)
+
+    def remove_node(self, name):
+        nodes = [n for n in self.nodes() if n["name"] != name]
+        with self.lock:
+            self._save_nodes(nodes)
+            self.status.pop(name, None)
+
+    def get_status(self):
+        nodes = self.nodes()
+        with self.lock:
+            return [{"name": n["name"], "url": n["url"],
+                     "push": dict(self.status.get(n["name"], {}).get("push", {})),
+                     "pull": dict(self.status.get(n["name"], {}).get("pull", {}))}
+                    for n in nodes]
+
+    def _set(self, node, kind, **values):
+        with self.lock:
+            entry = self.status.setdefault(node["name"], {}).setdefault(kind, {})
+            entry.update(values, updated=time.time())
+
+    # --- transport ---
+
+    def _request(self, node, method, path, payload=None):
+        import urllib.error
+        import urllib.request
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(node["url"] + path, data=data, method=method)
+        token = node.get("token") or self.token
+        if token:
+            req.add_header("Authorization", f"Bearer {token}")
+        req.add_header("Accept-Encoding", "gzip")
+        if data is not None:
+            req.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                body = resp.read()
+                if resp.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+        except urllib.error.HTTPError as e:
+            raise FleetError(f"HTTP {e.code} from {path}", retry=e.code >= 500)
+        except (OSError, ValueError) as e:
+            raise FleetError(f"{path}: {e}")
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise FleetError(f"{path}: invalid JSON response", retry=False)
+
+    async def _call(self, sem, node, method, path, payload=None, kind=None):
+        import asyncio
+        for attempt in range(1, self.retries + 1):
+            async with sem:
+                try:
+                    return await asyncio.to_thread(self._request, node, method, path, payload)
+                except FleetError as e:
+                    if not e.retry or attempt == self.retries:
+                        raise
+                    logger.info("Fleet node %s: %s (attempt %d)", node["name"], e, attempt)
+                    if kind:
+                        self._set(node, kind, attempts=attempt, message=str(e))
+            await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    # --- pushing ACLs ---
+
+    async def _push_node(self, sem, node, payload):
+        self._set(node, "push", state="running", message="Pushing ACLs", attempts=0)
+        started = time.monotonic()
+        try:
+            result = await self._call(sem, node, "PUT", "/agent/acl", payload, kind="push")
+            job_id = result.get("job_id")
+            message = "ACLs already up to date"
+            if job_id:
+                job = await self._wait_job(sem, node, job_id)
+                if job.get("state") != "done":
+                    raise FleetError(job.get("message") or "Apply failed", retry=False)
+                message = job.get("message") or "Applied"
+        except FleetError as e:
+            self._set(node, "push", state="failed", message=str(e),
+                      duration=time.monotonic() - started)
+            return False
+        self._set(node, "push", state="done", message=message, version=payload["version"],
+                  duration=time.monotonic() - started)
+        return True
+
+    async def _wait_job(self, sem, node, job_id):
+        import asyncio
+        deadline = time.monotonic() + FLEET_APPLY_WAIT_SECONDS
+        while True:
+            job = await self._call(sem, node, "GET", f"/agent/apply_status/{job_id}", kind="push")
+            if job.get("state") in ("done", "failed") or time.monotonic() > deadline:
+                return job
+            await asyncio.sleep(FLEET_APPLY_POLL_SECONDS)
+
+    async def _push_all(self, payload):
+        import asyncio
+        sem = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self._push_node(sem, node, payload) for node in self.nodes()))
+
+    def push(self, payload):
+        """Push the lists to every node in the background.
+
+        A push requested while one is running is coalesced into a single
+        follow-up push of the latest lists.
+        """
+        with self.lock:
+            self._next_payload = payload
+            if self._push_thread is not None and self._push_thread.is_alive():
+                return
+            self._push_thread = threading.Thread(target=self._push_loop, name="fleet-push", daemon=True)
+            self._push_thread.start()
+
+    def _push_loop(self):
+        import asyncio
+        while True:
+            with self.lock:
+                payload, self._next_payload = self._next_payload, None
+                if payload is None:
+                    self._push_thread = None
+                    return
+            try:
+                asyncio.run(self._push_all(payload))
+            except Exception:
+                logger.exception("Fleet push failed")
+
+    # --- pulling aggregates ---
+
+    async def _pull_node(self, sem, node):
+        try:
+            result = await self._call(sem, node, "GET", "/agent/denied", kind="pull")
+        except FleetError as e:
+            self._set(node, "pull", state="failed", message=str(e))
+            return None
+        aggregate = LogAggregate.from_dict({"domains": result.get("domains", {})})
+        self._set(node, "pull", state="done", message="", domains=len(aggregate.domains))
+        return aggregate
+
+    async def _pull_all(self):
+        import asyncio
+        sem = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self._pull_node(sem, node) for node in self.nodes()))
+
+    def collect(self):
+        """Merged domain aggregate of all reachable nodes, cached briefly."""
+        import asyncio
+        with self.lock:
+            if self._pulled is not None and time.monotonic() - self._pulled_at < self.pull_ttl:
+                return self._pulled
+        merged = LogAggregate()
+        for aggregate in asyncio.run(self._pull_all()):
+            if aggregate is not None:
+                merged.merge(aggregate)
+        with self.lock:
+            self._pulled = merged
+            self._pulled_at = time.monotonic()
+        return merged
@@ -0,0 +1,273 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+from itertools import islice
+
+from log_index import clean_domain
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 60 * 60
+MINUTE_RETENTION_SECONDS = 48 * HOUR
+HOUR_RETENTION_SECONDS = 30 * 24 * HOUR
+COMPACT_INTERVAL_SECONDS = 10 * MINUTE
+# Log files (by inode) whose ingested offset is remembered.
+INGESTED_FILES_KEPT = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS minute_hits (
+    domain_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    denied INTEGER NOT NULL,
+    PRIMARY KEY (domain_id, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS minute_hits_bucket ON minute_hits (bucket);
+CREATE TABLE IF NOT EXISTS hour_hits (
+    domain_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    denied INTEGER NOT NULL,
+    PRIMARY KEY (domain_id, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS hour_hits_bucket ON hour_hits (bucket);
+CREATE TABLE IF NOT EXISTS domain_clients (
+    domain_id INTEGER NOT NULL,
+    client TEXT NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (domain_id, client)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ingested (
+    inode INTEGER PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+UPSERT_MINUTE_HITS = """
+INSERT INTO minute_hits (domain_id, bucket, hits, denied) VALUES (?, ?, ?, ?)
+ON CONFLICT (domain_id, bucket) DO UPDATE SET
+    hits = hits + excluded.hits, denied = denied + excluded.denied
+"""
+
+ROLLUP_HOURS = """
+INSERT INTO hour_hits (domain_id, bucket, hits, denied)
+SELECT domain_id, bucket / 3600 * 3600, SUM(hits), SUM(denied)
+FROM minute_hits WHERE bucket < ? GROUP BY 1, 2
+ON CONFLICT (domain_id, bucket) DO UPDATE SET
+    hits = hits + excluded.hits, denied = denied + excluded.denied
+"""
+
+UPSERT_INGESTED = """
+INSERT INTO ingested (inode, offset, updated) VALUES (?, ?, ?)
+ON CONFLICT (inode) DO UPDATE SET offset = excluded.offset, updated = excluded.updated
+"""
+
+UPSERT_CLIENT = """
+INSERT INTO domain_clients (domain_id, client, last_seen) VALUES (?, ?, ?)
+ON CONFLICT (domain_id, client) DO UPDATE SET
+    last_seen = MAX(last_seen, excluded.last_seen)
+"""
+
+
+class HitStore:
+    """Per-domain hit counters in SQLite, bucketed per minute.
+
+    Storage is bounded by distinct domains x retained buckets: minute buckets
+    are kept for MINUTE_RETENTION_SECONDS and then rolled up into hourly
+    buckets, which are kept for HOUR_RETENTION_SECONDS.
+
+    The log offset counted so far is stored with the counts, so lines the
+    index reads again (after losing its state) are not counted twice.
+
+    As a LogIndex listener use enqueue(): batches are written (and the
+    store compacted) by a background thread, never under the index lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._domain_ids = {}
+        self._last_compact = 0.0
+        # inode -> offset of the last line counted; and the same for lines
+        # seen by this process, to tell a truncated log from a re-read one.
+        self._ingested = {}
+        self._live = {}
+        self._queue = queue.Queue()
+        self._thread = None
+        # Not self.lock: queries hold that during SQLite I/O.
+        self._thread_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            self._ingested = dict(conn.execute("SELECT inode, offset FROM ingested"))
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _domain_id(self, conn, name):
+        domain_id = self._domain_ids.get(name)
+        if domain_id is None:
+            conn.execute("INSERT OR IGNORE INTO domains (name) VALUES (?)", (name,))
+            (domain_id,) = conn.execute("SELECT id FROM domains WHERE name = ?", (name,)).fetchone()
+            self._domain_ids[name] = domain_id
+        return domain_id
+
+    # --- ingestion ---
+
+    def enqueue(self, lines, position=None):
+        """Hand a batch to the writer thread; cheap enough for a listener."""
+        self._queue.put((lines, position))
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="hit-store", daemon=True)
+                    self._thread.start()
+
+    def flush(self):
+        """Wait until every enqueued batch has been written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            lines, position = self._queue.get()
+            try:
+                self.ingest(lines, position)
+                if time.time() - self._last_compact > COMPACT_INTERVAL_SECONDS:
+                    self.compact()
+            except Exception:
+                logger.exception("Writing %d log lines to %s failed", len(lines), self.path)
+            finally:
+                self._queue.task_done()
+
+    def ingest(self, lines, position=None):
+        """Roll a batch of split log lines into minute buckets in one transaction.
+
+        position is LogIndex.batch_position, (inode, end offset of each line);
+        lines ending at or before the offset already ingested are skipped.
+        """
+        inode, ends = position or (None, [])
+        skip = 0
+        if inode is not None and ends:
+            done = self._ingested.get(inode, 0)
+            if ends[0] <= self._live.get(inode, -1):
+                # Re-read within this process: the file was truncated.
+                done = 0
+            skip = bisect_right(ends, done)
+        buckets = {}
+        clients = {}
+        for parts in islice(lines, skip, None):
+            if len(parts) <= 6:
+                continue
+            domain = clean_domain(parts[6])
+            if not domain:
+                continue
+            try:
+                ts = float(parts[0])
+            except ValueError:
+                continue
+            counts = buckets.setdefault((domain, int(ts) // MINUTE * MINUTE), [0, 0])
+            counts[0] += 1
+            if parts[3].startswith("TCP_DENIED"):
+                counts[1] += 1
+            key = (domain, parts[2])
+            if ts > clients.get(key, 0):
+                clients[key] = ts
+        if not buckets and inode is None:
+            return
+        with self.lock:
+            conn = self._conn()
+            with conn:
+                if inode is not None and ends:
+                    conn.execute(UPSERT_INGESTED, (inode, ends[-1], time.time()))
+                conn.executemany(UPSERT_MINUTE_HITS, [
+                    (self._domain_id(conn, domain), bucket, hits, denied)
+                    for (domain, bucket), (hits, denied) in buckets.items()
+                ])
+                conn.executemany(UPSERT_CLIENT, [
+                    (self._domain_id(conn, domain), client, ts)
+                    for (domain, client), ts in clients.items()
+                ])
+            if inode is not None and ends:
+                self._ingested[inode] = self._live[inode] = ends[-1]
+
+    def compact(self, now=None):
+        now = now if now is not None else time.time()
+        minute_cutoff = int(now - MINUTE_RETENTION_SECONDS) // HOUR * HOUR
+        hour_cutoff = int(now - HOUR_RETENTION_SECONDS)
+        with self.lock:
+            conn = self._conn()
+            with conn:
+                conn.execute(ROLLUP_HOURS, (minute_cutoff,))
+                conn.execute("DELETE FROM minute_hits WHERE bucket < ?", (minute_cutoff,))
+                conn.execute("DELETE FROM hour_hits WHERE bucket < ?", (hour_cutoff,))
+                conn.execute("DELETE FROM domain_clients WHERE last_seen < ?", (hour_cutoff,))
+                conn.execute("DELETE FROM ingested WHERE inode NOT IN "
+                             "(SELECT inode FROM ingested ORDER BY updated DESC LIMIT ?)",
+                             (INGESTED_FILES_KEPT,))
+            self._last_compact = time.time()
+
+    # --- queries ---
+
+    def _buckets_since(self, since):
+        # Minute buckets where still available, hourly roll-ups before that.
+        return (
+            "SELECT domain_id, bucket, hits, denied FROM minute_hits WHERE bucket >= :since "
+            "UNION ALL "
+            "SELECT domain_id, bucket, hits, denied FROM hour_hits WHERE bucket >= :since"
+        ), {"since": int(since)}
+
+    def top_denied(self, seconds, limit=20, now=None):
+        now = now if now is not None else time.time()
+        buckets, params = self._buckets_since(now - seconds)
+        params["limit"] = limit
+        sql = (
+            "SELECT d.name, SUM(b.denied) AS denied, SUM(b.hits) AS hits, "
+            "(SELECT COUNT(*) FROM domain_clients c "
+            "WHERE c.domain_id = d.id AND c.last_seen >= :since) AS clients "
+            f"FROM ({buckets}) b JOIN domains d ON d.id = b.domain_id "
+            "GROUP BY d.id HAVING SUM(b.denied) > 0 ORDER BY denied DESC, d.name LIMIT :limit"
+        )
+        with self.lock:
+            rows = self._conn().execute(sql, params).fetchall()
+        return [{"domain": name, "denied": denied, "hits": hits, "clients": clients}
+                for name, denied, hits, clients in rows]
+
+    def sparkline(self, domain, seconds, points=60, now=None):
+        """Hit counts for domain over the last `seconds`, in `points` equal steps."""
+        now = now if now is not None else time.time()
+        since = now - seconds
+        step = max(seconds / points, 1)
+        buckets, params = self._buckets_since(since)
+        params["name"] = domain
+        sql = (
+            f"SELECT b.bucket, b.hits, b.denied FROM ({buckets}) b "
+            "JOIN domains d ON d.id = b.domain_id WHERE d.name = :name"
+        )
+        with self.lock:
+            rows = self._conn().execute(sql, params).fetchall()
+        hits = [0] * points
+        denied = [0] * points
+        for bucket, h, d in rows:
+            i = int((bucket - since) // step)
+            if 0 <= i < points:
+                hits[i] += h
+                denied[i] += d
+        return {"domain": domain, "since": since, "step": step, "hits": hits, "denied": denied}
@@ -92,8 +92,13 @@ EOF
 chmod 600 "$APP_DIR/db_config.py"
 
 echo "Copying base allow list..."
-sudo cp "$APP_DIR/allowed_paw.acl" /etc/squid/allowed_paw.acl || touch /etc/squid/allowed_paw.acl
-sudo chmod 666 /etc/squid/allowed_paw.acl
+# The app replaces its lists atomically (temp file + rename), so it needs to
+# own the directory they live in, not just the files.
+sudo install -d -o "$USER" -g proxy -m 2775 /etc/squid/paw
+sudo cp "$APP_DIR/allowed_paw.acl" /etc/squid/paw/allowed_paw.acl || sudo touch /etc/squid/paw/allowed_paw.acl
+sudo touch /etc/squid/paw/hidden_domains.txt
+sudo chown "$USER":proxy /etc/squid/paw/allowed_paw.acl /etc/squid/paw/hidden_domains.txt
+sudo chmod 664 /etc/squid/paw/allowed_paw.acl /etc/squid/paw/hidden_domains.txt
 
 # ==== BEGIN: Use Working Squid Config ====
 echo ""
@@ -120,7 +125,7 @@ acl Safe_ports port 280
 acl Safe_ports port 488
 acl Safe_ports port 591
 acl Safe_ports port 777
-acl PAW_Access dstdomain "/etc/squid/allowed_paw.acl"
+acl PAW_Access dstdomain "/etc/squid/paw/allowed_paw.acl"
 
 http_access deny !Safe_ports
 http_access deny CONNECT !SSL_ports
@@ -142,9 +147,9 @@ if [ -f ERR_ACCESS_DENIED.html ]; then
     sudo cp ERR_ACCESS_DENIED.html /usr/share/squid/errors/English/ERR_ACCESS_DENIED
 fi
 
-if [ ! -f /etc/squid/allowed_paw.acl ]; then
+if [ ! -f /etc/squid/paw/allowed_paw.acl ]; then
     echo "---------------------------------------------"
-    echo "WARNING: /etc/squid/allowed_paw.acl does NOT exist."
+    echo "WARNING: /etc/squid/paw/allowed_paw.acl does NOT exist."
     echo "Please create this file with one domain per line, e.g.:"
     echo "  .windowsupdate.com"
     echo "  .microsoft.com"
@@ -157,6 +162,8 @@ sudo systemctl restart squid
 echo "Setting up sudoers for squid restart..."
 SUDOERS_LINE="$USER ALL=NOPASSWD: /bin/systemctl restart squid"
 sudo grep -qxF "$SUDOERS_LINE" /etc/sudoers || echo "$SUDOERS_LINE" | sudo EDITOR='tee -a' visudo > /dev/null
+SQUID_SUDOERS_LINE="$USER ALL=NOPASSWD: /usr/sbin/squid -k parse, /usr/sbin/squid -k reconfigure"
+sudo grep -qxF "$SQUID_SUDOERS_LINE" /etc/sudoers || echo "$SQUID_SUDOERS_LINE" | sudo EDITOR='tee -a' visudo > /dev/null
 
 echo "Generating self-signed SSL cert for nginx..."
 sudo mkdir -p /etc/nginx/ssl
@@ -197,6 +204,8 @@ After=network.target
 User=$USER
 WorkingDirectory=$APP_DIR
 Environment="PATH=$VENV_DIR/bin"
+Environment="PAW_ALLOW_LIST_FILE=/etc/squid/paw/allowed_paw.acl"
+Environment="PAW_HIDDEN_LIST_FILE=/etc/squid/paw/hidden_domains.txt"
 ExecStart=$VENV_DIR/bin/python app.py
 
 [Install]
@@ -23,8 +23,13 @@ pip install --upgrade pip
 pip install -r requirements.txt
 
 echo "Copying base allow list..."
-sudo cp "$APP_DIR/allowed_paw.acl" /etc/squid/allowed_paw.acl
-sudo chmod 666 /etc/squid/allowed_paw.acl
+# The app replaces its lists atomically (temp file + rename), so it needs to
+# own the directory they live in, not just the files.
+sudo install -d -o "$USER" -g proxy -m 2775 /etc/squid/paw
+sudo cp "$APP_DIR/allowed_paw.acl" /etc/squid/paw/allowed_paw.acl || sudo touch /etc/squid/paw/allowed_paw.acl
+sudo touch /etc/squid/paw/hidden_domains.txt
+sudo chown "$USER":proxy /etc/squid/paw/allowed_paw.acl /etc/squid/paw/hidden_domains.txt
+sudo chmod 664 /etc/squid/paw/allowed_paw.acl /etc/squid/paw/hidden_domains.txt
 
 # ==== BEGIN: Squid Config Generation (Non-Interactive, with full recommended config) ====
 echo ""
@@ -57,7 +62,7 @@ acl Safe_ports port 280 # http-mgmt
 acl Safe_ports port 488 # gss-http
 acl Safe_ports port 591 # filemaker
 acl Safe_ports port 777 # multiling http
-acl PAW_Access dstdomain "/etc/squid/allowed_paw.acl"
+acl PAW_Access dstdomain "/etc/squid/paw/allowed_paw.acl"
 
 # Deny requests to certain unsafe ports
 http_access deny !Safe_ports
@@ -90,9 +95,9 @@ EOF
 
 echo "New /etc/squid/squid.conf written."
 
-if [ ! -f /etc/squid/allowed_paw.acl ]; then
+if [ ! -f /etc/squid/paw/allowed_paw.acl ]; then
     echo "---------------------------------------------"
-    echo "WARNING: /etc/squid/allowed_paw.acl does NOT exist."
+    echo "WARNING: /etc/squid/paw/allowed_paw.acl does NOT exist."
     echo "Please create this file with one domain per line, e.g.:"
     echo "  .windowsupdate.com"
     echo "  .microsoft.com"
@@ -109,6 +114,10 @@ SUDOERS_LINE="$USER ALL=NOPASSWD: /bin/systemctl restart squid"
 if ! sudo grep -q "$SUDOERS_LINE" /etc/sudoers; then
     echo "$SUDOERS_LINE" | sudo EDITOR='tee -a' visudo > /dev/null
 fi
+SQUID_SUDOERS_LINE="$USER ALL=NOPASSWD: /usr/sbin/squid -k parse, /usr/sbin/squid -k reconfigure"
+if ! sudo grep -q "$SQUID_SUDOERS_LINE" /etc/sudoers; then
+    echo "$SQUID_SUDOERS_LINE" | sudo EDITOR='tee -a' visudo > /dev/null
+fi
 
 echo "Generating self-signed SSL cert for nginx..."
 sudo mkdir -p /etc/nginx/ssl
@@ -149,6 +158,8 @@ After=network.target
 User=$USER
 WorkingDirectory=$APP_DIR
 Environment="PATH=$VENV_DIR/bin"
+Environment="PAW_ALLOW_LIST_FILE=/etc/squid/paw/allowed_paw.acl"
+Environment="PAW_HIDDEN_LIST_FILE=/etc/squid/paw/hidden_domains.txt"
 ExecStart=$VENV_DIR/bin/python app.py
 
 [Install]
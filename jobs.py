@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = 4
+MAX_JOBS_KEPT = 200
+# Scheduling priority added to worker threads, so a log scan yields the CPU
+# to request threads (on a single core it otherwise holds whole time slices).
+JOB_NICE = 10
+# Budget for retained results, counted in rows (see result_size).
+MAX_RESULT_ITEMS = 200000
+
+
+def result_size(result):
+    """Rough size of a job result: list lengths, summed through dicts."""
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(result_size(value) for value in result.values()) or 1
+    return 1
+
+
+def _lower_priority(nice):
+    # Linux applies nice values per thread.
+    if not nice:
+        return
+    try:
+        tid = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, tid, os.getpriority(os.PRIO_PROCESS, tid) + nice)
+    except (AttributeError, OSError):
+        pass
+
+
+class JobRegistry:
+    """Runs slow work (log scans, history and fleet pulls) on a worker pool.
+
+    Handlers call cached(key, fn): a finished result for the same key is
+    returned straight away, otherwise the work is started (or joined, if
+    already running for that key) and the handler answers with the job id so
+    the page can poll /jobs/<id> instead of holding a worker thread. Keys
+    describe what is computed; for inputs that keep moving (a growing log),
+    pass version= and the last result is served while a newer one builds.
+    Finished jobs are trimmed to `keep` and their results to
+    `max_result_items` rows, oldest first.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, keep=MAX_JOBS_KEPT, max_result_items=MAX_RESULT_ITEMS,
+                 name="job", nice=JOB_NICE):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name,
+                                           initializer=_lower_priority, initargs=(nice,))
+        self.keep = keep
+        self.max_result_items = max_result_items
+        self.lock = threading.Lock()
+        self.jobs = {}
+        # key -> newest job, and newest successful job
+        self._by_key = {}
+        self._done_by_key = {}
+
+    def submit(self, name, fn, *args, key=None, version=None):
+        with self.lock:
+            if key is not None:
+                job = self.jobs.get(self._by_key.get(key))
+                if job is not None and (job["state"] in ("queued", "running") or
+                                        job["state"] == "done" and version is None):
+                    return job["id"]
+            job = {
+                "id": uuid.uuid4().hex,
+                "name": name,
+                "state": "queued",
+                "message": "",
+                "created": time.time(),
+                "finished": None,
+                "duration": None,
+                "key": key,
+                "result": None,
+                "version": None,
+                "size": 0,
+            }
+            self.jobs[job["id"]] = job
+            if key is not None:
+                self._by_key[key] = job["id"]
+            self._trim()
+        self.executor.submit(self._run, job, fn, args, version)
+        return job["id"]
+
+    def _run(self, job, fn, args, version):
+        started = time.monotonic()
+        with self.lock:
+            job["state"] = "running"
+        try:
+            result = fn(*args)
+            state, message = "done", ""
+        except Exception as e:
+            logger.exception("Job %s failed", job["name"])
+            result, state, message = None, "failed", str(e)
+        # Taken after fn, which may itself have moved the version on.
+        current = version() if version is not None and state == "done" else None
+        with self.lock:
+            job["result"] = result
+            job["state"] = state
+            job["message"] = message
+            job["finished"] = time.time()
+            job["duration"] = time.monotonic() - started
+            job["version"] = current
+            job["size"] = result_size(result) if state == "done" else 0
+            if state == "done" and job["key"] is not None:
+                previous = self._done_by_key.get(job["key"])
+                self._done_by_key[job["key"]] = job["id"]
+                if previous in self.jobs and previous != job["id"]:
+                    self._forget(self.jobs[previous])
+            self._trim()
+
+    def _forget(self, job):
+        del self.jobs[job["id"]]
+        for index in (self._by_key, self._done_by_key):
+            if job["key"] is not None and index.get(job["key"]) == job["id"]:
+                del index[job["key"]]
+
+    def _trim(self):
+        finished = [j for j in self.jobs.values() if j["state"] in ("done", "failed")]
+        finished.sort(key=lambda j: j["created"])
+        excess = len(self.jobs) - self.keep
+        size = sum(j["size"] for j in finished)
+        # The newest finished job stays, however large, so it can be fetched.
+        for job in finished[:-1]:
+            if excess <= 0 and size <= self.max_result_items:
+                break
+            self._forget(job)
+            excess -= 1
+            size -= job["size"]
+
+    def get(self, job_id):
+        """Public view of a job (without its result)."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return {k: v for k, v in job.items() if k not in ("result", "key", "version")}
+
+    def cached(self, name, key, fn, *args, version=None):
+        """Return (True, result) if a finished job for key exists, else (False, job_id).
+
+        With version, a callable such as LogIndex.position, each result
+        remembers version() as of when it finished; once that has moved on
+        the result is still returned, and a rebuild is started (or joined).
+        """
+        with self.lock:
+            job = self.jobs.get(self._done_by_key.get(key))
+        if job is None:
+            return False, self.submit(name, fn, *args, key=key, version=version)
+        if version is not None and job["version"] != version():
+            self.submit(name, fn, *args, key=key, version=version)
+        return True, job["result"]
@@ -0,0 +1,163 @@
+import json
+import queue
+import threading
+from collections import Counter, OrderedDict
+from itertools import islice
+
+from log_index import clean_domain
+
+POLL_INTERVAL_SECONDS = 1.0
+CLIENT_QUEUE_SIZE = 256
+KEEPALIVE_SECONDS = 15.0
+# Domains remembered beyond what the log aggregate can answer for (e.g.
+# after a rotation, or outside the sketch's top-K), least recently seen
+# dropped first.
+KNOWN_DOMAINS_MAX = 100000
+
+
+class Subscription:
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, event):
+        # A slow browser must never stall the follower: drop its oldest
+        # queued event instead and tell it how much it missed.
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class LogFollower:
+    """One shared tail of the squid log fanned out to every SSE client.
+
+    The follower thread drives LogIndex.refresh() (so rotation handling and
+    parsing happen once) and turns each batch of new lines into
+    "new_domain" and "denied" events for all subscribers.
+    """
+
+    def __init__(self, log_index, poll_interval=POLL_INTERVAL_SECONDS, queue_size=CLIENT_QUEUE_SIZE,
+                 known_max=KNOWN_DOMAINS_MAX):
+        self.log_index = log_index
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.known_max = known_max
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self._known = None
+        self._thread = None
+        self._stop = threading.Event()
+        log_index.listeners.append(self._on_lines)
+
+    def subscribe(self):
+        sub = Subscription(self.queue_size)
+        with self.lock:
+            self.subscribers.add(sub)
+            self._ensure_thread()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="log-follower", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.lock:
+                if not self.subscribers:
+                    self._thread = None
+                    return
+            self.log_index.refresh()
+            self._stop.wait(self.poll_interval)
+
+    def _on_lines(self, batch):
+        # Called by LogIndex with its lock held, for whoever triggered the
+        # refresh; skip the work entirely when nobody is listening.
+        with self.lock:
+            subscribers = list(self.subscribers)
+        if not subscribers:
+            self._known = None
+            return
+        in_batch = Counter()
+        for parts in batch:
+            if len(parts) > 6:
+                in_batch[clean_domain(parts[6])] += 1
+        aggregate = self.log_index.aggregate
+        if self._known is None:
+            self._known = OrderedDict.fromkeys(islice(
+                (d for d in aggregate.domains if self._seen_before(aggregate, d, in_batch[d])),
+                self.known_max))
+        known = self._known
+        denied = {}
+        new_domains = []
+        for parts in batch:
+            if len(parts) <= 6:
+                continue
+            domain = clean_domain(parts[6])
+            if not domain:
+                continue
+            if domain in known:
+                known.move_to_end(domain)
+            else:
+                if not self._seen_before(aggregate, domain, in_batch[domain]):
+                    new_domains.append({"domain": domain, "client": parts[2], "ts": parts[0]})
+                known[domain] = None
+                if len(known) > self.known_max:
+                    known.popitem(last=False)
+            if parts[3].startswith("TCP_DENIED"):
+                entry = denied.setdefault(domain, {"domain": domain, "count": 0, "clients": []})
+                entry["count"] += 1
+                if parts[2] not in entry["clients"]:
+                    entry["clients"].append(parts[2])
+                entry["ts"] = parts[0]
+        events = [("new_domain", item) for item in new_domains]
+        events += [("denied", item) for item in denied.values()]
+        for event in events:
+            for sub in subscribers:
+                sub.offer(event)
+
+    @staticmethod
+    def _seen_before(aggregate, domain, in_batch):
+        # The aggregate has already counted this batch, so a domain was seen
+        # before it if its count is higher than its hits in the batch. In
+        # sketch mode untracked domains fall back to the count-min estimate.
+        stats = aggregate.domains.get(domain)
+        if stats is not None:
+            hits = stats["hits"]
+        elif aggregate.sketch:
+            hits = aggregate.top_domains.estimate(domain)
+        else:
+            return False
+        return hits > in_batch
+
+    def stream(self, sub):
+        """Yield SSE-formatted chunks for one subscriber until it disconnects."""
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    name, data = sub.queue.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if sub.dropped:
+                    yield f"event: dropped\ndata: {json.dumps({'count': sub.dropped})}\n\n"
+                    sub.dropped = 0
+                yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            self.unsubscribe(sub)
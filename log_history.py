@@ -0,0 +1,84 @@
+import glob
+import gzip
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from log_index import LogAggregate
+
+_ROTATION_SUFFIX = re.compile(r"\.(\d+)(\.gz)?$")
+
+
+def rotated_log_files(path):
+    """Rotated siblings of path (access.log.1, access.log.2.gz, ...), oldest last."""
+    files = []
+    for candidate in glob.glob(glob.escape(path) + ".*"):
+        match = _ROTATION_SUFFIX.search(candidate[len(path):])
+        if match and os.path.isfile(candidate):
+            files.append((int(match.group(1)), candidate))
+    return [name for _, name in sorted(files)]
+
+
+def open_log(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def scan_file(path):
+    aggregate = LogAggregate()
+    try:
+        with open_log(path) as f:
+            for raw in f:
+                aggregate.add_parts(raw.decode("utf-8", "replace").split())
+    except (OSError, EOFError):
+        # Truncated or unreadable archive: keep whatever was parsed.
+        pass
+    return aggregate
+
+
+def scan_files(paths, workers=None):
+    """Parse each file in its own worker process and merge the partials."""
+    merged = LogAggregate()
+    if not paths:
+        return merged
+    workers = min(len(paths), workers or os.cpu_count() or 1)
+    if workers <= 1:
+        partials = map(scan_file, paths)
+        for partial in partials:
+            merged.merge(partial)
+        return merged
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for partial in pool.map(scan_file, paths):
+            merged.merge(partial)
+    return merged
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class HistoryCache:
+    """Aggregate over the rotated logs, rebuilt only when the set of rotated
+    files (or any of their sizes/mtimes) changes, i.e. after logrotate."""
+
+    def __init__(self, path, workers=None):
+        self.path = path
+        self.workers = workers
+        self.lock = threading.Lock()
+        self._signature = None
+        self._aggregate = LogAggregate()
+
+    def aggregate(self):
+        with self.lock:
+            files = rotated_log_files(self.path)
+            signature = tuple(_file_signature(f) for f in files)
+            if signature != self._signature:
+                self._aggregate = scan_files(files, self.workers)
+                self._signature = signature
+            return self._aggregate
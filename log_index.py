@@ -0,0 +1,601 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import metrics
+from sketches import TOP_K, HyperLogLog, TopK, hash64
+
+logger = logging.getLogger(__name__)
+
+STATE_SAVE_INTERVAL_SECONDS = 30.0
+# Rough CPython sizes of the exact aggregate's parts (measured on squid logs).
+EXACT_DOMAIN_BYTES = 700
+EXACT_CLIENT_BYTES = 500
+EXACT_CELL_BYTES = 70
+
+
+def clean_domain(url):
+    if not url or url.startswith("http:") or url.startswith("https:"):
+        return None
+    if ':' in url:
+        url = url.split(':')[0]
+    if url.startswith("www."):
+        url = url[4:]
+    return url or None
+
+
+class ClientStats:
+    """Per-client activity; raw epoch floats, formatted only when rendered."""
+
+    __slots__ = ("first_seen", "last_seen", "hits", "denied", "domains", "denied_domains")
+
+    def __init__(self):
+        self.first_seen = None
+        self.last_seen = None
+        self.hits = 0
+        self.denied = 0
+        # domain -> hits / denied hits from this client
+        self.domains = {}
+        self.denied_domains = {}
+
+    def seen(self, ts):
+        if ts is None:
+            return
+        if self.first_seen is None or ts < self.first_seen:
+            self.first_seen = ts
+        if self.last_seen is None or ts > self.last_seen:
+            self.last_seen = ts
+
+    def merge(self, other):
+        self.seen(other.first_seen)
+        self.seen(other.last_seen)
+        self.hits += other.hits
+        self.denied += other.denied
+        for domain, n in other.domains.items():
+            self.domains[domain] = self.domains.get(domain, 0) + n
+        for domain, n in other.denied_domains.items():
+            self.denied_domains[domain] = self.denied_domains.get(domain, 0) + n
+
+    def to_list(self):
+        return [self.first_seen, self.last_seen, self.hits, self.denied, self.domains, self.denied_domains]
+
+    @classmethod
+    def from_list(cls, data):
+        stats = cls()
+        if isinstance(data, list):
+            (stats.first_seen, stats.last_seen, stats.hits, stats.denied,
+             domains, denied_domains) = data
+            stats.domains = {sys.intern(d): n for d, n in domains.items()}
+            stats.denied_domains = {sys.intern(d): n for d, n in denied_domains.items()}
+        else:
+            # Older state kept only the last-seen timestamp.
+            stats.seen(data)
+        return stats
+
+
+def _new_domain():
+    return {"hits": 0, "first_seen": None, "last_seen": None, "codes": {}}
+
+
+def _count_domain(stats, ts, code):
+    stats["hits"] += 1
+    if ts is not None:
+        if stats["first_seen"] is None or ts < stats["first_seen"]:
+            stats["first_seen"] = ts
+        if stats["last_seen"] is None or ts > stats["last_seen"]:
+            stats["last_seen"] = ts
+    stats["codes"][code] = stats["codes"].get(code, 0) + 1
+
+
+def _merge_domain(ours, theirs):
+    ours["hits"] += theirs["hits"]
+    for key, pick in (("first_seen", min), ("last_seen", max)):
+        values = [v for v in (ours[key], theirs[key]) if v is not None]
+        ours[key] = pick(values) if values else None
+    for code, n in theirs["codes"].items():
+        ours["codes"][code] = ours["codes"].get(code, 0) + n
+
+
+def _copy_domain(stats):
+    return dict(stats, codes=dict(stats["codes"]))
+
+
+def _never(domain):
+    return False
+
+
+class LogAggregate:
+    """Everything the views need from the log, built in a single pass."""
+
+    sketch = False
+
+    def __init__(self):
+        # domain -> {"hits", "first_seen", "last_seen", "codes": {result: n}}
+        self.domains = {}
+        # client ip -> ClientStats
+        self.clients = {}
+        # Entries in the clients' per-domain maps, for memory_estimate().
+        self.cells = 0
+
+    def add_parts(self, parts):
+        if len(parts) <= 2:
+            return
+        try:
+            ts = float(parts[0])
+        except ValueError:
+            ts = None
+        client = self.clients.get(parts[2])
+        if client is None:
+            client = self.clients[sys.intern(parts[2])] = ClientStats()
+        client.seen(ts)
+        if len(parts) <= 6:
+            return
+        domain = clean_domain(parts[6])
+        if not domain:
+            return
+        code = parts[3].split('/')[0]
+        stats = self.domains.get(domain)
+        if stats is None:
+            domain = sys.intern(domain)
+            stats = self.domains[domain] = _new_domain()
+        _count_domain(stats, ts, code)
+        client.hits += 1
+        n = client.domains.get(domain)
+        if n is None:
+            self.cells += 1
+        client.domains[domain] = (n or 0) + 1
+        if code == "TCP_DENIED":
+            client.denied += 1
+            n = client.denied_domains.get(domain)
+            if n is None:
+                self.cells += 1
+            client.denied_domains[domain] = (n or 0) + 1
+
+    def merge(self, other):
+        for ip, theirs in other.clients.items():
+            ours = self.clients.get(ip)
+            if ours is None:
+                ours = self.clients[ip] = ClientStats()
+            ours.merge(theirs)
+        for domain, theirs in other.domains.items():
+            ours = self.domains.get(domain)
+            if ours is None:
+                self.domains[domain] = _copy_domain(theirs)
+            else:
+                _merge_domain(ours, theirs)
+        self.cells = sum(len(c.domains) + len(c.denied_domains) for c in self.clients.values())
+
+    def copy(self):
+        copy = LogAggregate()
+        copy.merge(self)
+        return copy
+
+    def memory_estimate(self):
+        """Approximate bytes held, to decide when to switch to a SketchAggregate."""
+        return (len(self.domains) * EXACT_DOMAIN_BYTES + len(self.clients) * EXACT_CLIENT_BYTES +
+                self.cells * EXACT_CELL_BYTES)
+
+    def to_dict(self):
+        return {
+            "domains": self.domains,
+            "clients": {ip: stats.to_list() for ip, stats in self.clients.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        agg = cls()
+        agg.domains = {sys.intern(d): stats for d, stats in data.get("domains", {}).items()}
+        agg.clients = {sys.intern(ip): ClientStats.from_list(stats)
+                       for ip, stats in data.get("clients", {}).items()}
+        agg.cells = sum(len(c.domains) + len(c.denied_domains) for c in agg.clients.values())
+        return agg
+
+
+class SketchAggregate:
+    """Fixed-memory stand-in for LogAggregate on very large logs.
+
+    Distinct domains and clients are estimated with HyperLogLog and only the
+    busiest ones (TopK) are kept, counted exactly from the moment they are
+    admitted. Domains that are on the allow or hidden list when first seen
+    keep exact counts, so the known part of the traffic stays accurate.
+    `domains` and `clients` have LogAggregate's shapes, limited to what is
+    tracked; clients carry no per-domain breakdown and their hits count
+    every request.
+    """
+
+    sketch = True
+
+    def __init__(self, top_k=TOP_K):
+        self.exact = {}
+        self.domain_hll = HyperLogLog()
+        self.client_hll = HyperLogLog()
+        self.top_domains = TopK(top_k)
+        self.top_clients = TopK(top_k)
+        # Set by LogIndex before each batch: domain -> True if on a list.
+        self.is_listed = _never
+        self._link()
+
+    def _link(self):
+        self.domains = dict(self.top_domains.data)
+        self.domains.update(self.exact)
+        self.clients = dict(self.top_clients.data)
+        self.top_domains.on_evict = self.domains.pop
+        self.top_clients.on_evict = self.clients.pop
+
+    def add_parts(self, parts):
+        if len(parts) <= 2:
+            return
+        try:
+            ts = float(parts[0])
+        except ValueError:
+            ts = None
+        ip = parts[2]
+        client = self.clients.get(ip)
+        if client is None:
+            h = hash64(ip)
+            self.client_hll.add_hash(h)
+            client = self.top_clients.add(ip, ClientStats, h=h)
+            if client is not None:
+                self.clients[ip] = client
+                client.hits = self.top_clients.counts[ip] - 1
+        else:
+            self.top_clients.add(ip, ClientStats)
+        if client is not None:
+            client.seen(ts)
+            client.hits += 1
+        if len(parts) <= 6:
+            return
+        domain = clean_domain(parts[6])
+        if not domain:
+            return
+        code = parts[3].split('/')[0]
+        if client is not None and code == "TCP_DENIED":
+            client.denied += 1
+        stats = self.domains.get(domain)
+        if stats is None:
+            h = hash64(domain)
+            self.domain_hll.add_hash(h)
+            if self.is_listed(domain):
+                stats = self.exact[domain] = self.domains[domain] = _new_domain()
+            else:
+                stats = self.top_domains.add(domain, _new_domain, h=h)
+                if stats is None:
+                    return
+                self.domains[domain] = stats
+                stats["hits"] = self.top_domains.counts[domain] - 1
+        elif domain not in self.exact:
+            self.top_domains.add(domain, _new_domain)
+        _count_domain(stats, ts, code)
+
+    def _merge_domain(self, domain, theirs, listed):
+        ours = self.domains.get(domain)
+        if ours is None:
+            self.domain_hll.add(domain)
+            if listed or self.is_listed(domain):
+                ours = self.exact[domain] = self.domains[domain] = _new_domain()
+            else:
+                ours = self.top_domains.add(domain, _new_domain, n=theirs["hits"])
+                if ours is None:
+                    return
+                self.domains[domain] = ours
+                ours["hits"] = self.top_domains.counts[domain] - theirs["hits"]
+        elif domain not in self.exact:
+            self.top_domains.add(domain, _new_domain, n=theirs["hits"])
+        _merge_domain(ours, theirs)
+
+    def _merge_client(self, ip, theirs):
+        n = max(theirs.hits, 1)
+        ours = self.clients.get(ip)
+        if ours is None:
+            self.client_hll.add(ip)
+            ours = self.top_clients.add(ip, ClientStats, n=n)
+            if ours is None:
+                return
+            self.clients[ip] = ours
+            ours.hits = self.top_clients.counts[ip] - n
+        else:
+            self.top_clients.add(ip, ClientStats, n=n)
+        ours.seen(theirs.first_seen)
+        ours.seen(theirs.last_seen)
+        ours.hits += n
+        ours.denied += theirs.denied
+
+    def merge(self, other):
+        if other.sketch:
+            self.domain_hll.merge(other.domain_hll)
+            self.client_hll.merge(other.client_hll)
+            self.top_domains.sketch.merge(other.top_domains.sketch)
+            self.top_clients.sketch.merge(other.top_clients.sketch)
+        for domain, theirs in other.domains.items():
+            self._merge_domain(domain, theirs, other.sketch and domain in other.exact)
+        for ip, theirs in other.clients.items():
+            self._merge_client(ip, theirs)
+
+    @classmethod
+    def from_exact(cls, aggregate, is_listed=_never, top_k=TOP_K):
+        sketch = cls(top_k)
+        sketch.is_listed = is_listed
+        sketch.merge(aggregate)
+        return sketch
+
+    def copy(self):
+        copy = SketchAggregate.__new__(SketchAggregate)
+        copy.exact = {d: _copy_domain(stats) for d, stats in self.exact.items()}
+        copy.domain_hll = self.domain_hll.copy()
+        copy.client_hll = self.client_hll.copy()
+        copy.top_domains = self.top_domains.copy(_copy_domain)
+        copy.top_clients = self.top_clients.copy(lambda stats: ClientStats.from_list(stats.to_list()))
+        copy.is_listed = self.is_listed
+        copy._link()
+        return copy
+
+    def distinct_domains(self):
+        return max(self.domain_hll.count(), len(self.domains))
+
+    def distinct_clients(self):
+        return max(self.client_hll.count(), len(self.clients))
+
+    def to_dict(self):
+        return {"sketch": {
+            "exact": self.exact,
+            "domain_hll": self.domain_hll.to_dict(),
+            "client_hll": self.client_hll.to_dict(),
+            "top_domains": self.top_domains.to_dict(lambda stats: stats),
+            "top_clients": self.top_clients.to_dict(ClientStats.to_list),
+        }}
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data["sketch"]
+        agg = cls.__new__(cls)
+        agg.exact = {sys.intern(d): stats for d, stats in data["exact"].items()}
+        agg.domain_hll = HyperLogLog.from_dict(data["domain_hll"])
+        agg.client_hll = HyperLogLog.from_dict(data["client_hll"])
+        agg.top_domains = TopK.from_dict(data["top_domains"], lambda stats: stats)
+        agg.top_clients = TopK.from_dict(data["top_clients"], ClientStats.from_list)
+        agg.is_listed = _never
+        agg._link()
+        return agg
+
+
+def aggregate_from_dict(data):
+    if "sketch" in data:
+        return SketchAggregate.from_dict(data)
+    return LogAggregate.from_dict(data)
+
+
+class LogIndex:
+    """Incremental reader for the squid access.log.
+
+    Remembers the inode and byte offset of the last scan so each refresh only
+    parses lines appended since then. A change of inode (logrotate) drains the
+    old file before switching to the new one; a shrinking file is treated as a
+    truncation and re-read from the start. Like the original full scans, the
+    aggregate covers the current file only; rotated files are covered by
+    log_history.HistoryCache.
+    """
+
+    def __init__(self, path, state_file=None, memory_budget=0, sketch=False, listed_filter=None):
+        self.path = path
+        self.state_file = state_file
+        # Bytes the exact aggregate may use before it is folded into a
+        # SketchAggregate (0: no limit); sketch=True skips exact mode.
+        self.memory_budget = memory_budget
+        self.sketch = sketch
+        # Returns a predicate for "domain is on a list", fetched per batch.
+        self.listed_filter = listed_filter
+        self.lock = threading.Lock()
+        self.inode = None
+        self.offset = 0
+        self.aggregate = self._new_aggregate()
+        # Callables receiving each batch of newly parsed lines (lists of fields).
+        self.listeners = []
+        # While listeners run: the batch's inode and the byte offset at which
+        # each of its lines ends, for listeners that must not count a line twice.
+        self.batch_position = (None, [])
+        self._fh = None
+        self._last_save = 0.0
+        self._dirty = False
+        self._load_state()
+
+    # --- persistence ---
+
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if "aggregate" not in state:
+            # Older state without aggregates; rescan from the start.
+            return
+        self.inode = state.get("inode")
+        self.offset = state.get("offset", 0)
+        self.aggregate = aggregate_from_dict(state.get("aggregate", {}))
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        state = {"inode": self.inode, "offset": self.offset, "aggregate": self.aggregate.to_dict()}
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def _save_throttled(self):
+        # The state holds the whole aggregate, so writing it on every refresh
+        # would make each page cost grow with the log; save() flushes on exit.
+        self._dirty = True
+        if time.monotonic() - self._last_save >= STATE_SAVE_INTERVAL_SECONDS:
+            self._save_state()
+
+    # --- exact vs sketch mode ---
+
+    def _new_aggregate(self):
+        return SketchAggregate() if self.sketch else LogAggregate()
+
+    def _listed(self):
+        return self.listed_filter() if self.listed_filter else _never
+
+    def _prepare_batch(self):
+        if self.aggregate.sketch:
+            self.aggregate.is_listed = self._listed()
+
+    def _check_budget(self):
+        if (self.memory_budget and not self.aggregate.sketch and
+                self.aggregate.memory_estimate() > self.memory_budget):
+            logger.warning("Log aggregate for %s passed %g MB; switching to sketch mode",
+                           self.path, self.memory_budget / 2 ** 20)
+            self.aggregate = SketchAggregate.from_exact(self.aggregate, self._listed())
+
+    # --- scanning ---
+
+    def _consume(self, fh):
+        batch = []
+        ends = []
+        start_offset = self.offset
+        self._prepare_batch()
+        for raw in fh:
+            if not raw.endswith(b"\n"):
+                # Partial line still being written; pick it up next time.
+                break
+            self.offset += len(raw)
+            ends.append(self.offset)
+            parts = raw.decode("utf-8", "replace").split()
+            self.aggregate.add_parts(parts)
+            batch.append(parts)
+        self._check_budget()
+        self._indexed(batch, self.offset - start_offset, ends)
+        return len(batch)
+
+    def _indexed(self, batch, scanned, ends):
+        metrics.LOG_BYTES.inc(scanned)
+        metrics.LOG_LINES.inc(len(batch))
+        metrics.record("log_bytes", scanned)
+        metrics.record("log_lines", len(batch))
+        if batch:
+            self.batch_position = (self.inode, ends)
+            for listener in self.listeners:
+                try:
+                    listener(batch)
+                except Exception:
+                    logger.exception("Log listener %r failed", listener)
+            self.batch_position = (None, [])
+
+    def _find_rotated(self, inode):
+        # After a restart we no longer hold the old file open; look for it
+        # among the usual logrotate names so its tail isn't lost.
+        for candidate in (self.path + ".1", self.path + ".0"):
+            try:
+                if os.stat(candidate).st_ino == inode:
+                    return open(candidate, "rb")
+            except OSError:
+                continue
+        return None
+
+    def refresh(self):
+        with self.lock:
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                return 0
+            count = 0
+            if self.inode is not None and st.st_ino != self.inode:
+                old = self._fh or self._find_rotated(self.inode)
+                if old is not None:
+                    old.seek(self.offset)
+                    count += self._consume(old)
+                    old.close()
+                self._fh = None
+                self.inode = st.st_ino
+                self.offset = 0
+                self.aggregate = self._new_aggregate()
+            elif self.inode is None:
+                self.inode = st.st_ino
+                self.offset = 0
+            if st.st_size < self.offset:
+                self.offset = 0
+                self.aggregate = self._new_aggregate()
+            if self._fh is None:
+                self._fh = open(self.path, "rb")
+            self._fh.seek(self.offset)
+            count += self._consume(self._fh)
+            if count:
+                self._save_throttled()
+            return count
+
+    def append(self, lines):
+        """Append complete lines received elsewhere (UDP, syslog) and index them.
+
+        The lines are written to the end of the log purely for persistence and
+        parsed from memory, so refresh() has nothing left to read. If the file
+        moved underneath us (rotation), indexing is left to the next refresh().
+        """
+        data = b"".join(lines)
+        self.refresh()
+        with self.lock:
+            with open(self.path, "ab") as f:
+                position = f.tell()
+                f.write(data)
+                inode = os.fstat(f.fileno()).st_ino
+            if inode != self.inode or position != self.offset:
+                return 0
+            batch = []
+            ends = []
+            self._prepare_batch()
+            for raw in lines:
+                self.offset += len(raw)
+                ends.append(self.offset)
+                parts = raw.decode("utf-8", "replace").split()
+                self.aggregate.add_parts(parts)
+                batch.append(parts)
+            self._check_budget()
+            self._indexed(batch, len(data), ends)
+            self._save_throttled()
+            return len(batch)
+
+    def save(self):
+        """Write the state now if anything was indexed since the last save."""
+        with self.lock:
+            if self._dirty:
+                self._save_state()
+
+    def blocked_domains(self):
+        self.refresh()
+        with self.lock:
+            return sorted(self.aggregate.domains, key=lambda d: d.lower())
+
+    def version(self):
+        """Cheap identifier that changes whenever new lines are indexed."""
+        self.refresh()
+        with self.lock:
+            return (self.inode, self.offset)
+
+    def position(self):
+        """(inode, offset) as of the last refresh, without refreshing or locking."""
+        return (self.inode, self.offset)
+
+    def snapshot(self):
+        """Refresh once and return a private copy of the aggregate."""
+        self.refresh()
+        with self.lock:
+            return self.aggregate.copy()
+
+    def client(self, ip):
+        """Refresh once and return a copy of one client's stats, or None."""
+        self.refresh()
+        with self.lock:
+            stats = self.aggregate.clients.get(ip)
+            if stats is None:
+                return None
+            copy = ClientStats()
+            copy.merge(stats)
+            return copy
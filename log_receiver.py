@@ -0,0 +1,175 @@
+"""Receive squid access log lines over UDP instead of re-reading access.log.
+
+Point squid at the listener with either of
+
+    access_log udp://127.0.0.1:5140 squid
+    access_log syslog:local4.info squid     (with rsyslog forwarding to UDP)
+
+and set PAW_UDP_LISTEN=127.0.0.1:5140. Datagrams are parsed in batches
+straight into the LogIndex aggregates; the lines are also appended to a
+spool file so the index can be rebuilt after a restart and the time-window
+and history views keep working.
+
+Only one process can own the port. The app starts a receiver thread and, if
+the port is already taken (another gunicorn worker), simply reads the spool
+file like a normal log. `python log_receiver.py` runs the receiver on its
+own for deployments that prefer a separate daemon.
+"""
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_LINES = 500
+FLUSH_INTERVAL_SECONDS = 0.5
+SPOOL_MAX_BYTES = int(os.environ.get("PAW_UDP_SPOOL_MAX_MB", 512)) * 1024 * 1024
+# Rotated spool generations kept (.1 newest ... .N oldest).
+SPOOL_KEEP = int(os.environ.get("PAW_UDP_SPOOL_KEEP", 4))
+RECV_BUFFER_BYTES = 4 * 1024 * 1024
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def split_datagram(data):
+    """Return the squid log lines in one datagram, newline-terminated.
+
+    Squid's udp module sends one line per datagram; syslog relays prefix it
+    with "<PRI>timestamp host tag: ", which is stripped.
+    """
+    lines = []
+    for line in data.splitlines():
+        if line.startswith(b"<"):
+            sep = line.find(b": ")
+            if sep != -1:
+                line = line[sep + 2:]
+        line = line.strip()
+        if line:
+            lines.append(line + b"\n")
+    return lines
+
+
+class LogReceiver:
+    def __init__(self, log_index, address, batch_lines=BATCH_LINES,
+                 flush_interval=FLUSH_INTERVAL_SECONDS, spool_max_bytes=SPOOL_MAX_BYTES,
+                 spool_keep=SPOOL_KEEP):
+        self.log_index = log_index
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.batch_lines = batch_lines
+        self.flush_interval = flush_interval
+        self.spool_max_bytes = spool_max_bytes
+        self.spool_keep = max(1, spool_keep)
+        self.sock = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {"datagrams": 0, "lines": 0, "batches": 0}
+
+    def start(self):
+        """Bind and start the receiver thread; False if the port is taken."""
+        os.makedirs(os.path.dirname(self.log_index.path) or ".", exist_ok=True)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_BYTES)
+            sock.bind(self.address)
+        except OSError as e:
+            sock.close()
+            logger.info("UDP log receiver not started on %s:%s: %s", *self.address, e)
+            return False
+        sock.settimeout(self.flush_interval)
+        self.sock = sock
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="log-receiver", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.log_index.save()
+
+    def _run(self):
+        pending = []
+        deadline = time.monotonic() + self.flush_interval
+        while not self._stop.is_set():
+            try:
+                data = self.sock.recv(65535)
+            except socket.timeout:
+                data = None
+            except OSError:
+                logger.exception("UDP log receiver failed")
+                break
+            if data:
+                self.stats["datagrams"] += 1
+                metrics.UDP_DATAGRAMS.inc()
+                pending.extend(split_datagram(data))
+            now = time.monotonic()
+            if pending and (len(pending) >= self.batch_lines or now >= deadline):
+                self._flush(pending)
+                pending = []
+            if now >= deadline:
+                deadline = now + self.flush_interval
+        if pending:
+            self._flush(pending)
+
+    def _flush(self, lines):
+        self._rotate_spool()
+        try:
+            self.log_index.append(lines)
+        except OSError:
+            logger.exception("Writing %d log lines to %s failed", len(lines), self.log_index.path)
+            return
+        self.stats["lines"] += len(lines)
+        self.stats["batches"] += 1
+        metrics.UDP_BATCHES.inc()
+
+    def _rotate_spool(self):
+        path = self.log_index.path
+        try:
+            if os.path.getsize(path) < self.spool_max_bytes:
+                return
+        except OSError:
+            return
+        # Same shape as logrotate, so LogIndex and HistoryCache handle it:
+        # shift .N-1 -> .N (dropping the oldest), then the spool -> .1.
+        for n in range(self.spool_keep - 1, 0, -1):
+            try:
+                os.replace(f"{path}.{n}", f"{path}.{n + 1}")
+            except FileNotFoundError:
+                continue
+        os.replace(path, path + ".1")
+
+
+def main():
+    from log_index import LogIndex
+
+    parser = argparse.ArgumentParser(description="Receive squid access log lines over UDP")
+    parser.add_argument("--listen", default=os.environ.get("PAW_UDP_LISTEN", "127.0.0.1:5140"))
+    parser.add_argument("--spool", required=True, help="Spool file, used as the app's log file")
+    parser.add_argument("--state", help="LogIndex state file (defaults to <spool>.json)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    receiver = LogReceiver(LogIndex(args.spool, args.state or args.spool + ".json"), args.listen)
+    if not receiver.start():
+        raise SystemExit(f"Could not listen on {args.listen}")
+    logger.info("Receiving squid logs on %s:%s into %s", *receiver.address, args.spool)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        receiver.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Headless log triage reports, for cron.
+
+    python log_report.py                                # current log, JSON to stdout
+    python log_report.py --since-last --output /var/lib/paw/triage.json
+    python log_report.py --rotated --format csv --output /var/lib/paw/triage/
+
+Streams one or more squid logs (plain or .gz) without the web app and checks
+each host against the allow and hidden lists as it goes. Only unsorted hosts
+and clients are kept, with a few counters each, so memory follows the number
+of distinct hosts and clients, not the size of the logs. The state file
+remembers every host reported so far (for the "new hosts" section) and where
+each log was left off (for --since-last).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import psl
+from acl_store import AclFile
+from log_history import open_log, rotated_log_files
+from log_index import clean_domain
+
+DATA_DIR = os.environ.get("PAW_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+SQUID_LOG_FILE = os.environ.get("PAW_SQUID_LOG_FILE", "/var/log/squid/access.log")
+ALLOW_LIST_FILE = os.environ.get("PAW_ALLOW_LIST_FILE", "/etc/squid/allowed_paw.acl")
+HIDDEN_LIST_FILE = os.environ.get("PAW_HIDDEN_LIST_FILE", "/etc/squid/hidden_domains.txt")
+REPORT_STATE_FILE = os.path.join(DATA_DIR, "report_state.json")
+
+UNSORTED_COLUMNS = ("domain", "parent", "hits", "denied", "first_seen", "last_seen")
+CLIENT_COLUMNS = ("ip", "hits", "denied", "unsorted_hits", "first_seen", "last_seen")
+NEW_HOST_COLUMNS = ("domain", "unsorted")
+
+# Counter lists: [hits, denied, first_seen, last_seen] per unsorted host and
+# [hits, denied, first_seen, last_seen, unsorted_hits] per client.
+HITS, DENIED, FIRST_SEEN, LAST_SEEN, UNSORTED_HITS = range(5)
+
+
+def _seen(stats, ts):
+    if ts is None:
+        return
+    if stats[FIRST_SEEN] is None or ts < stats[FIRST_SEEN]:
+        stats[FIRST_SEEN] = ts
+    if stats[LAST_SEEN] is None or ts > stats[LAST_SEEN]:
+        stats[LAST_SEEN] = ts
+
+
+class TriageScan:
+    def __init__(self, allow_trie, hidden_trie, known_hosts=()):
+        self.allow_trie = allow_trie
+        self.hidden_trie = hidden_trie
+        self.known_hosts = set(known_hosts)
+        self.new_hosts = set()
+        # Hosts found on either list, so each is looked up in the tries once.
+        self.listed = set()
+        self.unsorted = {}
+        self.clients = {}
+        self.lines = 0
+        self.listed_hits = 0
+
+    def add_parts(self, parts):
+        if len(parts) <= 2:
+            return
+        self.lines += 1
+        try:
+            ts = float(parts[0])
+        except ValueError:
+            ts = None
+        client = self.clients.get(parts[2])
+        if client is None:
+            client = self.clients[sys.intern(parts[2])] = [0, 0, None, None, 0]
+        _seen(client, ts)
+        if len(parts) <= 6:
+            return
+        domain = clean_domain(parts[6])
+        if not domain:
+            return
+        denied = parts[3].split('/')[0] == "TCP_DENIED"
+        client[HITS] += 1
+        client[DENIED] += denied
+        stats = self.unsorted.get(domain)
+        if stats is None:
+            if domain in self.listed:
+                self.listed_hits += 1
+                return
+            # First sighting in this run.
+            domain = sys.intern(domain)
+            if domain not in self.known_hosts:
+                self.new_hosts.add(domain)
+            if domain in self.allow_trie or domain in self.hidden_trie:
+                self.listed.add(domain)
+                self.listed_hits += 1
+                return
+            stats = self.unsorted[domain] = [0, 0, ts, ts]
+        stats[HITS] += 1
+        stats[DENIED] += denied
+        _seen(stats, ts)
+        client[UNSORTED_HITS] += 1
+
+    def scan(self, path, offset=0):
+        """Add the complete lines of path from offset on; returns the end offset."""
+        with open_log(path) as f:
+            if offset:
+                f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    # Partial line still being written; left for the next run.
+                    break
+                offset += len(raw)
+                self.add_parts(raw.decode("utf-8", "replace").split())
+        return offset
+
+
+def load_state(path):
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    return {"hosts": state.get("hosts", []), "offsets": state.get("offsets", {})}
+
+
+def save_state(path, state):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def _inode(path):
+    try:
+        return str(os.stat(path).st_ino)
+    except OSError:
+        return None
+
+
+def scan_logs(paths, scan, offsets=None):
+    """Scan each log; with offsets ({inode: offset}), resume where the last
+    run stopped and return the updated offsets of the plain files."""
+    done = {}
+    for path in paths:
+        start = 0
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        plain = not path.endswith(".gz")
+        if not plain and offsets:
+            # Compressed archives were read as plain files before logrotate
+            # compressed them; only a first run reads them.
+            continue
+        if plain and offsets is not None:
+            start = offsets.get(str(st.st_ino), 0)
+            if start > st.st_size:
+                # Truncated, or a new file that reused the inode.
+                start = 0
+        try:
+            end = scan.scan(path, start)
+        except (OSError, EOFError):
+            continue
+        if plain:
+            done[str(st.st_ino)] = end
+    return done
+
+
+def build_report(scan, paths, parent_fn=psl.parent_entry, top=0):
+    unsorted = sorted(scan.unsorted.items(), key=lambda item: (-item[1][HITS], item[0]))
+    if top:
+        unsorted = unsorted[:top]
+    clients = sorted(scan.clients.items(), key=lambda item: (-item[1][HITS], item[0]))
+    return {
+        "generated": time.time(),
+        "files": paths,
+        "lines": scan.lines,
+        "listed_hits": scan.listed_hits,
+        "unsorted_count": len(scan.unsorted),
+        "unsorted": [
+            {"domain": d, "parent": parent_fn(d), "hits": s[HITS], "denied": s[DENIED],
+             "first_seen": s[FIRST_SEEN], "last_seen": s[LAST_SEEN]}
+            for d, s in unsorted
+        ],
+        "clients": [
+            {"ip": ip, "hits": s[HITS], "denied": s[DENIED], "unsorted_hits": s[UNSORTED_HITS],
+             "first_seen": s[FIRST_SEEN], "last_seen": s[LAST_SEEN]}
+            for ip, s in clients
+        ],
+        "new_hosts": [{"domain": d, "unsorted": d in scan.unsorted} for d in sorted(scan.new_hosts)],
+    }
+
+
+def _replace_write(path, write):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", newline="") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def write_report(report, fmt, output):
+    if fmt == "json":
+        if output == "-":
+            json.dump(report, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+        else:
+            _replace_write(output, lambda f: json.dump(report, f, indent=2))
+        return
+    os.makedirs(output, exist_ok=True)
+    for name, columns in (("unsorted", UNSORTED_COLUMNS), ("clients", CLIENT_COLUMNS),
+                          ("new_hosts", NEW_HOST_COLUMNS)):
+        def write(f, rows=report[name], columns=columns):
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        _replace_write(os.path.join(output, f"{name}.csv"), write)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write an unsorted-domain triage report from squid logs")
+    parser.add_argument("logs", nargs="*", help=f"Log files (default: {SQUID_LOG_FILE})")
+    parser.add_argument("--rotated", action="store_true", help="Also read the rotated logs (.1, .2.gz, ...), oldest first")
+    parser.add_argument("--since-last", action="store_true", help="Only read lines added since the last run")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("--output", help="JSON file (default: stdout) or directory for the CSV files")
+    parser.add_argument("--top", type=int, default=0, help="Only list the N busiest unsorted hosts")
+    parser.add_argument("--allow-list", default=ALLOW_LIST_FILE)
+    parser.add_argument("--hidden-list", default=HIDDEN_LIST_FILE)
+    parser.add_argument("--state", default=REPORT_STATE_FILE, help="State file for new hosts and --since-last")
+    parser.add_argument("--no-state", action="store_true", help="Neither read nor update the state file")
+    args = parser.parse_args(argv)
+    if args.format == "csv" and not args.output:
+        parser.error("--format csv needs --output DIRECTORY")
+
+    state = {"hosts": [], "offsets": {}} if args.no_state else load_state(args.state)
+    paths = []
+    for path in args.logs or [SQUID_LOG_FILE]:
+        if args.rotated:
+            paths += reversed(rotated_log_files(path))
+        elif args.since_last and _inode(path + ".1") in state["offsets"]:
+            # Rotated since the last run: finish the old file first.
+            paths.append(path + ".1")
+        paths.append(path)
+    psl.configure(os.path.join(DATA_DIR, "psl.table"))
+    scan = TriageScan(AclFile(args.allow_list).trie(), AclFile(args.hidden_list).trie(), state["hosts"])
+    offsets = scan_logs(paths, scan, state["offsets"] if args.since_last else None)
+    write_report(build_report(scan, paths, top=args.top), args.format, args.output or "-")
+    if not args.no_state:
+        state["offsets"] = offsets
+        state["hosts"] = sorted(scan.known_hosts | scan.new_hosts)
+        state["last_run"] = time.time()
+        save_state(args.state, state)
+
+
+if __name__ == "__main__":
+    main()
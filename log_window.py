@@ -0,0 +1,108 @@
+import mmap
+import os
+import time
+
+from log_history import open_log, rotated_log_files
+from log_index import LogAggregate
+
+WINDOWS = {
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "24h": 24 * 60 * 60,
+}
+
+
+def _line_start(mm, pos):
+    """Offset of the first line starting at or after pos."""
+    if pos <= 0:
+        return 0
+    nl = mm.find(b"\n", pos - 1)
+    return len(mm) if nl == -1 else nl + 1
+
+
+def _timestamp_at(mm, start):
+    end = mm.find(b" ", start, start + 64)
+    if end == -1:
+        return None
+    try:
+        return float(mm[start:end])
+    except ValueError:
+        return None
+
+
+def window_start_offset(mm, since):
+    """Binary search for the first line whose timestamp is >= since.
+
+    Squid's native format starts every line with an increasing epoch
+    timestamp, so the predicate is monotonic over byte offsets. Lines
+    without a parseable timestamp are treated as older than the window.
+    """
+    lo, hi = 0, len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = _line_start(mm, mid)
+        if start >= len(mm):
+            hi = mid
+            continue
+        ts = _timestamp_at(mm, start)
+        if ts is None or ts < since:
+            lo = mid + 1
+        else:
+            hi = mid
+    return _line_start(mm, lo)
+
+
+def _scan_plain(path, since, aggregate):
+    """Add lines newer than since; returns True if the file starts inside
+    the window (so older files may hold more of it)."""
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return True
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = window_start_offset(mm, since)
+                first_ts = _timestamp_at(mm, 0)
+            f.seek(offset)
+            for raw in f:
+                aggregate.add_parts(raw.decode("utf-8", "replace").split())
+    except (OSError, ValueError):
+        return True
+    return offset == 0 and (first_ts is None or first_ts >= since)
+
+
+def _scan_compressed(path, since, aggregate):
+    # Compressed archives can't be searched, so filter while streaming.
+    reached = True
+    try:
+        with open_log(path) as f:
+            for raw in f:
+                parts = raw.decode("utf-8", "replace").split()
+                try:
+                    ts = float(parts[0])
+                except (IndexError, ValueError):
+                    continue
+                if ts >= since:
+                    aggregate.add_parts(parts)
+                else:
+                    reached = False
+    except (OSError, EOFError):
+        pass
+    return reached
+
+
+def scan_window(path, seconds, now=None):
+    """Aggregate only the log lines from the last `seconds` seconds.
+
+    Reads the tail of the current log and walks back through rotated files
+    only while the window extends past the start of the newer file.
+    """
+    since = (now if now is not None else time.time()) - seconds
+    aggregate = LogAggregate()
+    for candidate in [path] + rotated_log_files(path):
+        if candidate.endswith(".gz"):
+            more = _scan_compressed(candidate, since, aggregate)
+        else:
+            more = _scan_plain(candidate, since, aggregate)
+        if not more:
+            break
+    return aggregate
@@ -0,0 +1,165 @@
+"""Minimal Prometheus-style metrics without extra dependencies.
+
+Counters, gauges and histograms are kept in-process and rendered in the
+Prometheus text exposition format by render(). Per-request values (log bytes
+scanned, DB queries, ...) are accumulated in a thread-local via record() and
+turned into histogram observations when the request ends.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (0, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 100, 1e3, 1e4, 1e5, 1e6)
+
+_lock = threading.Lock()
+_metrics = {}
+_local = threading.local()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [(self.name, key, (), value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        out = []
+        for key, (counts, count, total) in self.values.items():
+            for bound, n in zip(self.buckets, counts):
+                out.append((self.name + "_bucket", key, (("le", repr(float(bound))),), n))
+            out.append((self.name + "_bucket", key, (("le", "+Inf"),), count))
+            out.append((self.name + "_count", key, (), count))
+            out.append((self.name + "_sum", key, (), total))
+        return out
+
+
+def _register(metric):
+    with _lock:
+        existing = _metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        _metrics[metric.name] = metric
+        return metric
+
+
+def counter(name, help_text):
+    return _register(Counter(name, help_text))
+
+
+def gauge(name, help_text):
+    return _register(Gauge(name, help_text))
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help_text, buckets))
+
+
+def render():
+    lines = []
+    with _lock:
+        metrics = sorted(_metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key, extra)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- per-request accumulation ---
+
+def start_request():
+    _local.values = {}
+
+
+def finish_request():
+    values = getattr(_local, "values", None)
+    _local.values = None
+    return values or {}
+
+
+def record(key, amount=1):
+    """Add to a per-request value; a no-op outside a request."""
+    values = getattr(_local, "values", None)
+    if values is not None:
+        values[key] = values.get(key, 0) + amount
+
+
+# --- shared metric definitions ---
+
+PHASE_SECONDS = histogram("paw_phase_seconds", "Time spent in each request phase")
+REQUEST_SECONDS = histogram("paw_request_duration_seconds", "Request latency by endpoint")
+REQUEST_LOG_BYTES = histogram("paw_request_log_bytes", "Log bytes scanned per request", SIZE_BUCKETS)
+REQUEST_LOG_LINES = histogram("paw_request_log_lines", "Log lines parsed per request", COUNT_BUCKETS)
+REQUEST_DB_CHECKOUTS = histogram("paw_request_db_checkouts", "Pooled connections checked out per request",
+                                 COUNT_BUCKETS)
+REQUEST_DB_HOLD_SECONDS = histogram("paw_request_db_hold_seconds",
+                                    "Time per request spent holding a pooled connection")
+LOG_BYTES = counter("paw_log_bytes_total", "Log bytes scanned")
+LOG_LINES = counter("paw_log_lines_total", "Log lines parsed")
+ACL_RELOADS = counter("paw_acl_reloads_total", "ACL file reloads from disk")
+SQUID_APPLY_SECONDS = histogram("paw_squid_apply_seconds", "Duration of squid apply jobs")
+UDP_DATAGRAMS = counter("paw_udp_datagrams_total", "Log datagrams received over UDP")
+UDP_BATCHES = counter("paw_udp_batches_total", "Batches of UDP log lines indexed")
@@ -0,0 +1,182 @@
+"""Public suffix lookups from a precompiled, memory-mapped table.
+
+publicsuffix2 builds a nested-dict trie from its bundled list in every
+process on first use. Instead the list is compiled once into a hash table
+on disk (rebuilt when the bundled list changes) and mmap'd, so gunicorn
+workers share the pages and pay nothing at import. get_sld() follows
+publicsuffix2.get_sld() exactly, including its quirks: every node on a rule's
+path counts as a suffix, and an unknown TLD yields just the last label.
+
+Table layout: MAGIC, uint32 entry and slot counts, uint64 source mtime_ns
+and size, then an open-addressing hash table of uint32 slots (crc32 of the
+node path, linear probing; each slot holds a data offset + 1, 0 = empty),
+then "<node path>\\t<negate flag>\\n" records.
+"""
+import importlib.util
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+MAGIC = b"PAWPSL2\n"
+HEADER = struct.Struct("<IIQQ")
+SLOT = struct.Struct("<I")
+
+_lock = threading.Lock()
+_table = None
+_cache_file = None
+
+
+def bundled_list_path():
+    # find_spec locates the package without importing (and parsing) it.
+    spec = importlib.util.find_spec("publicsuffix2")
+    if spec is None or not spec.submodule_search_locations:
+        raise ImportError("publicsuffix2 is required for its bundled public_suffix_list.dat")
+    return os.path.join(list(spec.submodule_search_locations)[0], "public_suffix_list.dat")
+
+
+def _source_signature(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def compile_list(source, target):
+    nodes = {}
+    with open(source, encoding="utf8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("//"):
+                continue
+            rule = line.encode("idna").decode().split()[0].lstrip(".")
+            negate = rule.startswith("!")
+            labels = rule.lstrip("!").split(".")
+            # Intermediate nodes exist with flag 0, as in publicsuffix2's trie.
+            for i in range(len(labels) - 1, 0, -1):
+                nodes.setdefault(".".join(labels[i:]), 0)
+            nodes[".".join(labels)] = 1 if negate else 0
+    slots = 1
+    while slots < len(nodes) * 2:
+        slots *= 2
+    table = [0] * slots
+    data = bytearray()
+    for path, negate in nodes.items():
+        key = path.encode()
+        i = zlib.crc32(key) & (slots - 1)
+        while table[i]:
+            i = (i + 1) & (slots - 1)
+        table[i] = len(data) + 1
+        data += key + b"\t" + str(negate).encode() + b"\n"
+    mtime_ns, size = _source_signature(source)
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    tmp = f"{target}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(len(nodes), slots, mtime_ns, size))
+        f.write(struct.pack(f"<{slots}I", *table))
+        f.write(data)
+    os.replace(tmp, target)
+
+
+class SuffixTable:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a compiled public suffix table")
+        self.count, self.slots, self.mtime_ns, self.size = HEADER.unpack_from(self.mm, len(MAGIC))
+        self.table_start = len(MAGIC) + HEADER.size
+        self.data_start = self.table_start + self.slots * SLOT.size
+        self.mask = self.slots - 1
+
+    def flag(self, path):
+        """Negate flag (0 or 1) of the node at path, or None if absent."""
+        key = path.encode() + b"\t"
+        mm = self.mm
+        i = zlib.crc32(key[:-1]) & self.mask
+        while True:
+            offset = SLOT.unpack_from(mm, self.table_start + i * SLOT.size)[0]
+            if not offset:
+                return None
+            start = self.data_start + offset - 1
+            if mm[start:start + len(key)] == key:
+                return mm[start + len(key)] - 48
+            i = (i + 1) & self.mask
+
+    def get_tld(self, parts):
+        hits = [None] * len(parts)
+        if self.flag(parts[-1]) is None:
+            return None
+        # Breadth-first over ("*", label) branches; the last write at each
+        # depth wins, matching publicsuffix2's depth-first recursion.
+        hits[-1] = 0
+        frontier = [""]
+        for depth in range(1, len(parts) + 1):
+            found = []
+            for node in frontier:
+                for name in ("*", parts[-depth]):
+                    path = f"{name}.{node}" if node else name
+                    flag = self.flag(path)
+                    if flag is not None:
+                        hits[-depth] = flag
+                        found.append(path)
+            if not found:
+                break
+            frontier = found
+        for i, flag in enumerate(hits):
+            if flag == 0:
+                return ".".join(parts[i:])
+        return None
+
+
+def configure(cache_file):
+    """Set where the compiled table is kept (e.g. the app's data dir)."""
+    global _cache_file, _table
+    with _lock:
+        _cache_file = cache_file
+        _table = None
+
+
+def load_table():
+    global _table
+    with _lock:
+        if _table is not None:
+            return _table
+        source = bundled_list_path()
+        target = _cache_file or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "psl.table")
+        table = None
+        if os.path.exists(target):
+            try:
+                table = SuffixTable(target)
+                if (table.mtime_ns, table.size) != _source_signature(source):
+                    table = None
+            except (OSError, ValueError, struct.error):
+                table = None
+        if table is None:
+            try:
+                compile_list(source, target)
+            except OSError:
+                # Read-only install dir (e.g. the CLI run as another user).
+                target = os.path.join(tempfile.gettempdir(), f"paw_psl_{os.getuid()}.table")
+                compile_list(source, target)
+            table = SuffixTable(target)
+        _table = table
+        return _table
+
+
+def get_sld(domain):
+    if not domain:
+        return None
+    parts = domain.lower().strip(".").split(".")
+    tld = load_table().get_tld(parts)
+    tld_parts = 0 if tld is None else tld.count(".") + 1
+    if len(parts) <= tld_parts:
+        return tld
+    return ".".join(parts[-(tld_parts + 1):])
+
+
+def parent_entry(domain):
+    """Squid ACL entry for a domain's registrable parent, e.g. ".example.co.uk"."""
+    parent = get_sld(domain)
+    return f".{parent}" if parent and parent != domain else f".{domain}"
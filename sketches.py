@@ -0,0 +1,198 @@
+"""Fixed-memory approximate counters used by log_index.SketchAggregate.
+
+HyperLogLog estimates how many distinct items were seen (about 1% error
+with the default 16K registers). CountMinSketch estimates per-item counts
+(never under, over by at most a small fraction of the total). TopK keeps
+the k most frequent items exactly from the moment they are admitted; new
+items are admitted through the count-min estimate, so the long tail of
+one-off URLs never churns the table.
+"""
+import array
+import base64
+import hashlib
+import heapq
+import math
+from collections import Counter
+
+HLL_PRECISION = 14
+CMS_WIDTH = 1 << 15
+CMS_DEPTH = 4
+TOP_K = 1000
+
+
+def hash64(item):
+    return int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add_hash(self, h):
+        index = h & (len(self.registers) - 1)
+        rank = 64 - self.precision - (h >> self.precision).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, item):
+        self.add_hash(hash64(item))
+
+    def count(self):
+        m = len(self.registers)
+        histogram = Counter(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(n * 2.0 ** -r for r, n in histogram.items())
+        zeros = histogram.get(0, 0)
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting).
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def copy(self):
+        copy = HyperLogLog(self.precision)
+        copy.registers[:] = self.registers
+        return copy
+
+    def to_dict(self):
+        return {"precision": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        hll = cls(data["precision"])
+        hll.registers[:] = base64.b64decode(data["registers"])
+        return hll
+
+
+class CountMinSketch:
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = array.array("Q", bytes(8 * width * depth))
+
+    def _cells(self, h):
+        # Double hashing: row i uses h1 + i * h2.
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [i * self.width + (h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add_hash(self, h, n=1):
+        """Count n more and return the new estimate."""
+        table = self.table
+        estimate = None
+        for cell in self._cells(h):
+            table[cell] += n
+            if estimate is None or table[cell] < estimate:
+                estimate = table[cell]
+        return estimate
+
+    def estimate_hash(self, h):
+        return min(self.table[cell] for cell in self._cells(h))
+
+    def raise_to(self, h, n):
+        """Make sure the estimate for h is at least n (conservative update)."""
+        table = self.table
+        for cell in self._cells(h):
+            if table[cell] < n:
+                table[cell] = n
+
+    def merge(self, other):
+        self.table = array.array("Q", map(sum, zip(self.table, other.table)))
+
+    def copy(self):
+        copy = CountMinSketch(self.width, self.depth)
+        copy.table = array.array("Q", self.table)
+        return copy
+
+    def to_dict(self):
+        return {"width": self.width, "depth": self.depth, "table": base64.b64encode(self.table.tobytes()).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["width"], data["depth"])
+        sketch.table = array.array("Q", base64.b64decode(data["table"]))
+        return sketch
+
+
+class TopK:
+    """The k items with the highest counts, each with a caller-owned data object."""
+
+    def __init__(self, k=TOP_K, sketch=None):
+        self.k = k
+        self.sketch = sketch or CountMinSketch()
+        self.counts = {}
+        self.data = {}
+        # (count, item) pairs; counts only grow, so an entry is a lower bound
+        # and is refreshed lazily when it reaches the top.
+        self.heap = []
+        # Called with each evicted item, e.g. to drop it from an index.
+        self.on_evict = None
+
+    def _smallest(self):
+        heap = self.heap
+        while True:
+            count, item = heap[0]
+            actual = self.counts.get(item)
+            if actual is None:
+                heapq.heappop(heap)
+            elif actual != count:
+                heapq.heapreplace(heap, (actual, item))
+            else:
+                return count, item
+
+    def add(self, item, factory, n=1, h=None):
+        """Count n more of item; returns its data object if it is tracked."""
+        count = self.counts.get(item)
+        if count is not None:
+            self.counts[item] = count + n
+            return self.data[item]
+        estimate = self.sketch.add_hash(hash64(item) if h is None else h, n)
+        if len(self.counts) >= self.k:
+            smallest, victim = self._smallest()
+            if estimate <= smallest:
+                return None
+            heapq.heappop(self.heap)
+            self._evict(victim)
+        self.counts[item] = estimate
+        heapq.heappush(self.heap, (estimate, item))
+        data = self.data[item] = factory()
+        return data
+
+    def _evict(self, item):
+        # Fold the exact count back into the sketch so a returning item
+        # resumes from where it left off.
+        self.sketch.raise_to(hash64(item), self.counts.pop(item))
+        del self.data[item]
+        if self.on_evict is not None:
+            self.on_evict(item)
+
+    def estimate(self, item):
+        count = self.counts.get(item)
+        return count if count is not None else self.sketch.estimate_hash(hash64(item))
+
+    def copy(self, copy_data):
+        copy = TopK(self.k, self.sketch.copy())
+        copy.counts = dict(self.counts)
+        copy.data = {item: copy_data(data) for item, data in self.data.items()}
+        copy.heap = list(self.heap)
+        return copy
+
+    def to_dict(self, encode):
+        return {"k": self.k, "sketch": self.sketch.to_dict(),
+                "items": [[item, count, encode(self.data[item])] for item, count in self.counts.items()]}
+
+    @classmethod
+    def from_dict(cls, data, decode):
+        top = cls(data["k"], CountMinSketch.from_dict(data["sketch"]))
+        for item, count, encoded in data["items"]:
+            top.counts[item] = count
+            top.data[item] = decode(encoded)
+        top.heap = [(count, item) for item, count in top.counts.items()]
+        heapq.heapify(top.heap)
+        return top
+
+    def items(self):
+        """(item, count, data), most frequent first."""
+        return sorted(((item, count, self.data[item]) for item, count in self.counts.items()),
+                      key=lambda entry: entry[1], reverse=True)
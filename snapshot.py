@@ -0,0 +1,89 @@
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL_SECONDS = 5.0
+
+
+class SnapshotBuilder:
+    """Keeps a versioned, prebuilt result up to date in a background thread.
+
+    version_fn() must be cheap (stat calls, offsets); build_fn() is only run
+    when the version changes. Request handlers call get() and never wait for
+    a rebuild unless no snapshot exists yet.
+    """
+
+    def __init__(self, build_fn, version_fn, interval=SNAPSHOT_INTERVAL_SECONDS, name="snapshot"):
+        self.build_fn = build_fn
+        self.version_fn = version_fn
+        self.interval = interval
+        self.name = name
+        self.lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._version = None
+        self._data = None
+        self._etag = None
+        self._thread = None
+        self._wake = threading.Event()
+
+    def _rebuild(self, force=False):
+        with self._build_lock:
+            version = self.version_fn()
+            if not force and version == self._version:
+                return
+            data = self.build_fn()
+            etag = hashlib.sha1(repr(version).encode()).hexdigest()[:20]
+            with self.lock:
+                self._version = version
+                self._data = data
+                self._etag = etag
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self._rebuild()
+            except Exception:
+                logger.exception("Rebuilding %s failed", self.name)
+
+    def _ensure_thread(self):
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-builder", daemon=True)
+            self._thread.start()
+            return True
+
+    def invalidate(self):
+        """Ask the background thread to check for changes now."""
+        self._wake.set()
+
+    def start(self):
+        """Start the background thread unless it is already running."""
+        if self._ensure_thread():
+            self._wake.set()
+
+    def get(self, wait=True):
+        """Return (etag, data) for the latest snapshot.
+
+        With wait=False nothing is built in the caller's thread: (None, None)
+        is returned until the background thread has the first snapshot.
+        """
+        with self.lock:
+            ready = self._data is not None
+        if not ready:
+            if not wait:
+                self.start()
+                return None, None
+            self._rebuild(force=True)
+        self._ensure_thread()
+        with self.lock:
+            return self._etag, self._data
+
+
+def minute_bucket():
+    return int(time.time() // 60)
@@ -0,0 +1,125 @@
+import os
+import shlex
+import subprocess
+import threading
+import time
+import uuid
+
+import metrics
+
+SQUID_CMD = shlex.split(os.environ.get("PAW_SQUID_CMD", "sudo squid"))
+SQUID_RESTART_CMD = shlex.split(os.environ.get("PAW_SQUID_RESTART_CMD", "sudo systemctl restart squid"))
+APPLY_DEBOUNCE_SECONDS = float(os.environ.get("PAW_APPLY_DEBOUNCE", 2.0))
+APPLY_TIMEOUT_SECONDS = 60
+MAX_JOBS_KEPT = 50
+
+
+class ApplyError(Exception):
+    pass
+
+
+class ApplyQueue:
+    """Coalescing background applier for squid configuration changes.
+
+    Each request either joins the pending job or starts a new one. The worker
+    waits until no new request has arrived for the debounce interval, checks
+    the config with `squid -k parse` and then runs `squid -k reconfigure`
+    (or a full restart if any coalesced request asked for one), so a burst of
+    ACL edits costs a single reload.
+    """
+
+    def __init__(self, debounce=APPLY_DEBOUNCE_SECONDS, squid_cmd=None, restart_cmd=None):
+        self.debounce = debounce
+        self.squid_cmd = squid_cmd or SQUID_CMD
+        self.restart_cmd = restart_cmd or SQUID_RESTART_CMD
+        self.cond = threading.Condition()
+        self.jobs = {}
+        self._pending = None
+        self._last_request = 0.0
+        self._worker = None
+
+    def request_apply(self, reason="acl", restart=False):
+        with self.cond:
+            job = self._pending
+            if job is None:
+                job = {
+                    "id": uuid.uuid4().hex,
+                    "state": "queued",
+                    "message": "Waiting to apply changes",
+                    "reasons": [],
+                    "restart": False,
+                    "created": time.time(),
+                    "finished": None,
+                    "duration": None,
+                }
+                self._pending = job
+                self.jobs[job["id"]] = job
+                self._trim_jobs()
+            job["reasons"].append(reason)
+            job["restart"] = job["restart"] or restart
+            self._last_request = time.monotonic()
+            self._ensure_worker()
+            self.cond.notify_all()
+            return job["id"]
+
+    def get_job(self, job_id):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _trim_jobs(self):
+        finished = [j for j in self.jobs.values() if j["state"] in ("done", "failed")]
+        finished.sort(key=lambda j: j["created"])
+        for job in finished[:max(0, len(self.jobs) - MAX_JOBS_KEPT)]:
+            del self.jobs[job["id"]]
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="squid-apply", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self._pending is None:
+                    self.cond.wait()
+                while True:
+                    remaining = self._last_request + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                job = self._pending
+                self._pending = None
+                job["state"] = "running"
+                job["message"] = "Applying changes"
+            started = time.monotonic()
+            try:
+                message = self._apply(job["restart"])
+                state = "done"
+            except ApplyError as e:
+                message = str(e)
+                state = "failed"
+            with self.cond:
+                job["state"] = state
+                job["message"] = message
+                job["finished"] = time.time()
+                job["duration"] = time.monotonic() - started
+            metrics.SQUID_APPLY_SECONDS.observe(job["duration"], result=state)
+
+    def _call(self, cmd):
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=APPLY_TIMEOUT_SECONDS)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise ApplyError(f"{' '.join(cmd)} failed: {e}")
+        if result.returncode != 0:
+            output = (result.stderr or result.stdout).strip()
+            raise ApplyError(f"{' '.join(cmd)} failed: {output or 'exit code ' + str(result.returncode)}")
+        return result
+
+    def _apply(self, restart):
+        self._call(self.squid_cmd + ["-k", "parse"])
+        if restart:
+            self._call(self.restart_cmd)
+            return "Squid restarted!"
+        self._call(self.squid_cmd + ["-k", "reconfigure"])
+        return "Squid reconfigured!"
@@ -1,30 +1,27 @@
 function updateBulkButtons() {
-    const checkboxes = document.querySelectorAll('input[name="selected_domains"]:checked');
-    const allowBtn = document.getElementById('allowSelected');
-    const removeBtn = document.getElementById('removeSelected');
-    const enabled = checkboxes.length > 0;
-    if (allowBtn) allowBtn.disabled = !enabled;
-    if (removeBtn) removeBtn.disabled = !enabled;
+    const enabled = document.querySelector('input[name="selected_domains"]:checked') !== null;
+    const buttons = document.querySelectorAll('.bulk-action, #allowSelected, #removeSelected');
+    for (let i = 0; i < buttons.length; i++) {
+        buttons[i].disabled = !enabled;
+    }
 }
 
 function toggleAll(source) {
     const checkboxes = document.querySelectorAll('input[name="selected_domains"]');
-    for(let i=0; i<checkboxes.length; i++) {
+    for (let i = 0; i < checkboxes.length; i++) {
         checkboxes[i].checked = source.checked;
     }
     updateBulkButtons();
 }
 
-document.addEventListener('DOMContentLoaded', function() {
-    const checkboxes = document.querySelectorAll('input[name="selected_domains"]');
-    for(let i=0; i<checkboxes.length; i++) {
-        checkboxes[i].addEventListener('change', updateBulkButtons);
-    }
-    const selectAll = document.getElementById('selectAll');
-    if (selectAll) {
-        selectAll.addEventListener('change', function() {
-            toggleAll(this);
-        });
+// One delegated listener instead of one per checkbox, so rows added later
+// by domain_table.js are covered too.
+document.addEventListener('change', function(event) {
+    if (event.target.id === 'selectAll') {
+        toggleAll(event.target);
+    } else if (event.target.name === 'selected_domains') {
+        updateBulkButtons();
     }
-    updateBulkButtons();
 });
+
+document.addEventListener('DOMContentLoaded', updateBulkButtons);
@@ -0,0 +1,94 @@
+// Fetches domain rows page by page from /api/domains/<kind> and renders
+// them from a <template>, so page size stays flat however long the list is.
+function initDomainTable(table) {
+    const api = table.dataset.api;
+    const tbody = table.querySelector('tbody');
+    const rowTemplate = document.getElementById(table.dataset.rowTemplate);
+    const moreBtn = document.getElementById(table.dataset.more);
+    const search = document.getElementById(table.dataset.search);
+    const sort = document.getElementById(table.dataset.sort);
+    const status = document.getElementById(table.dataset.status);
+    const filters = document.querySelectorAll('[data-filter-for="' + table.id + '"]');
+    let cursor = null;
+    let generation = 0;
+    let searchTimer = null;
+
+    function renderRow(item) {
+        const row = rowTemplate.content.firstElementChild.cloneNode(true);
+        row.querySelectorAll('[data-field]').forEach(function(el) {
+            el.textContent = item[el.dataset.field] !== undefined ? item[el.dataset.field] : '';
+        });
+        row.querySelectorAll('[data-value]').forEach(function(el) {
+            el.value = item[el.dataset.value] !== undefined ? item[el.dataset.value] : '';
+        });
+        return row;
+    }
+
+    function waitForJob(statusUrl, current, done) {
+        fetch(statusUrl)
+            .then(r => r.json())
+            .then(job => {
+                if (current !== generation) return;
+                if (job.state === 'failed') {
+                    if (status) status.textContent = 'Failed: ' + (job.message || 'unknown error');
+                } else if (job.state === 'done' || !job.state) {
+                    done();
+                } else {
+                    setTimeout(() => waitForJob(statusUrl, current, done), 500);
+                }
+            });
+    }
+
+    function load(reset) {
+        if (reset) {
+            cursor = null;
+            generation++;
+            tbody.innerHTML = '';
+        }
+        const current = generation;
+        const params = new URLSearchParams();
+        if (search && search.value) params.set('q', search.value);
+        if (sort) params.set('sort', sort.value);
+        filters.forEach(function(el) {
+            if (el.value) params.set(el.name, el.value);
+        });
+        if (cursor) params.set('cursor', cursor);
+        fetch(api + '?' + params.toString())
+            .then(r => r.json().then(data => ({status: r.status, data: data})))
+            .then(({status: code, data}) => {
+                if (current !== generation) return;
+                if (code === 202) {
+                    // Rows are being built in the background; wait and retry.
+                    if (status) status.textContent = 'Reading the squid log...';
+                    waitForJob(data.status_url, current, () => load(false));
+                    return;
+                }
+                const fragment = document.createDocumentFragment();
+                data.items.forEach(item => fragment.appendChild(renderRow(item)));
+                tbody.appendChild(fragment);
+                cursor = data.next_cursor;
+                if (moreBtn) moreBtn.style.display = cursor ? '' : 'none';
+                if (status) {
+                    status.textContent = data.total
+                        ? 'Showing ' + tbody.rows.length + ' of ' + data.total
+                        : 'No domains.';
+                }
+                if (typeof updateBulkButtons === 'function') updateBulkButtons();
+            });
+    }
+
+    if (moreBtn) moreBtn.addEventListener('click', () => load(false));
+    if (sort) sort.addEventListener('change', () => load(true));
+    filters.forEach(el => el.addEventListener('change', () => load(true)));
+    if (search) {
+        search.addEventListener('input', function() {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => load(true), 250);
+        });
+    }
+    load(true);
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('table[data-api]').forEach(initDomainTable);
+});
@@ -0,0 +1,31 @@
+// Subscribes to /events and prepends new-domain / denied notices to the
+// element with id "live-feed", keeping only the most recent entries.
+document.addEventListener('DOMContentLoaded', function() {
+    const feed = document.getElementById('live-feed');
+    if (!feed || !window.EventSource) return;
+    const maxItems = parseInt(feed.dataset.max || '20', 10);
+    const source = new EventSource(feed.dataset.src);
+
+    function add(text, cls) {
+        const item = document.createElement('li');
+        item.className = cls;
+        item.textContent = new Date().toLocaleTimeString() + '  ' + text;
+        feed.insertBefore(item, feed.firstChild);
+        while (feed.children.length > maxItems) {
+            feed.removeChild(feed.lastChild);
+        }
+    }
+
+    source.addEventListener('new_domain', function(e) {
+        const data = JSON.parse(e.data);
+        add('New domain ' + data.domain + ' from ' + data.client, 'live-new');
+    });
+    source.addEventListener('denied', function(e) {
+        const data = JSON.parse(e.data);
+        add('Denied ' + data.domain + ' x' + data.count + ' (' + data.clients.join(', ') + ')', 'live-denied');
+    });
+    source.addEventListener('dropped', function(e) {
+        const data = JSON.parse(e.data);
+        add(data.count + ' events skipped; reload for the full picture', 'live-dropped');
+    });
+});
@@ -0,0 +1,23 @@
+function drawSparkline(svg, values) {
+    const width = svg.width.baseVal.value;
+    const height = svg.height.baseVal.value;
+    const max = Math.max.apply(null, values.concat([1]));
+    const step = values.length > 1 ? width / (values.length - 1) : width;
+    const points = values.map(function(v, i) {
+        return (i * step).toFixed(1) + ',' + (height - 1 - (v / max) * (height - 2)).toFixed(1);
+    });
+    const line = document.createElementNS('http://www.w3.org/2000/svg', 'polyline');
+    line.setAttribute('points', points.join(' '));
+    line.setAttribute('fill', 'none');
+    line.setAttribute('stroke', '#2563eb');
+    line.setAttribute('stroke-width', '1.5');
+    svg.appendChild(line);
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('svg.sparkline[data-src]').forEach(function(svg) {
+        fetch(svg.dataset.src)
+            .then(r => r.json())
+            .then(data => drawSparkline(svg, data.hits));
+    });
+});
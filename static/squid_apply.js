@@ -0,0 +1,26 @@
+function pollApplyStatus(statusUrl, spinner) {
+    fetch(statusUrl)
+        .then(r => r.json())
+        .then(job => {
+            if (job.state === "done" || job.state === "failed" || !job.state) {
+                spinner.innerHTML = job.message || "Done";
+                setTimeout(() => location.reload(), 2000);
+            } else {
+                setTimeout(() => pollApplyStatus(statusUrl, spinner), 1000);
+            }
+        });
+}
+
+function applySquidChanges(restartUrl, button, spinner) {
+    button.style.display = "none";
+    spinner.style.display = "inline-block";
+    fetch(restartUrl, {method: "POST"})
+        .then(r => r.json())
+        .then(data => {
+            if (data.status_url) {
+                pollApplyStatus(data.status_url, spinner);
+            } else {
+                spinner.innerHTML = data.message || "Failed to apply changes";
+            }
+        });
+}
@@ -0,0 +1,72 @@
+"""DomainTrie against squid dstdomain semantics, and collapse-on-write."""
+from acl_store import AclFile, apply_batch
+from domain_trie import DomainTrie
+
+
+def test_wildcard_matches_domain_and_subdomains():
+    trie = DomainTrie([".example.com"])
+    assert trie.match("example.com") == ".example.com"
+    assert trie.match("a.b.example.com") == ".example.com"
+    assert "notexample.com" not in trie
+    assert "com" not in trie
+
+
+def test_exact_matches_only_itself():
+    trie = DomainTrie(["host.example.com"])
+    assert "host.example.com" in trie
+    assert "a.host.example.com" not in trie
+    assert "example.com" not in trie
+
+
+def test_match_is_case_insensitive_and_returns_broadest():
+    trie = DomainTrie([".Example.com", ".api.example.com", "x.api.example.com"])
+    assert trie.match("X.API.example.COM") == ".Example.com"
+
+
+def test_remove():
+    trie = DomainTrie([".example.com", "example.com"])
+    trie.remove(".example.com")
+    assert "a.example.com" not in trie
+    assert trie.match("example.com") == "example.com"
+    trie.remove("missing.org")
+
+
+def test_covering_and_covered():
+    trie = DomainTrie([".com", ".example.com", "a.example.com", ".b.example.com", "other.net"])
+    assert trie.covering(".b.example.com") == [".com", ".example.com"]
+    assert sorted(trie.covered(".example.com")) == [".b.example.com", "a.example.com"]
+    assert trie.covered("a.example.com") == []
+
+
+def test_redundant():
+    trie = DomainTrie([".example.com", "example.com", "a.example.com", ".b.example.com", "other.net"])
+    assert sorted(trie.redundant()) == [
+        (".b.example.com", ".example.com"),
+        ("a.example.com", ".example.com"),
+        ("example.com", ".example.com"),
+    ]
+
+
+def test_collapse_only_drops_what_the_batch_covers(tmp_path):
+    path = tmp_path / "allow.acl"
+    path.write_text("a.example.com\n.x.example.com\n.net2.org\nfoo.net2.org\n")
+    acl = AclFile(str(path))
+    dropped = []
+    changed = apply_batch([(acl, "add", ".example.com")], collapse=(acl,), dropped=dropped)
+    assert changed == 3
+    assert sorted((n, b) for _, n, b in dropped) == [(".x.example.com", ".example.com"),
+                                                     ("a.example.com", ".example.com")]
+    # The admin's own overlap is left for the lint action.
+    assert sorted(acl.entries()) == [".example.com", ".net2.org", "foo.net2.org"]
+    assert path.read_text() == ".example.com\nfoo.net2.org\n.net2.org\n"
+
+    assert apply_batch([], collapse=(acl,)) == 1
+    assert sorted(acl.entries()) == [".example.com", ".net2.org"]
+
+
+def test_no_collapse_keeps_covered_entries(tmp_path):
+    path = tmp_path / "allow.acl"
+    path.write_text("a.example.com\n")
+    acl = AclFile(str(path))
+    assert apply_batch([(acl, "add", ".example.com")]) == 1
+    assert sorted(acl.entries()) == [".example.com", "a.example.com"]
@@ -0,0 +1,118 @@
+"""JobRegistry.cached: join running work, serve stale results while rebuilding."""
+import threading
+import time
+
+import pytest
+
+from jobs import JobRegistry
+
+
+def wait_done(jobs, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get(job_id)
+        if job is not None and job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.005)
+    pytest.fail(f"job {job_id} did not finish")
+
+
+class Source:
+    """A computation gated by an event, over a version that can move on."""
+
+    def __init__(self):
+        self.version = 0
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def build(self):
+        self.gate.wait(10)
+        self.calls += 1
+        return f"result@{self.version}"
+
+    def current(self):
+        return self.version
+
+
+@pytest.fixture
+def jobs():
+    registry = JobRegistry(workers=2, nice=0)
+    yield registry
+    registry.executor.shutdown(wait=True)
+
+
+def test_first_call_starts_a_job_and_concurrent_calls_join_it(jobs):
+    source = Source()
+    source.gate.clear()
+    ready, first = jobs.cached("scan", "k", source.build)
+    assert not ready
+    ready, second = jobs.cached("scan", "k", source.build)
+    assert not ready and second == first
+    source.gate.set()
+    wait_done(jobs, first)
+    assert jobs.cached("scan", "k", source.build) == (True, "result@0")
+    assert source.calls == 1
+
+
+def test_result_without_version_is_reused(jobs):
+    source = Source()
+    wait_done(jobs, jobs.cached("scan", "k", source.build)[1])
+    source.version = 1
+    assert jobs.cached("scan", "k", source.build) == (True, "result@0")
+    assert source.calls == 1
+
+
+def test_stale_result_is_served_while_rebuilding(jobs):
+    source = Source()
+    wait_done(jobs, jobs.cached("scan", "k", source.build, version=source.current)[1])
+    source.version = 1
+    source.gate.clear()
+    assert jobs.cached("scan", "k", source.build, version=source.current) == (True, "result@0")
+    # A second stale read joins the rebuild rather than starting another.
+    assert jobs.cached("scan", "k", source.build, version=source.current) == (True, "result@0")
+    rebuild = jobs._by_key["k"]
+    source.gate.set()
+    wait_done(jobs, rebuild)
+    assert jobs.cached("scan", "k", source.build, version=source.current) == (True, "result@1")
+    assert source.calls == 2
+    # The superseded result was dropped.
+    assert len(jobs.jobs) == 1
+
+
+def test_failed_rebuild_keeps_the_last_result(jobs):
+    state = {"fail": False, "version": 0}
+
+    def build():
+        if state["fail"]:
+            raise RuntimeError("log vanished")
+        return "good"
+
+    version = lambda: state["version"]
+    wait_done(jobs, jobs.cached("scan", "k", build, version=version)[1])
+    state.update(fail=True, version=1)
+    assert jobs.cached("scan", "k", build, version=version) == (True, "good")
+    failed = wait_done(jobs, jobs._by_key["k"])
+    assert failed["state"] == "failed" and failed["message"] == "log vanished"
+    assert jobs.cached("scan", "k", build, version=version)[0]
+
+
+def test_keys_are_independent(jobs):
+    a, b = Source(), Source()
+    b.version = 7
+    wait_done(jobs, jobs.cached("scan", "a", a.build)[1])
+    wait_done(jobs, jobs.cached("scan", "b", b.build)[1])
+    assert jobs.cached("scan", "a", a.build) == (True, "result@0")
+    assert jobs.cached("scan", "b", b.build) == (True, "result@7")
+
+
+def test_results_are_trimmed_to_the_size_budget():
+    jobs = JobRegistry(workers=1, max_result_items=10, nice=0)
+    try:
+        for key in ("a", "b", "c"):
+            wait_done(jobs, jobs.cached("scan", key, lambda: list(range(6)))[1])
+        # Only the newest fits the budget; older results are rebuilt on demand.
+        assert jobs.cached("scan", "c", list) == (True, list(range(6)))
+        assert jobs.cached("scan", "a", list)[0] is False
+    finally:
+        jobs.executor.shutdown(wait=True)
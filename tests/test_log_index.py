@@ -0,0 +1,114 @@
+"""LogIndex.refresh: incremental reads, rotation, truncation and restarts."""
+import os
+
+from log_index import LogIndex
+
+
+def line(host, ts=1700000000.0, ip="10.0.0.1"):
+    return f"{ts:.3f} 5 {ip} TCP_TUNNEL/200 100 CONNECT {host}:443 - HIER_DIRECT/1.2.3.4 -\n"
+
+
+def append(path, *lines):
+    with open(path, "a") as f:
+        f.writelines(lines)
+
+
+def hits(index):
+    return {domain: stats["hits"] for domain, stats in index.aggregate.domains.items()}
+
+
+def test_reads_only_what_was_appended(tmp_path):
+    log = tmp_path / "access.log"
+    append(log, line("a.example.com"), line("b.example.com"))
+    index = LogIndex(str(log))
+    batches = []
+    index.listeners.append(batches.append)
+    assert index.refresh() == 2
+    assert index.refresh() == 0
+    append(log, line("a.example.com"))
+    assert index.refresh() == 1
+    assert hits(index) == {"a.example.com": 2, "b.example.com": 1}
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert index.position() == (os.stat(log).st_ino, os.path.getsize(log))
+
+
+def test_partial_line_waits_for_its_newline(tmp_path):
+    log = tmp_path / "access.log"
+    full = line("a.example.com")
+    append(log, full, full[:20])
+    index = LogIndex(str(log))
+    assert index.refresh() == 1
+    assert index.position()[1] == len(full)
+    append(log, full[20:])
+    assert index.refresh() == 1
+    assert hits(index) == {"a.example.com": 2}
+
+
+def test_rotation_drains_the_old_file_then_starts_over(tmp_path):
+    log = tmp_path / "access.log"
+    append(log, line("a.example.com"))
+    index = LogIndex(str(log))
+    index.refresh()
+    old = index.aggregate
+    # Written after the last refresh, then rotated away.
+    append(log, line("late.example.com"))
+    log.rename(str(log) + ".1")
+    append(log, line("new.example.com"))
+    seen = []
+    index.listeners.append(lambda batch: seen.extend(parts[6] for parts in batch))
+    assert index.refresh() == 2
+    assert seen == ["late.example.com:443", "new.example.com:443"]
+    # The aggregate covers the current file only.
+    assert index.aggregate is not old
+    assert hits(index) == {"new.example.com": 1}
+    assert index.position() == (os.stat(log).st_ino, os.path.getsize(log))
+
+
+def test_truncation_rereads_from_the_start(tmp_path):
+    log = tmp_path / "access.log"
+    append(log, line("a.example.com"), line("a.example.com"), line("b.example.com"))
+    index = LogIndex(str(log))
+    index.refresh()
+    old = index.aggregate
+    with open(log, "w") as f:
+        f.write(line("c.example.com"))
+    assert index.refresh() == 1
+    assert index.aggregate is not old
+    assert hits(index) == {"c.example.com": 1}
+
+
+def test_restart_resumes_from_saved_offset(tmp_path):
+    log, state = tmp_path / "access.log", tmp_path / "index.json"
+    append(log, line("a.example.com"))
+    index = LogIndex(str(log), state_file=str(state))
+    index.refresh()
+    index.save()
+    append(log, line("a.example.com"), line("b.example.com"))
+
+    restarted = LogIndex(str(log), state_file=str(state))
+    assert restarted.refresh() == 2
+    assert hits(restarted) == {"a.example.com": 2, "b.example.com": 1}
+
+
+def test_restart_after_rotation_finds_the_rotated_tail(tmp_path):
+    log, state = tmp_path / "access.log", tmp_path / "index.json"
+    append(log, line("a.example.com"))
+    index = LogIndex(str(log), state_file=str(state))
+    index.refresh()
+    index.save()
+    append(log, line("tail.example.com"))
+    log.rename(str(log) + ".1")
+    append(log, line("new.example.com"))
+
+    restarted = LogIndex(str(log), state_file=str(state))
+    seen = []
+    restarted.listeners.append(lambda batch: seen.extend(parts[6] for parts in batch))
+    assert restarted.refresh() == 2
+    assert seen == ["tail.example.com:443", "new.example.com:443"]
+    assert hits(restarted) == {"new.example.com": 1}
+
+
+def test_missing_log_is_not_an_error(tmp_path):
+    index = LogIndex(str(tmp_path / "absent.log"))
+    assert index.refresh() == 0
+    assert index.position() == (None, 0)
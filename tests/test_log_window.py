@@ -0,0 +1,77 @@
+"""Time windows: the binary search over the log and the walk back through rotations."""
+import gzip
+import mmap
+
+import pytest
+
+from log_window import scan_window, window_start_offset
+
+NOW = 1700100000.0
+
+
+def line(ts, host="a.example.com"):
+    return f"{ts:.3f} 5 10.0.0.1 TCP_TUNNEL/200 100 CONNECT {host}:443 - HIER_DIRECT/1.2.3.4 -\n"
+
+
+def search(tmp_path, data, since):
+    path = tmp_path / "log"
+    path.write_bytes(data)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return window_start_offset(mm, since)
+
+
+def linear(data, since):
+    offset = 0
+    for raw in data.splitlines(keepends=True):
+        try:
+            if float(raw.split(b" ", 1)[0]) >= since:
+                return offset
+        except ValueError:
+            pass
+        offset += len(raw)
+    return len(data)
+
+
+@pytest.mark.parametrize("since", [0, 1000, 1000.5, 1001, 1050, 1099, 1100, 5000])
+def test_search_agrees_with_linear_scan(tmp_path, since):
+    # Repeated timestamps and lines of different lengths.
+    data = "".join(line(1000 + i // 3, host="h" * (i % 17 + 1) + ".com") for i in range(300)).encode()
+    assert search(tmp_path, data, since) == linear(data, since)
+
+
+def test_search_skips_unparseable_lines(tmp_path):
+    data = (line(1000) + "garbage without a timestamp\n" + line(1001) + line(1002)).encode()
+    assert search(tmp_path, data, 1001) == data.index(line(1001).encode())
+
+
+def test_search_single_line(tmp_path):
+    data = line(1000).encode()
+    assert search(tmp_path, data, 999) == 0
+    assert search(tmp_path, data, 1001) == len(data)
+
+
+def test_scan_window_current_file_only(tmp_path):
+    log = tmp_path / "access.log"
+    log.write_text("".join(line(NOW - 3600 + i * 60) for i in range(61)))
+    (tmp_path / "access.log.1").write_text(line(NOW - 7200, host="old.example.com"))
+    aggregate = scan_window(str(log), 15 * 60, now=NOW)
+    assert aggregate.domains["a.example.com"]["hits"] == 16
+    assert "old.example.com" not in aggregate.domains
+
+
+def test_scan_window_walks_back_through_rotations(tmp_path):
+    log = tmp_path / "access.log"
+    log.write_text(line(NOW - 60, host="new.example.com"))
+    (tmp_path / "access.log.1").write_text(line(NOW - 1800, host="mid.example.com") +
+                                           line(NOW - 600, host="mid.example.com"))
+    with gzip.open(tmp_path / "access.log.2.gz", "wt") as f:
+        f.write(line(NOW - 7200, host="old.example.com") + line(NOW - 2400, host="gz.example.com"))
+    (tmp_path / "access.log.3").write_text(line(NOW - 10, host="never.example.com"))
+
+    aggregate = scan_window(str(log), 3600, now=NOW)
+    assert {d: s["hits"] for d, s in aggregate.domains.items()} == {
+        "new.example.com": 1, "mid.example.com": 2, "gz.example.com": 1}
+
+    aggregate = scan_window(str(log), 900, now=NOW)
+    assert {d: s["hits"] for d, s in aggregate.domains.items()} == {
+        "new.example.com": 1, "mid.example.com": 1}
@@ -0,0 +1,130 @@
+"""Accuracy and bookkeeping of the sketch-mode counters."""
+import json
+import random
+
+from log_index import LogAggregate, SketchAggregate, aggregate_from_dict
+from sketches import CountMinSketch, HyperLogLog, TopK, hash64
+
+
+def line(host, ip="10.0.0.1", code="TCP_TUNNEL", ts=1700000000.0):
+    return f"{ts:.3f} 5 {ip} {code}/200 100 CONNECT {host}:443 - HIER_DIRECT/1.2.3.4 -".split()
+
+
+def test_hll_estimates_within_a_few_percent():
+    hll = HyperLogLog()
+    for i in range(50000):
+        hll.add(f"host{i}.example.com")
+        hll.add(f"host{i}.example.com")
+    assert abs(hll.count() - 50000) / 50000 < 0.03
+    small = HyperLogLog()
+    for i in range(100):
+        small.add(str(i))
+    assert abs(small.count() - 100) <= 2
+
+
+def test_hll_merge_and_round_trip():
+    a, b = HyperLogLog(), HyperLogLog()
+    for i in range(3000):
+        (a if i % 2 else b).add(str(i))
+    a.merge(b)
+    assert abs(a.count() - 3000) / 3000 < 0.03
+    assert HyperLogLog.from_dict(json.loads(json.dumps(a.to_dict()))).count() == a.count()
+
+
+def test_count_min_never_underestimates():
+    rng = random.Random(1)
+    cms = CountMinSketch(width=256, depth=4)
+    truth = {}
+    for _ in range(20000):
+        item = f"d{int(rng.paretovariate(1.2))}"
+        truth[item] = truth.get(item, 0) + 1
+        cms.add_hash(hash64(item))
+    total = sum(truth.values())
+    for item, n in truth.items():
+        estimate = cms.estimate_hash(hash64(item))
+        assert n <= estimate <= n + total * 0.05
+
+
+def test_count_min_raise_to_is_conservative():
+    cms = CountMinSketch(width=64, depth=2)
+    h = hash64("a")
+    cms.add_hash(h, 3)
+    cms.raise_to(h, 10)
+    assert cms.estimate_hash(h) == 10
+    cms.raise_to(h, 5)
+    assert cms.estimate_hash(h) == 10
+
+
+def test_topk_keeps_heavy_hitters_and_ignores_the_tail():
+    top = TopK(k=10)
+    evicted = []
+    top.on_evict = evicted.append
+    for i in range(10):
+        for _ in range(100 + i):
+            top.add(f"heavy{i}", dict)
+    for i in range(1000):
+        assert top.add(f"tail{i}", dict) is None
+    assert sorted(top.counts) == sorted(f"heavy{i}" for i in range(10))
+    assert [item for item, _, _ in top.items()][:2] == ["heavy9", "heavy8"]
+    assert top.counts["heavy0"] == 100
+    assert evicted == []
+
+
+def test_topk_evicts_into_the_sketch():
+    top = TopK(k=2)
+    evicted = []
+    top.on_evict = evicted.append
+    top.add("a", dict, n=5)
+    top.add("b", dict, n=3)
+    top.add("c", dict, n=10)
+    assert evicted == ["b"]
+    assert set(top.counts) == {"a", "c"}
+    # The evicted item's count lives on in the sketch.
+    assert top.estimate("b") >= 3
+
+
+def test_sketch_aggregate_matches_exact_for_few_domains():
+    exact, sketch = LogAggregate(), SketchAggregate(top_k=50)
+    for i in range(500):
+        parts = line(f"h{i % 20}.example.com", ip=f"10.0.0.{i % 5}",
+                     code="TCP_DENIED" if i % 4 == 0 else "TCP_TUNNEL", ts=1700000000.0 + i)
+        exact.add_parts(parts)
+        sketch.add_parts(parts)
+    assert set(sketch.domains) == set(exact.domains)
+    for domain, stats in exact.domains.items():
+        assert sketch.domains[domain]["hits"] == stats["hits"]
+        assert sketch.domains[domain]["codes"] == stats["codes"]
+        assert sketch.domains[domain]["last_seen"] == stats["last_seen"]
+    for ip, stats in exact.clients.items():
+        assert sketch.clients[ip].hits == stats.hits
+        assert sketch.clients[ip].denied == stats.denied
+    assert sketch.distinct_domains() == 20
+    assert sketch.distinct_clients() == 5
+
+
+def test_listed_domains_stay_exact_under_pressure():
+    sketch = SketchAggregate(top_k=5)
+    sketch.is_listed = lambda domain: domain.endswith(".corp.example")
+    for i in range(2000):
+        sketch.add_parts(line(f"noise{i}.example.com"))
+        if i % 10 == 0:
+            sketch.add_parts(line("app.corp.example"))
+    assert sketch.domains["app.corp.example"]["hits"] == 200
+    assert "app.corp.example" in sketch.exact
+    assert len(sketch.top_domains.counts) <= 5
+    assert abs(sketch.distinct_domains() - 2001) / 2001 < 0.03
+
+
+def test_from_exact_and_round_trip():
+    exact = LogAggregate()
+    for i in range(300):
+        exact.add_parts(line(f"h{i % 30}.example.com", ip=f"10.0.1.{i % 3}"))
+    sketch = SketchAggregate.from_exact(exact, top_k=100)
+    assert {d: s["hits"] for d, s in sketch.domains.items()} == {d: s["hits"] for d, s in exact.domains.items()}
+    restored = aggregate_from_dict(json.loads(json.dumps(sketch.to_dict())))
+    assert restored.sketch
+    assert {d: s["hits"] for d, s in restored.domains.items()} == {d: s["hits"] for d, s in sketch.domains.items()}
+    assert restored.distinct_domains() == sketch.distinct_domains()
+    copy = sketch.copy()
+    copy.add_parts(line("h0.example.com"))
+    assert copy.domains["h0.example.com"]["hits"] == sketch.domains["h0.example.com"]["hits"] + 1
@@ -0,0 +1,77 @@
+"""ApplyQueue against a fake squid pointed to by PAW_SQUID_CMD."""
+import importlib
+import os
+import stat
+import time
+
+import pytest
+
+import squid_apply
+
+FAKE_SQUID = """#!/bin/sh
+echo "$*" >> "{calls}"
+if [ "$2" = "{fail}" ]; then
+    echo "FATAL: Bungled squid.conf line 42" >&2
+    exit 1
+fi
+"""
+
+
+def fake_queue(tmp_path, monkeypatch, fail=""):
+    calls = tmp_path / "calls"
+    script = tmp_path / "squid"
+    script.write_text(FAKE_SQUID.format(calls=calls, fail=fail))
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PAW_SQUID_CMD", str(script))
+    monkeypatch.setenv("PAW_SQUID_RESTART_CMD", f"{script} restart")
+    module = importlib.reload(squid_apply)
+    return module.ApplyQueue(debounce=0.05), calls
+
+
+def wait_job(queue, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get_job(job_id)
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    pytest.fail(f"apply job still {job['state']}")
+
+
+def read_calls(calls):
+    return calls.read_text().splitlines() if os.path.exists(calls) else []
+
+
+@pytest.fixture(autouse=True)
+def restore_module():
+    yield
+    importlib.reload(squid_apply)
+
+
+def test_reconfigure_after_successful_parse(tmp_path, monkeypatch):
+    queue, calls = fake_queue(tmp_path, monkeypatch)
+    first = queue.request_apply(reason="allow")
+    second = queue.request_apply(reason="hide")
+    assert first == second
+    job = wait_job(queue, first)
+    assert job["state"] == "done"
+    assert job["message"] == "Squid reconfigured!"
+    assert job["reasons"] == ["allow", "hide"]
+    assert read_calls(calls) == ["-k parse", "-k reconfigure"]
+
+
+def test_failed_parse_leaves_squid_untouched(tmp_path, monkeypatch):
+    queue, calls = fake_queue(tmp_path, monkeypatch, fail="parse")
+    job = wait_job(queue, queue.request_apply(restart=True))
+    assert job["state"] == "failed"
+    assert "Bungled squid.conf line 42" in job["message"]
+    # Squid keeps running its previous configuration: no reconfigure or restart.
+    assert read_calls(calls) == ["-k parse"]
+
+
+def test_failed_reconfigure_is_reported(tmp_path, monkeypatch):
+    queue, calls = fake_queue(tmp_path, monkeypatch, fail="reconfigure")
+    job = wait_job(queue, queue.request_apply())
+    assert job["state"] == "failed"
+    assert "-k reconfigure failed" in job["message"]
+    assert read_calls(calls) == ["-k parse", "-k reconfigure"]
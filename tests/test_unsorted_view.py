@@ -0,0 +1,145 @@
+"""UnsortedView kept incrementally, checked against a rebuild from scratch."""
+import pytest
+
+from acl_store import AclFile, apply_batch
+from log_index import LogIndex
+from unsorted_view import UnsortedView
+
+# Small stand-in for the public suffix list: "co.uk" is a suffix.
+SUFFIXES = {"com", "net", "uk", "co.uk"}
+
+
+def parent_fn(domain):
+    labels = domain.lstrip(".").lower().split(".")
+    for i in range(len(labels)):
+        if ".".join(labels[i:]) in SUFFIXES:
+            return "." + ".".join(labels[max(i - 1, 0):])
+    return "." + ".".join(labels[-2:])
+
+
+def line(host, code="TCP_TUNNEL", ts=1700000000.0):
+    return f"{ts:.3f} 5 10.0.0.1 {code}/200 100 CONNECT {host}:443 - HIER_DIRECT/1.2.3.4 -\n"
+
+
+class Setup:
+    def __init__(self, tmp_path, state_file=None):
+        self.log = tmp_path / "access.log"
+        self.log.touch()
+        self.allow = AclFile(str(tmp_path / "allow.acl"))
+        self.hidden = AclFile(str(tmp_path / "hidden.txt"))
+        self.index = LogIndex(str(self.log))
+        self.view = UnsortedView(self.index, self.allow, self.hidden, parent_fn, state_file)
+
+    def write(self, *lines):
+        with open(self.log, "a") as f:
+            f.writelines(lines)
+        self.index.refresh()
+
+    def expected(self):
+        view = UnsortedView(self.index, self.allow, self.hidden, parent_fn)
+        with self.index.lock:
+            view._rebuild()
+        return view
+
+    def check(self):
+        with self.view._current():
+            view = self.view
+        fresh = self.expected()
+        assert view.rows == fresh.rows
+        assert view.keys == fresh.keys
+        assert view.children == fresh.children
+        assert view.parents == fresh.parents
+
+
+@pytest.fixture
+def setup(tmp_path):
+    s = Setup(tmp_path)
+    s.view.attach()
+    return s
+
+
+def test_inserts_and_counts(setup):
+    setup.write(line("b.example.com"), line("A.example.com", code="TCP_DENIED"), line("x.net"))
+    setup.check()
+    setup.write(line("b.example.com", ts=1700000100.0), line("zz.co.uk"), line("a.example.com"))
+    setup.check()
+    rows, total, _ = setup.view.page()
+    assert total == 5
+    assert [r["domain"] for r in rows] == ["A.example.com", "a.example.com", "b.example.com", "x.net", "zz.co.uk"]
+    assert rows[2]["hits"] == 2 and rows[2]["last_seen"] == 1700000100.0
+    assert rows[0]["denied"] == 1
+
+
+def test_exact_entry_removes_every_spelling(setup):
+    setup.write(line("Host.example.com"), line("host.example.com"), line("other.example.com"))
+    apply_batch([(setup.allow, "add", "host.example.com")])
+    setup.check()
+    assert [r["domain"] for r in setup.view.rows_list()] == ["other.example.com"]
+
+
+def test_subdomain_entry_removes_covered_hosts(setup):
+    setup.write(line("Api.Svc.example.com"), line("svc.example.com"), line("web.example.com"),
+                line("notsvc.example.com"))
+    apply_batch([(setup.hidden, "add", ".SVC.example.com")])
+    setup.check()
+    assert sorted(r["domain"] for r in setup.view.rows_list()) == ["notsvc.example.com", "web.example.com"]
+
+
+def test_entry_above_registrable_removes_whole_parents(setup):
+    setup.write(line("a.foo.co.uk"), line("B.bar.co.uk"), line("co.uk"), line("x.example.com"))
+    apply_batch([(setup.allow, "add", ".co.uk")])
+    setup.check()
+    assert [r["domain"] for r in setup.view.rows_list()] == ["x.example.com"]
+    assert setup.view.parents == ["com.example"]
+
+
+def test_removed_entry_rebuilds(setup):
+    apply_batch([(setup.allow, "add", ".example.com")])
+    setup.write(line("a.example.com"), line("x.net"))
+    setup.check()
+    assert [r["domain"] for r in setup.view.rows_list()] == ["x.net"]
+    apply_batch([(setup.allow, "remove", ".example.com")])
+    setup.check()
+    assert [r["domain"] for r in setup.view.rows_list()] == ["a.example.com", "x.net"]
+
+
+def test_rotation_rebuilds(setup):
+    setup.write(line("a.example.com"))
+    setup.log.rename(str(setup.log) + ".1")
+    setup.write(line("b.example.com"))
+    setup.check()
+    assert [r["domain"] for r in setup.view.rows_list()] == ["b.example.com"]
+
+
+def test_load_state_replays_gap(tmp_path):
+    state = tmp_path / "view.json"
+    first = Setup(tmp_path, str(state))
+    first.view.attach()
+    first.write(line("a.example.com"), line("b.net"))
+    first.view._dirty = True
+    first.view.save()
+    first.write(line("c.example.com"), line("a.example.com", code="TCP_DENIED"))
+
+    # Same index position, a view restored from the older state file.
+    second = UnsortedView(first.index, first.allow, first.hidden, parent_fn, str(state))
+    with first.index.lock:
+        assert second._load_state()
+    first.view = second
+    first.check()
+    assert second._position == first.index.position()
+    assert second.rows["a.example.com"][1:3] == [2, 1]
+
+
+def test_load_state_rejects_other_log(tmp_path):
+    state = tmp_path / "view.json"
+    first = Setup(tmp_path, str(state))
+    first.view.attach()
+    first.write(line("a.example.com"))
+    first.view._dirty = True
+    first.view.save()
+    first.log.rename(str(first.log) + ".1")
+    first.write(line("b.example.com"))
+
+    second = UnsortedView(first.index, first.allow, first.hidden, parent_fn, str(state))
+    with first.index.lock:
+        assert not second._load_state()
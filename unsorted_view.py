@@ -0,0 +1,336 @@
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from log_index import clean_domain
+
+VIEW_SAVE_INTERVAL_SECONDS = 30.0
+
+# Row fields: [parent, hits, denied, last_seen]
+PARENT, HITS, DENIED, LAST_SEEN = range(4)
+
+
+def _reversed_name(domain):
+    return ".".join(reversed(domain.lstrip(".").split(".")))
+
+
+class UnsortedView:
+    """The live unsorted-domain list, maintained instead of recomputed.
+
+    Fed by the LogIndex listener hook: hosts not on either list are inserted
+    in name order as they first appear, and counts are bumped in place. A
+    parent -> hosts index (plus the parents sorted by reversed labels) lets
+    a new allow/hidden entry drop exactly the hosts it covers; a removed
+    entry, a rotated log or sketch mode trigger a rebuild from the
+    aggregate. Shares the index lock, so batches and reads never interleave.
+    The view is persisted with the log position it reflects and, after a
+    restart, catches up by re-reading just the lines appended since.
+    """
+
+    def __init__(self, log_index, allow_acl, hidden_acl, parent_fn, state_file=None):
+        self.log_index = log_index
+        self.lock = log_index.lock
+        self.allow_acl = allow_acl
+        self.hidden_acl = hidden_acl
+        self.parent_fn = parent_fn
+        self.state_file = state_file
+        self._clear()
+        # The aggregate the view was built from; a new one means rebuild.
+        self._source = None
+        self._position = (None, 0)
+        self._acl_versions = None
+        self._allow = frozenset()
+        self._hidden = frozenset()
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def _clear(self):
+        # host -> row; None while the index is in sketch mode.
+        self.rows = {}
+        # (host.lower(), host), sorted; matches the API's name sort and cursors.
+        self.keys = []
+        self.children = {}
+        self.parents = []
+        # Hosts seen that are on a list, so they skip the trie lookup.
+        self.listed = set()
+        # Inserted since the last _merge_pending.
+        self._new_keys = []
+        self._new_parents = []
+
+    # --- structure ---
+
+    def _insert(self, domain, row):
+        # keys/parents are merged in once per batch by _merge_pending: an
+        # insort per new host would shift the whole list each time.
+        self.rows[domain] = row
+        self._new_keys.append((domain.lower(), domain))
+        hosts = self.children.get(row[PARENT])
+        if hosts is None:
+            hosts = self.children[row[PARENT]] = set()
+            self._new_parents.append(_reversed_name(row[PARENT]))
+        hosts.add(domain)
+
+    def _merge_pending(self):
+        # Two sorted runs: sort() merges them in one linear pass.
+        if self._new_keys:
+            self.keys += sorted(self._new_keys)
+            self.keys.sort()
+            self._new_keys = []
+        if self._new_parents:
+            self.parents += sorted(self._new_parents)
+            self.parents.sort()
+            self._new_parents = []
+
+    def _remove_hosts(self, domains):
+        """Drop hosts from every structure, rebuilding keys/parents once."""
+        if not domains:
+            return
+        gone_parents = set()
+        for domain in domains:
+            row = self.rows.pop(domain)
+            hosts = self.children[row[PARENT]]
+            hosts.discard(domain)
+            if not hosts:
+                del self.children[row[PARENT]]
+                gone_parents.add(_reversed_name(row[PARENT]))
+        if len(domains) == 1:
+            key = (domains[0].lower(), domains[0])
+            del self.keys[bisect.bisect_left(self.keys, key)]
+        else:
+            doomed = set(domains)
+            self.keys = [key for key in self.keys if key[1] not in doomed]
+        if gone_parents:
+            self.parents = [name for name in self.parents if name not in gone_parents]
+
+    def _remove_covered(self, entry):
+        # Hosts are kept as logged; match them case-insensitively, as the trie does.
+        base = entry.lstrip(".").lower()
+        if not entry.startswith("."):
+            start = end = bisect.bisect_left(self.keys, (base,))
+            while end < len(self.keys) and self.keys[end][0] == base:
+                end += 1
+            self._remove_hosts([host for _, host in self.keys[start:end]])
+            return
+        parent = self.parent_fn(base).lstrip(".")
+        if base.endswith("." + parent):
+            # Below its registrable parent: only that parent's hosts can match.
+            hosts = self.children.get("." + parent, ())
+            self._remove_hosts([h for h in hosts if h.lower() == base or h.lower().endswith("." + base)])
+            return
+        # At or above the registrable level (e.g. ".co.uk"): every parent
+        # at or under it goes, found as a range of the reversed names.
+        name = _reversed_name(base)
+        doomed = [name] if "." + base in self.children else []
+        start = bisect.bisect_left(self.parents, name + ".")
+        for candidate in self.parents[start:]:
+            if not candidate.startswith(name + "."):
+                break
+            doomed.append(candidate)
+        self._remove_hosts([host for candidate in doomed
+                            for host in self.children["." + _reversed_name(candidate)]])
+
+    def _rebuild(self):
+        aggregate = self.log_index.aggregate
+        self._source = aggregate
+        self._position = self.log_index.position()
+        self._dirty = True
+        self._clear()
+        self._snapshot_acl()
+        if aggregate.sketch:
+            self.rows = None
+            return
+        allow_trie, hidden_trie = self.allow_acl.trie(), self.hidden_acl.trie()
+        for domain, stats in aggregate.domains.items():
+            if domain in allow_trie or domain in hidden_trie:
+                self.listed.add(domain)
+                continue
+            self.rows[domain] = [self.parent_fn(domain), stats["hits"],
+                                 stats["codes"].get("TCP_DENIED", 0), stats["last_seen"]]
+        self._index_rows()
+
+    def _index_rows(self):
+        self.keys = sorted((d.lower(), d) for d in self.rows)
+        for domain, row in self.rows.items():
+            self.children.setdefault(row[PARENT], set()).add(domain)
+        self.parents = sorted(_reversed_name(p) for p in self.children)
+
+    # --- keeping current ---
+
+    def _snapshot_acl(self):
+        self._acl_versions = (self.allow_acl.version(), self.hidden_acl.version())
+        self._allow = frozenset(self.allow_acl.entries())
+        self._hidden = frozenset(self.hidden_acl.entries())
+
+    def _sync_acl(self):
+        if (self.allow_acl.version(), self.hidden_acl.version()) == self._acl_versions:
+            return
+        allow, hidden = frozenset(self.allow_acl.entries()), frozenset(self.hidden_acl.entries())
+        if self._allow - allow or self._hidden - hidden:
+            # Hosts may be unsorted again; only the aggregate knows which.
+            self._rebuild()
+            return
+        if self.rows is not None:
+            for entry in (allow - self._allow) | (hidden - self._hidden):
+                self._remove_covered(entry)
+        self._snapshot_acl()
+        self._dirty = True
+
+    def _apply(self, parts, allow_trie, hidden_trie):
+        if len(parts) <= 6:
+            return
+        domain = clean_domain(parts[6])
+        if not domain:
+            return
+        row = self.rows.get(domain)
+        if row is None:
+            if domain in self.listed:
+                return
+            if domain in allow_trie or domain in hidden_trie:
+                self.listed.add(domain)
+                return
+            row = [self.parent_fn(domain), 0, 0, None]
+            self._insert(domain, row)
+        row[HITS] += 1
+        if parts[3].split('/')[0] == "TCP_DENIED":
+            row[DENIED] += 1
+        try:
+            ts = float(parts[0])
+        except ValueError:
+            return
+        if row[LAST_SEEN] is None or ts > row[LAST_SEEN]:
+            row[LAST_SEEN] = ts
+
+    def _on_batch(self, batch):
+        # Called by LogIndex with its lock held, after the aggregate saw batch.
+        if self.log_index.aggregate is not self._source:
+            # Rotated, truncated or switched to sketch mode.
+            self._rebuild()
+            return
+        self._sync_acl()
+        if self.rows is not None:
+            allow_trie, hidden_trie = self.allow_acl.trie(), self.hidden_acl.trie()
+            for parts in batch:
+                self._apply(parts, allow_trie, hidden_trie)
+            self._merge_pending()
+        self._position = self.log_index.position()
+        self._dirty = True
+
+    @contextmanager
+    def _current(self):
+        # No refresh here: readers see what the background indexing has
+        # reached, as the job-cached views do.
+        with self.lock:
+            if self.log_index.aggregate is not self._source:
+                self._rebuild()
+            self._sync_acl()
+            yield
+        if self._dirty and time.monotonic() - self._last_save >= VIEW_SAVE_INTERVAL_SECONDS:
+            self.save()
+
+    # --- persistence ---
+
+    def _load_state(self):
+        if not self.state_file or self.log_index.aggregate.sketch:
+            return False
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        inode, offset = state.get("position", (None, 0))
+        current_inode, current_offset = self.log_index.position()
+        if inode is None or inode != current_inode or offset > current_offset:
+            return False
+        self.rows = {domain: row for domain, *row in state["rows"]}
+        self._index_rows()
+        self._allow = frozenset(state["allow"])
+        self._hidden = frozenset(state["hidden"])
+        self._acl_versions = None
+        self._source = self.log_index.aggregate
+        if offset < current_offset:
+            # Saved a little behind the index: replay the gap from the log.
+            allow_trie, hidden_trie = self.allow_acl.trie(), self.hidden_acl.trie()
+            try:
+                with open(self.log_index.path, "rb") as f:
+                    f.seek(offset)
+                    for raw in f:
+                        if offset + len(raw) > current_offset:
+                            break
+                        offset += len(raw)
+                        self._apply(raw.decode("utf-8", "replace").split(), allow_trie, hidden_trie)
+            except OSError:
+                return False
+            self._merge_pending()
+            if offset != current_offset:
+                return False
+        self._position = (inode, current_offset)
+        return True
+
+    def save(self):
+        with self.lock:
+            if not self.state_file or not self._dirty or self.rows is None or self._position[0] is None:
+                return
+            state = {
+                "position": list(self._position),
+                "allow": sorted(self._allow),
+                "hidden": sorted(self._hidden),
+                "rows": [[domain] + self.rows[domain] for _, domain in self.keys],
+            }
+            self._dirty = False
+            self._last_save = time.monotonic()
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        tmp = f"{self.state_file}.tmp{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp, self.state_file)
+
+    # --- public ---
+
+    def attach(self):
+        """Load or build the view and start following the index."""
+        with self.lock:
+            if not self._load_state():
+                self._rebuild()
+            self.log_index.listeners.append(self._on_batch)
+
+    def enabled(self):
+        """Whether the view can answer: exact mode, and the log scanned at least once."""
+        return not self.log_index.aggregate.sketch and self._scanned()
+
+    def _scanned(self):
+        # Before the first scan an empty view would read as "nothing unsorted".
+        return self.log_index.position()[0] is not None
+
+    def count(self):
+        if not self._scanned():
+            return None
+        with self._current():
+            return None if self.rows is None else len(self.rows)
+
+    def rows_list(self):
+        """All rows as dicts (raw last_seen), in name order; None in sketch mode
+        or before the log has been scanned."""
+        if not self._scanned():
+            return None
+        with self._current():
+            if self.rows is None:
+                return None
+            return [self._row(domain) for _, domain in self.keys]
+
+    def page(self, after=None, limit=100):
+        """(rows, total, last key) of the name-ordered rows after the key `after`."""
+        if not self._scanned():
+            return None
+        with self._current():
+            if self.rows is None:
+                return None
+            start = bisect.bisect_right(self.keys, tuple(after)) if after else 0
+            keys = self.keys[start:start + limit]
+            more = keys and start + limit < len(self.keys)
+            return [self._row(domain) for _, domain in keys], len(self.keys), keys[-1] if more else None
+
+    def _row(self, domain):
+        parent, hits, denied, last_seen = self.rows[domain]
+        return {"domain": domain, "parent": parent, "hits": hits, "denied": denied, "last_seen": last_seen}
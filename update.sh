@@ -8,7 +8,7 @@ VENV_DIR="$APP_DIR/venv"
 SERVICE_NAME="squid_allow_app"
 
 ALLOW_LIST_SRC="$APP_DIR/allowed_paw.acl"
-ALLOW_LIST_DEST="/etc/squid/allowed_paw.acl"
+ALLOW_LIST_DEST="/etc/squid/paw/allowed_paw.acl"
 SQUID_ERR_SRC="$APP_DIR/ERR_ACCESS_DENIED.html"
 SQUID_ERR_DEST="/usr/share/squid/errors/English/ERR_ACCESS_DENIED"
 
@@ -32,8 +32,10 @@ pip install --upgrade pip
 pip install -r requirements.txt
 
 echo "Updating allow list..."
+sudo install -d -o "$APP_USER" -g proxy -m 2775 "$(dirname "$ALLOW_LIST_DEST")"
 sudo cp "$ALLOW_LIST_SRC" "$ALLOW_LIST_DEST"
-sudo chmod 666 "$ALLOW_LIST_DEST"
+sudo chown "$APP_USER":proxy "$ALLOW_LIST_DEST"
+sudo chmod 664 "$ALLOW_LIST_DEST"
 
 echo "Deploying Squid custom error page..."
 sudo cp "$SQUID_ERR_SRC" "$SQUID_ERR_DEST"